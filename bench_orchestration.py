@@ -0,0 +1,524 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020. Hitachi Vantara Corporation. All rights reserved.
+#
+# The copyright to the computer software herein is the property of
+# Hitachi Vantara Corporation. The software may be used and/or copied only
+# with the written permission of Hitachi Vantara Corporation or in accordance
+# with the terms and conditions stipulated in the agreement/contract
+# under which the software has been supplied.
+
+# Time a whole collection run against local stand-in nodes.
+#
+#   python3 bench_orchestration.py -n 1,2,4,8 -t 10 -o /var/tmp/bench_orchestration -r results.json
+#
+# Every stand-in node is an ssh server on its own local port. Commands run
+# in their own mount and uts namespaces, with the hostname of the node
+# and its own directory bound over NODE_RUN_PATH. Stub sar, iostat,
+# docker and kubectl binaries come first in PATH, sar and iostat print the
+# columns of the sysstat release given with -s. The sftp root of a node
+# is its directory. collect_result then drives the nodes the way its main
+# does, and the wall time of each phase is reported for every node count:
+#
+#   init    nodes_init of an inventory of the nodes, batch discovery
+#   launch  nodes_launch, deploy in parallel and start together, and
+#           measure_clock_offsets
+#   watch   watch_nodes, wait for every collector and fetch its results
+#   parse   parsing_result of all hosts
+#
+# Needs root for unshare. The output of the controller and the nodes goes
+# to bench_<nodes>.log in the work directory.
+
+import contextlib
+import datetime
+import getopt
+import json
+import os
+import platform
+import posixpath
+import shutil
+import socket
+import stat
+import subprocess
+import sys
+import threading
+import time
+import paramiko
+import yaml
+import collect_result
+import parse_output
+
+HOST_PREFIX = "bench-node-"
+DEPLOY_FILES = ["collect_node.py", "timeseries.py", "couch_latency.py", "kube_metrics.py"]
+PHASES = ["init", "launch", "watch", "parse"]
+INVENTORY_FILE = "inventory.yml"
+# wraps every command of a node: private mounts, node hostname, node directory as NODE_RUN_PATH
+NODE_WRAPPER = ('mount --make-rprivate / && mkdir -p "$NODE_ROOT$NODE_RUN_PATH" "$NODE_RUN_PATH" && '
+                'mount --bind "$NODE_ROOT$NODE_RUN_PATH" "$NODE_RUN_PATH" && hostname "$NODE_NAME" && '
+                'cd / && exec sh -c "$NODE_CMD"')
+STUB_SCRIPT = '''#!%(python)s
+# stand-in of sar, iostat, docker and kubectl, picked by the name it runs as
+import json, os, random, sys, time
+
+name = os.path.basename(sys.argv[0])
+args = sys.argv[1:]
+devices = ["sd%%s" %% chr(ord("a") + d) for d in range(int(os.environ.get("STUB_DEVICES", "4")))]
+containers = int(os.environ.get("STUB_CONTAINERS", "4"))
+# sysstat 11 renamed the sar -d and iostat -x columns
+sysstat = int(os.environ.get("STUB_SYSSTAT", "12"))
+
+
+def values(count):
+    return " ".join("%%9.2f" %% (random.random() * 100) for _ in range(count))
+
+
+def sample(interval, count, each):
+    try:
+        for i in range(count):
+            time.sleep(interval)
+            each()
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+
+
+if name == "sar":
+    interval, count = int(args[-2]), int(args[-1])
+    if "-n" in args:
+        header, rows = ["IFACE", "rxpck/s", "txpck/s", "rxkB/s", "txkB/s", "rxcmp/s", "txcmp/s", "rxmcst/s"], \\
+            ["lo", "eth0", "cali0a1b2c3d4e5"]
+    elif "-dp" in args and sysstat >= 11:
+        header, rows = ["DEV", "tps", "rkB/s", "wkB/s", "dkB/s", "areq-sz", "aqu-sz", "await", "%%util"], \\
+            devices
+    elif "-dp" in args:
+        header, rows = ["DEV", "tps", "rd_sec/s", "wr_sec/s", "avgrq-sz", "avgqu-sz", "await", "svctm", "%%util"], \\
+            devices
+    elif "-r" in args:
+        header, rows = ["kbmemfree", "kbmemused", "%%memused", "kbbuffers", "kbcached", "kbcommit", "%%commit",
+                        "kbactive", "kbinact", "kbdirty"], [None]
+    elif "-b" in args:
+        header, rows = ["tps", "rtps", "wtps", "bread/s", "bwrtn/s"], [None]
+    else:
+        header, rows = ["CPU", "%%user", "%%nice", "%%system", "%%iowait", "%%steal", "%%idle"], ["all"]
+    width = len(header) - (0 if rows == [None] else 1)
+    print("Linux 5.14.0 (%%s) \\t%%s \\t_x86_64_\\t(4 CPU)\\n" %% (os.uname()[1], time.strftime("%%m/%%d/%%Y")))
+    print(time.strftime("%%H:%%M:%%S") + " " + " ".join(header))
+
+    def each():
+        for row in rows:
+            print(time.strftime("%%H:%%M:%%S") + " " + (row + " " if row else "") + values(width))
+
+    sample(interval, count, each)
+    print()
+    if rows != [None] and len(rows) > 1:
+        print("Average: " + " ".join(header))
+    for row in rows:
+        print("Average: " + (row + " " if row else "") + values(width))
+elif name == "iostat":
+    interval, count = int(args[-2]), int(args[-1])
+    print("Linux 5.14.0 (%%s) \\t%%s \\t_x86_64_\\t(4 CPU)\\n" %% (os.uname()[1], time.strftime("%%m/%%d/%%Y")))
+
+    def each():
+        if "t" in args[0]:
+            print(time.strftime("%%Y-%%m-%%dT%%H:%%M:%%S%%z"))
+        if sysstat >= 11:
+            print("Device            r/s     rMB/s   rrqm/s  %%rrqm r_await rareq-sz     w/s     wMB/s   wrqm/s  "
+                  "%%wrqm w_await wareq-sz  aqu-sz  %%util")
+            width = 14
+        else:
+            print("Device:         rrqm/s   wrqm/s     r/s     w/s    rMB/s    wMB/s "
+                  "avgrq-sz avgqu-sz   await r_await w_await  svctm  %%util")
+            width = 13
+        for dev in devices:
+            print("%%-12s " %% dev + values(width))
+        print()
+
+    sample(interval, count, each)
+elif name == "docker" and args[:1] == ["ps"]:
+    print("CONTAINER ID   IMAGE     COMMAND   CREATED   STATUS    PORTS     NAMES")
+    for c in range(containers):
+        print("%%012x   minio:latest   \\"minio\\"   1 hour ago   Up 1 hour      k8s_minio_minio-%%d_hiota" %% (c, c))
+elif name == "docker" and args[:1] == ["stats"]:
+    for cid in args[4:]:
+        print(json.dumps({"ID": cid, "Name": "k8s_minio_minio-%%d_hiota" %% int(cid, 16),
+                          "CPUPerc": "%%.2f%%%%" %% (random.random() * 400), "MemPerc": "%%.2f%%%%" %% (random.random() * 100),
+                          "MemUsage": "1.5GiB / 16GiB", "BlockIO": "%%dMB / %%dMB" %% (random.randint(1, 900),
+                                                                                     random.randint(1, 900))}))
+elif name == "kubectl":
+    print("NAME                                CPU(cores)   MEMORY(bytes)")
+    for p in range(containers):
+        print("hiota-pod-%%04d-7f9c8d   %%dm   %%dMi" %% (p, random.randint(1, 4000), random.randint(10, 16000)))
+'''
+
+
+class NodeSFTPHandle(paramiko.SFTPHandle):
+
+    def stat(self):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def chattr(self, attr):
+        try:
+            paramiko.SFTPServer.set_file_attr(self.filename, attr)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+
+class NodeSFTP(paramiko.SFTPServerInterface):
+    """sftp of a stand-in node, chrooted to its directory."""
+
+    def __init__(self, server, *args, **kwargs):
+        paramiko.SFTPServerInterface.__init__(self, server, *args, **kwargs)
+        self.root = server.node.root
+
+    def canonicalize(self, path):
+        return posixpath.normpath(posixpath.join("/", path))
+
+    def real(self, path):
+        return os.path.join(self.root, self.canonicalize(path).lstrip("/"))
+
+    def list_folder(self, path):
+        path = self.real(path)
+        try:
+            return [paramiko.SFTPAttributes.from_stat(os.lstat(os.path.join(path, name)), name)
+                    for name in os.listdir(path)]
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self.real(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def lstat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.lstat(self.real(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def open(self, path, flags, attr):
+        path = self.real(path)
+        try:
+            mode = getattr(attr, "st_mode", None)
+            fd = os.open(path, flags, stat.S_IMODE(mode) if mode else 0o666)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        if flags & os.O_WRONLY:
+            fstr = "ab" if flags & os.O_APPEND else "wb"
+        elif flags & os.O_RDWR:
+            fstr = "a+b" if flags & os.O_APPEND else "r+b"
+        else:
+            fstr = "rb"
+        handle = NodeSFTPHandle(flags)
+        handle.filename = path
+        handle.readfile = handle.writefile = os.fdopen(fd, fstr)
+        return handle
+
+    def remove(self, path):
+        try:
+            os.remove(self.real(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def rename(self, oldpath, newpath):
+        try:
+            os.rename(self.real(oldpath), self.real(newpath))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def mkdir(self, path, attr):
+        try:
+            os.mkdir(self.real(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def rmdir(self, path):
+        try:
+            os.rmdir(self.real(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def chattr(self, path, attr):
+        try:
+            paramiko.SFTPServer.set_file_attr(self.real(path), attr)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+
+class NodeServer(paramiko.ServerInterface):
+    """ssh session of a stand-in node, any key of the controller is let in."""
+
+    def __init__(self, node):
+        self.node = node
+
+    def get_allowed_auths(self, username):
+        return "publickey"
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED_ERROR
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=self.node.exec_command, args=(channel, command.decode()), daemon=True).start()
+        return True
+
+
+class StandInNode(object):
+    """one local ssh server acting as a node of its own name and directory."""
+
+    def __init__(self, name, root, host_key, env):
+        self.name = name
+        self.root = root
+        self.host_key = host_key
+        self.env = env
+        self.transports = []
+        self.procs = []
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(16)
+        self.address = "127.0.0.1:%d" % self.sock.getsockname()[1]
+        os.makedirs(root, exist_ok=True)
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(conn)
+            transport.add_server_key(self.host_key)
+            transport.set_subsystem_handler("sftp", paramiko.SFTPServer, NodeSFTP)
+            transport.start_server(server=NodeServer(self))
+            self.transports.append(transport)
+
+    def exec_command(self, channel, command):
+        proc = subprocess.Popen(["unshare", "-mu", "sh", "-c", NODE_WRAPPER], stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                env=dict(self.env, NODE_ROOT=self.root, NODE_NAME=self.name, NODE_CMD=command))
+        self.procs.append(proc)
+
+        def pump(fileobj, send):
+            for data in iter(lambda: os.read(fileobj.fileno(), 65536), b""):
+                try:
+                    send(data)
+                except (OSError, EOFError, paramiko.SSHException):
+                    break
+
+        def feed():
+            try:
+                for data in iter(lambda: channel.recv(65536), b""):
+                    proc.stdin.write(data)
+                    proc.stdin.flush()
+            except (OSError, EOFError, paramiko.SSHException):
+                pass
+            try:
+                proc.stdin.close()
+            except OSError:
+                pass
+
+        threading.Thread(target=feed, daemon=True).start()
+        err = threading.Thread(target=pump, args=(proc.stderr, channel.sendall_stderr), daemon=True)
+        err.start()
+        pump(proc.stdout, channel.sendall)
+        err.join()
+        try:
+            channel.send_exit_status(proc.wait())
+            channel.close()
+        except (OSError, EOFError, paramiko.SSHException):
+            pass
+
+    def close(self):
+        self.sock.close()
+        for proc in self.procs:
+            if proc.poll() is None:
+                proc.kill()
+        for transport in self.transports:
+            transport.close()
+
+
+def write_stubs(bin_dir):
+    os.makedirs(bin_dir, exist_ok=True)
+    stub = os.path.join(bin_dir, "stub")
+    with open(stub, "w") as fl:
+        fl.write(STUB_SCRIPT % {"python": sys.executable})
+    os.chmod(stub, 0o755)
+    for name in ("sar", "iostat", "docker", "kubectl"):
+        link = os.path.join(bin_dir, name)
+        if not os.path.lexists(link):
+            os.symlink("stub", link)
+
+
+def prepare_work_dir(work_dir, addresses, overrides):
+    """copy the node files to work_dir, write the configs and the inventory of a run of addresses."""
+    os.makedirs(work_dir, exist_ok=True)
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in DEPLOY_FILES:
+        shutil.copy(os.path.join(here, name), work_dir)
+    with open(os.path.join(here, collect_result.COLLECT_CONFIG_YML_FILE), "r") as fl:
+        config = yaml.safe_load(fl)
+    config.update(overrides)
+    with open(os.path.join(work_dir, collect_result.COLLECT_CONFIG_YML_FILE), "w") as fl:
+        yaml.dump(config, fl, default_flow_style=False)
+    # nodes_init fills in the nodes, the stand-ins sample the loopback
+    with open(os.path.join(work_dir, collect_result.NODE_CONFIG_YML_FILE), "w") as fl:
+        yaml.dump({"INTERFACES": "lo"}, fl, default_flow_style=False)
+    with open(os.path.join(work_dir, INVENTORY_FILE), "w") as fl:
+        yaml.dump({"NODES": addresses, "COUCH_PW": ""}, fl, default_flow_style=False)
+    return config
+
+
+def fetched_size(names):
+    return sum(os.path.getsize(os.path.join(name, f)) for name in names if os.path.isdir(name)
+               for f in os.listdir(name))
+
+
+def bench_run(count, work_dir, key_dir, host_key, env, overrides):
+    """{phase: seconds} of a collection run of count stand-in nodes."""
+    names = ["%s%d" % (HOST_PREFIX, i) for i in range(count)]
+    run_dir = os.path.join(work_dir, "run_%d" % count)
+    if os.path.isdir(run_dir):
+        shutil.rmtree(run_dir)
+    nodes = [StandInNode(name, os.path.join(run_dir, "nodes", name), host_key, env) for name in names]
+    config = prepare_work_dir(run_dir, [node.address for node in nodes], overrides)
+    times = {}
+    cwd = os.getcwd()
+    os.chdir(run_dir)
+    collect_result.config = config
+    collect_result.SSH_KEY_PATH = key_dir
+    try:
+        start = time.time()
+        addresses, couch_pw, ssh_password = collect_result.read_inventory(INVENTORY_FILE)
+        if collect_result.nodes_init("minio", addresses, couch_pw, ssh_password) is False:
+            raise IOError("nodes init failed")
+        if collect_result.hostnames != names:
+            raise IOError("stand-in nodes answered %s" % collect_result.hostnames)
+        times["init"] = time.time() - start
+
+        start = time.time()
+        procs = collect_result.nodes_launch(collect_result.ips)
+        collect_result.measure_clock_offsets(list(procs))
+        times["launch"] = time.time() - start
+        if len(procs) != count:
+            raise IOError("launch failed")
+
+        start = time.time()
+        status = collect_result.watch_nodes(procs)
+        times["watch"] = time.time() - start
+        if any(code for code, _ in status.values()):
+            print("collector exit codes %s" % {ip: code for ip, (code, _) in status.items()})
+        times["fetched_mb"] = fetched_size(names) / (1024.0 * 1024.0)
+
+        start = time.time()
+        parse_output.parsing_result(names, config.get("PARSE_ENGINE", "python"), config.get("PARSE_WORKERS", 0),
+                                    cache_dir=None, merge_step=config.get("MERGE_STEP_SEC"))
+        times["parse"] = time.time() - start
+    finally:
+        collect_result.close_ssh_pool()
+        for node in nodes:
+            node.close()
+        os.chdir(cwd)
+    return times
+
+
+def usage():
+    print("bench_orchestration.py [-n 1,2,4,8] [-t load_time_sec] [-d devices] [-c containers] [-s sysstat_major] "
+          "[-o dir] [-r results.json]")
+
+
+def main(argv):
+    try:
+        opts, args = getopt.getopt(argv, "hn:t:d:c:s:o:r:", ["nodes=", "load-time=", "devices=", "containers=",
+                                                             "sysstat=", "dir=", "results="])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+    counts = [1, 2, 4]
+    load_time = 10
+    devices = 4
+    containers = 4
+    sysstat = 12
+    work_dir = "/var/tmp/bench_orchestration"
+    results_file = None
+    for opt, arg in opts:
+        if opt == '-h':
+            usage()
+            return
+        elif opt in ("-n", "--nodes"):
+            counts = [int(n) for n in arg.split(",")]
+        elif opt in ("-t", "--load-time"):
+            load_time = int(arg)
+        elif opt in ("-d", "--devices"):
+            devices = int(arg)
+        elif opt in ("-c", "--containers"):
+            containers = int(arg)
+        elif opt in ("-s", "--sysstat"):
+            sysstat = int(arg)
+        elif opt in ("-o", "--dir"):
+            work_dir = arg
+        elif opt in ("-r", "--results"):
+            results_file = arg
+    if os.geteuid() != 0 or shutil.which("unshare") is None:
+        print("stand-in nodes need root and unshare")
+        sys.exit(1)
+    work_dir = os.path.abspath(work_dir)
+    results_file = os.path.abspath(results_file or os.path.join(work_dir, "bench_results.json"))
+    key_dir = os.path.join(work_dir, "ssh")
+    os.makedirs(key_dir, exist_ok=True)
+    client_key = os.path.join(key_dir, collect_result.SSH_KEY_FILE)
+    if not os.path.exists(client_key):
+        paramiko.RSAKey.generate(2048).write_private_key_file(client_key)
+    if not os.path.exists(client_key + ".pub"):
+        # nodes_init generates a key pair when the public half is missing
+        key = paramiko.RSAKey.from_private_key_file(client_key)
+        with open(client_key + ".pub", "w") as fl:
+            fl.write("%s %s\n" % (key.get_name(), key.get_base64()))
+    host_key = paramiko.RSAKey.generate(2048)
+    bin_dir = os.path.join(work_dir, "bin")
+    write_stubs(bin_dir)
+    env = dict(os.environ, PATH=bin_dir + os.pathsep + os.environ.get("PATH", ""),
+               NODE_RUN_PATH=collect_result.NODE_RUN_PATH, STUB_DEVICES=str(devices),
+               STUB_CONTAINERS=str(containers), STUB_SYSSTAT=str(sysstat))
+    overrides = {"NODE_RUN_PATH": collect_result.NODE_RUN_PATH, "LOAD_TIME_IN_SEC": load_time,
+                 "START_DELAY_SEC": 1, "CONTAINER_INTERVAL_SEC": 2, "LIVE_SUMMARY_SEC": 0,
+                 "KUBE_METRICS": "kubectl", "DISPATCH_LATENCY": "native", "COUCH_PAGE_SIZE": 10}
+
+    rows = []
+    for count in counts:
+        log = os.path.join(work_dir, "bench_%d.log" % count)
+        print("%d nodes, log in %s" % (count, log))
+        with open(log, "w") as fl, contextlib.redirect_stdout(fl):
+            times = bench_run(count, work_dir, key_dir, host_key, env, overrides)
+        rows.append(dict({phase: round(times[phase], 3) for phase in PHASES}, nodes=count,
+                         total=round(sum(times[phase] for phase in PHASES), 3),
+                         run_overhead=round(times["watch"] - load_time, 3),
+                         fetched_mb=round(times["fetched_mb"], 3)))
+
+    print("%6s " % "NODES" + " ".join("%9s" % phase.upper() for phase in PHASES) +
+          " %9s %9s %10s" % ("TOTAL", "OVERHEAD", "FETCH(MB)"))
+    for row in rows:
+        print("%6d " % row["nodes"] + " ".join("%9.3f" % row[phase] for phase in PHASES) +
+              " %9.3f %9.3f %10.3f" % (row["total"], row["run_overhead"], row["fetched_mb"]))
+    with open(results_file, "w") as fl:
+        json.dump({"created": datetime.datetime.now().isoformat(timespec="seconds"), "node": platform.node(),
+                   "python": platform.python_version(), "load_time_sec": load_time, "devices": devices,
+                   "containers": containers, "sysstat": sysstat, "results": rows}, fl, indent=1)
+    print("results saved to %s" % results_file)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020. Hitachi Vantara Corporation. All rights reserved.
+#
+# The copyright to the computer software herein is the property of
+# Hitachi Vantara Corporation. The software may be used and/or copied only
+# with the written permission of Hitachi Vantara Corporation or in accordance
+# with the terms and conditions stipulated in the agreement/contract
+# under which the software has been supplied.
+
+# Benchmark the parsers and the report stage of parse_output on synthetic logs.
+#
+#   python3 bench_parse.py -H 8 -d 16 -c 200 -p 40 -t 3600 -o /var/tmp/bench_parse -r bench_results.json
+#
+# writes the sar Average, sar -n DEV, iostat -dNmzx, docker stats and kubectl
+# top logs of -H hosts sampled for -t seconds, laid out as collect_result
+# fetches them, and under summary/ the run summary, latency log and .ts
+# files it fetches with NODE_SUMMARY. Every parser is then timed on its own
+# with the python engine, and with numpy too when asked for with -e
+# python,numpy, followed by the whole parsing_result and its CSV stage of
+# both. Lines/s, MB/s and the tracemalloc peak of each are printed and
+# saved as json to -r, so runs can be compared for regressions.
+
+import contextlib
+import datetime
+import getopt
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import time
+import tracemalloc
+import parse_output
+import timeseries
+
+HOST_PREFIX = "bench-node-"
+PARAMS_FILE = "bench_params.json"
+# hosts whose node folded the samples into a run summary, the default since NODE_SUMMARY
+SUMMARY_DIR = "summary"
+SAR_DISK_FIELDS = ['tps', 'rkB/s', 'wkB/s', 'dkB/s', 'areq-sz', 'aqu-sz', 'await', '%util']
+IOSTAT_FIELDS = ['r/s', 'rMB/s', 'rrqm/s', '%rrqm', 'r_await', 'rareq-sz', 'w/s', 'wMB/s', 'wrqm/s', '%wrqm',
+                 'w_await', 'wareq-sz', 'aqu-sz', '%util']
+# seconds between the samples of the logs that grow with the run
+INTERVALS = {'iostat': 1, 'kube_top': 15, 'docker_stat': 10}
+MB = 1024.0 * 1024.0
+
+
+def device_name(d):
+    return "sd%s%d" % (chr(ord('a') + d % 26), d // 26)
+
+
+def average_line(name, count):
+    return "Average: %12s " % name + " ".join("%9.2f" % (random.random() * 100) for _ in range(count)) + "\n"
+
+
+def gen_cpu(filename, opts):
+    with open(filename, 'w') as fl:
+        fl.write(average_line('all', 6))
+
+
+def gen_memory(filename, opts):
+    with open(filename, 'w') as fl:
+        fl.write(average_line('', 10))
+
+
+def gen_network(filename, opts):
+    # calico adds an interface per pod, the parser has to skip all of them
+    nics = ['lo', 'eth0', 'eth1'] + ["cali%011x" % random.getrandbits(44) for _ in range(opts['cali'])]
+    with open(filename, 'w') as fl:
+        fl.write("Average: %12s " % 'IFACE' + " ".join(['rxpck/s', 'txpck/s', 'rxkB/s', 'txkB/s', 'rxcmp/s',
+                                                       'txcmp/s', 'rxmcst/s', '%ifutil']) + "\n")
+        for nic in nics:
+            fl.write(average_line(nic, 8))
+
+
+def gen_disk(filename, opts):
+    with open(filename, 'w') as fl:
+        fl.write("Average: %12s " % 'DEV' + " ".join(['tps', 'rd_sec/s', 'wr_sec/s', 'avgrq-sz', 'avgqu-sz',
+                                                     'await', 'svctm', '%util']) + "\n")
+        for d in range(opts['devices']):
+            fl.write(average_line(device_name(d), 8))
+
+
+def gen_block(filename, opts):
+    with open(filename, 'w') as fl:
+        fl.write(average_line('', 5))
+
+
+def gen_iostat(filename, opts):
+    header = ("Device:         rrqm/s   wrqm/s     r/s     w/s    rMB/s    wMB/s "
+              "avgrq-sz avgqu-sz   await r_await w_await  svctm  %util\n")
+    with open(filename, 'w') as fl:
+        fl.write("Linux 4.18.0 (%s) \t10/18/2026 \t_x86_64_\t(32 CPU)\n\n" % opts['host'])
+        for _ in range(opts['duration'] // INTERVALS['iostat']):
+            fl.write(header)
+            for d in range(opts['devices']):
+                fl.write("%-12s " % device_name(d) +
+                         " ".join("%8.2f" % (random.random() * 100) for _ in range(13)) + "\n")
+            fl.write("\n")
+
+
+def gen_kube_top(filename, opts):
+    with open(filename, 'w') as fl:
+        for _ in range(opts['duration'] // INTERVALS['kube_top']):
+            fl.write("NAME                                CPU(cores)   MEMORY(bytes)\n")
+            for p in range(opts['pods']):
+                fl.write("hiota-pod-%04d-7f9c8d   %dm   %dMi\n" % (
+                    p, random.randint(1, 4000), random.randint(10, 16000)))
+
+
+def gen_docker_stats(filename, opts):
+    ts = time.time()
+    with open(filename, 'w') as fl:
+        for _ in range(opts['duration'] // INTERVALS['docker_stat']):
+            ts += INTERVALS['docker_stat']
+            for c in range(opts['containers']):
+                fl.write(json.dumps({
+                    "ts": ts, "id": "%012x" % c, "name": "k8s_minio_minio-%d_hiota" % c, "source": "cgroup",
+                    "cpu_pct": random.random() * 400, "mem_pct": random.random() * 100,
+                    "mem_bytes": random.randint(1, 1 << 34), "mem_limit_bytes": 1 << 35,
+                    "blk_read_bytes": random.randint(1, 1 << 40), "blk_write_bytes": random.randint(1, 1 << 40)}) + "\n")
+
+
+def nic_names(opts):
+    return ['lo', 'eth0', 'eth1'] + ["cali%011x" % c for c in range(opts['cali'])]
+
+
+def node_series(opts):
+    """(metric, key, columns, interval) of every series a node samples."""
+    series = [("cpu", "all", ['%user', '%nice', '%system', '%iowait', '%steal', '%idle'], 1),
+              ("memory", "", ['kbmemfree', 'kbmemused', '%memused', 'kbbuffers', 'kbcached', 'kbcommit',
+                              '%commit', 'kbactive', 'kbinact', 'kbdirty'], 1),
+              ("diskIO_block", "", ['tps', 'rtps', 'wtps', 'bread/s', 'bwrtn/s'], 1)]
+    series += [("network", nic, ['rxpck/s', 'txpck/s', 'rxkB/s', 'txkB/s', 'rxcmp/s', 'txcmp/s', 'rxmcst/s'], 1)
+               for nic in nic_names(opts)]
+    for d in range(opts['devices']):
+        series.append(("disk_io_all_part", device_name(d), SAR_DISK_FIELDS, 1))
+        series.append(("iostat", device_name(d), IOSTAT_FIELDS, INTERVALS['iostat']))
+    series += [("kube_top", "hiota-pod-%04d-7f9c8d" % p, ['Cpu(core)', 'Memory(Mib)'], INTERVALS['kube_top'])
+               for p in range(opts['pods'])]
+    series += [("docker_stat", "k8s_minio_minio-%d_hiota" % c,
+                ['cpu_pct', 'mem_pct', 'mem_bytes', 'blk_read_bytes', 'blk_write_bytes'], INTERVALS['docker_stat'])
+               for c in range(opts['containers'])]
+    return series
+
+
+def gen_summary(filename, opts):
+    # what RingAggregator folds on the node over the whole run
+    summary = timeseries.RunSummary(True)
+    start = time.time()
+    for metric, key, columns, interval in node_series(opts):
+        for t in range(0, opts['duration'], interval):
+            summary.append(metric, key, columns, start + t, [random.random() * 100 for _ in columns])
+    summary.write(filename, start + opts['duration'])
+
+
+def gen_timeseries(host_dir, opts):
+    # the .ts files fetched for the merged grid
+    start = time.time()
+    for metric, key, columns, interval in node_series(opts):
+        writer = timeseries.TimeSeriesWriter(os.path.join(host_dir, timeseries.series_file(opts['host'], metric, key)),
+                                             columns)
+        for t in range(0, opts['duration'], interval):
+            writer.append(start + t, [random.random() * 100 for _ in columns])
+        writer.close()
+
+
+def gen_latency(filename, opts):
+    # raw view rows as the couch_query scripts write them
+    rows = [{"id": "doc%08d" % i, "key": i, "value": {"latency": random.expovariate(1 / 20.0)}}
+            for i in range(opts['duration'] * opts['containers'])]
+    with open(filename, 'w') as fl:
+        json.dump({"total_rows": len(rows), "offset": 0, "rows": rows}, fl)
+
+
+# metric, log name of host_parse_jobs, generator, python parser, numpy parser, first host only
+CASES = [("cpu", "_cpu_info.log", gen_cpu, parse_output.process_cpu, None, False),
+         ("memory", "_memory_info.log", gen_memory, parse_output.process_memory, None, False),
+         ("network", "_network_info.log", gen_network, parse_output.process_network, None, False),
+         ("disk_io_all_part", "_disk_io_info.log", gen_disk, parse_output.process_disk_io_all_part, None, False),
+         ("diskIO_block", "_disk_block_info.log", gen_block, parse_output.process_diskIO_block, None, False),
+         ("iostat", "_iostat_info.log", gen_iostat, parse_output.process_iostat,
+          parse_output.process_iostat_np, False),
+         ("kube_top", "_kube_top_info.log", gen_kube_top, parse_output.process_kube_top,
+          parse_output.process_kube_top_np, True),
+         ("docker_stat", "_docker_stats.log", gen_docker_stats, parse_output.process_docker_stat,
+          parse_output.process_docker_stat_np, False)]
+# the same for the hosts of SUMMARY_DIR, a None log name is the host directory
+SUMMARY_CASES = [("summary", timeseries.SUMMARY_POST, gen_summary, parse_output.process_summary, None, False),
+                 ("postdispatch", "_postdispatch_latency.log", gen_latency, parse_output.process_dispatch_latency,
+                  None, True),
+                 ("timeseries", None, gen_timeseries, parse_output.process_timeseries, None, False)]
+
+
+def log_path(out_dir, host, post):
+    if post is None:
+        return os.path.join(out_dir, host)
+    return os.path.join(out_dir, host, host + post)
+
+
+def case_files(paths):
+    """files behind the log paths of a case, the .ts files of a host directory."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, f) for f in sorted(os.listdir(path)) if f.endswith(timeseries.TS_POST))
+        elif os.path.exists(path):
+            files.append(path)
+    return files
+
+
+def case_trees(out_dir):
+    return [(out_dir, CASES), (os.path.join(out_dir, SUMMARY_DIR), SUMMARY_CASES)]
+
+
+def generate(out_dir, hosts, opts):
+    """write the logs of all hosts, unless those of the same parameters are there."""
+    params_file = os.path.join(out_dir, PARAMS_FILE)
+    try:
+        with open(params_file, 'r') as fl:
+            if json.load(fl) == opts:
+                return
+    except (IOError, ValueError):
+        pass
+    random.seed(opts['seed'])
+    for root, cases in case_trees(out_dir):
+        for i, host in enumerate(hosts):
+            os.makedirs(os.path.join(root, host), exist_ok=True)
+            for metric, post, gen, python_parser, numpy_parser, first_only in cases:
+                path = log_path(root, host, post)
+                if first_only and i:
+                    if os.path.isfile(path):
+                        os.remove(path)
+                    continue
+                print("generating %s" % path)
+                gen(path, dict(opts, host=host))
+    with open(params_file, 'w') as fl:
+        json.dump(opts, fl)
+
+
+def count_lines(paths):
+    lines = 0
+    for path in paths:
+        with open(path, 'rb') as fl:
+            for chunk in iter(lambda: fl.read(1024 * 1024), b''):
+                lines += chunk.count(b'\n')
+    return lines
+
+
+def measure(func, memory=True):
+    """seconds of func(), and the tracemalloc peak in MB of a second run of it."""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        result = func()
+        seconds = time.perf_counter() - start
+        peak = None
+        if memory:
+            tracemalloc.start()
+            try:
+                func()
+                peak = tracemalloc.get_traced_memory()[1] / MB
+            finally:
+                tracemalloc.stop()
+    return seconds, peak, result
+
+
+def result_row(stage, metric, engine, files, size, lines, seconds, peak):
+    return {"stage": stage, "metric": metric, "engine": engine, "files": files,
+            "mb": round(size / MB, 3), "lines": lines, "seconds": round(seconds, 6),
+            "lines_per_sec": round(lines / seconds, 1) if seconds > 0 else None,
+            "mb_per_sec": round(size / MB / seconds, 3) if seconds > 0 else None,
+            "peak_mb": None if peak is None else round(peak, 3)}
+
+
+def bench_parsers(root, cases, hosts, engines, memory):
+    rows = []
+    for metric, post, gen, python_parser, numpy_parser, first_only in cases:
+        paths = [log_path(root, host, post) for host in hosts]
+        paths = [path for path in paths if os.path.exists(path)]
+        files = case_files(paths)
+        size = sum(os.path.getsize(path) for path in files)
+        lines = count_lines(files)
+        for engine in engines:
+            parser = numpy_parser if engine == "numpy" else python_parser
+            if parser is None:
+                continue
+
+            def run():
+                out = {}
+                for path in paths:
+                    host_dir = path if os.path.isdir(path) else os.path.dirname(path)
+                    parser(path, os.path.basename(host_dir), out)
+                return out
+
+            seconds, peak, _ = measure(run, memory)
+            rows.append(result_row("parser", metric, engine, len(files), size, lines, seconds, peak))
+    return rows
+
+
+def bench_pipeline(out_dir, cases, hosts, engine, workers, memory, label="all", merge_step=None):
+    """time parsing_result over all hosts, then its CSV stage alone on the same records."""
+    cwd = os.getcwd()
+    os.chdir(out_dir)
+    try:
+        paths = [log_path(out_dir, host, post) for host in hosts for _, post, _, _, _, _ in cases]
+        paths = case_files([path for path in paths if os.path.exists(path)])
+        size = sum(os.path.getsize(path) for path in paths)
+        lines = count_lines(paths)
+        reports = [os.path.join(out_dir, name) for name in ("performance_report.csv", "final_performance_report.csv",
+                                                            "bench_report.csv", "bench_final_report.csv")]
+
+        def clean():
+            for report in reports:
+                if os.path.exists(report):
+                    os.remove(report)
+
+        def run():
+            clean()
+            return parse_output.parsing_result(hosts, engine, workers, merge_step=merge_step)
+
+        seconds, peak, out_dict = measure(run, memory)
+        rows = [result_row("parsing_result", label, engine, len(paths), size, lines, seconds, peak)]
+
+        def write():
+            clean()
+            parse_output.write_report_csv(out_dict, hosts, reports[2], reports[3])
+
+        seconds, peak, _ = measure(write, memory)
+        csv_lines = count_lines(reports[2:3])
+        rows.append(result_row("csv", label, engine, 2, os.path.getsize(reports[2]), csv_lines, seconds, peak))
+        clean()
+    finally:
+        os.chdir(cwd)
+    return rows
+
+
+def print_results(rows):
+    print("%-14s %-16s %-6s %6s %10s %11s %9s %11s %9s %9s" % (
+        "STAGE", "METRIC", "ENGINE", "FILES", "SIZE(MB)", "LINES", "TIME(s)", "LINES/s", "MB/s", "PEAK(MB)"))
+    for row in rows:
+        print("%-14s %-16s %-6s %6d %10.3f %11d %9.3f %11s %9s %9s" % (
+            row["stage"], row["metric"], row["engine"], row["files"], row["mb"], row["lines"], row["seconds"],
+            "-" if row["lines_per_sec"] is None else "%.0f" % row["lines_per_sec"],
+            "-" if row["mb_per_sec"] is None else "%.1f" % row["mb_per_sec"],
+            "-" if row["peak_mb"] is None else "%.1f" % row["peak_mb"]))
+
+
+def usage():
+    print("bench_parse.py [-H hosts] [-d devices] [-c cali_interfaces] [-p pods] [-n containers] "
+          "[-t duration_sec] [-e python,numpy] [-w workers] [-o dir] [-r results.json] [-M]")
+
+
+def main(argv):
+    try:
+        opts, args = getopt.getopt(argv, "hH:d:c:p:n:t:e:w:o:r:M",
+                                   ["hosts=", "devices=", "cali=", "pods=", "containers=", "duration=",
+                                    "engines=", "workers=", "dir=", "results=", "no-memory"])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+    params = {'hosts': 4, 'devices': 16, 'cali': 200, 'pods': 40, 'containers': 16, 'duration': 3600, 'seed': 1,
+              'layout': 2}
+    engines = ["python"]
+    workers = 0
+    out_dir = "/var/tmp/bench_parse"
+    results_file = None
+    memory = True
+    for opt, arg in opts:
+        if opt == '-h':
+            usage()
+            return
+        elif opt in ("-H", "--hosts"):
+            params['hosts'] = int(arg)
+        elif opt in ("-d", "--devices"):
+            params['devices'] = int(arg)
+        elif opt in ("-c", "--cali"):
+            params['cali'] = int(arg)
+        elif opt in ("-p", "--pods"):
+            params['pods'] = int(arg)
+        elif opt in ("-n", "--containers"):
+            params['containers'] = int(arg)
+        elif opt in ("-t", "--duration"):
+            params['duration'] = int(arg)
+        elif opt in ("-e", "--engines"):
+            engines = arg.split(",")
+        elif opt in ("-w", "--workers"):
+            workers = int(arg)
+        elif opt in ("-o", "--dir"):
+            out_dir = arg
+        elif opt in ("-r", "--results"):
+            results_file = arg
+        elif opt in ("-M", "--no-memory"):
+            memory = False
+    if "numpy" in engines and parse_output.np is None:
+        print("numpy is not installed, only the python parsers are timed")
+        engines = [engine for engine in engines if engine != "numpy"]
+    out_dir = os.path.abspath(out_dir)
+    os.makedirs(out_dir, exist_ok=True)
+    results_file = os.path.abspath(results_file or os.path.join(out_dir, "bench_results.json"))
+
+    hosts = ["%s%d" % (HOST_PREFIX, i) for i in range(params['hosts'])]
+    generate(out_dir, hosts, params)
+    rows = []
+    for root, cases in case_trees(out_dir):
+        rows.extend(bench_parsers(root, cases, hosts, engines, memory))
+    for engine in engines:
+        rows.extend(bench_pipeline(out_dir, CASES, hosts, engine, workers, memory, "logs"))
+    # the default controller path: summary, latency logs and the merged grid of the .ts files
+    rows.extend(bench_pipeline(os.path.join(out_dir, SUMMARY_DIR), SUMMARY_CASES, hosts, "python", workers, memory,
+                               "summary", merge_step=1))
+    print_results(rows)
+
+    with open(results_file, 'w') as fl:
+        json.dump({"created": datetime.datetime.now().isoformat(timespec="seconds"),
+                   "node": platform.node(), "python": platform.python_version(),
+                   "numpy": parse_output.np.__version__ if parse_output.np is not None else None,
+                   "params": dict(params, workers=workers, memory=memory),
+                   "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 3),
+                   "results": rows}, fl, indent=1)
+    print("results saved to %s" % results_file)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -9,23 +9,63 @@
 # under which the software has been supplied.
 
 from subprocess import Popen, PIPE
-from multiprocessing import Process, Manager, Lock
+from multiprocessing import Process, Event, current_process
 import csv
 import time
 import re
 from functools import reduce
 import datetime
 import os
+import sys
+import json
+import getopt
+import resource
+import signal
+import ssl
+import threading
 import yaml
 import netifaces
+import couch_latency
+import kube_metrics
+import timeseries
 
 NODE_RUN_PATH = "/var/tmp/node_stat"
 NODE_CONFIG_YML_FILE = "node_config.yml"
 COLLECT_CONFIG_YML_FILE = "collect_config.yml"
 
+SAR_ENV = {"S_TIME_FORMAT": "ISO", "LC_ALL": "C"}
+CLOCK_RE = re.compile(r"^\d{1,2}:\d{2}:\d{2}$")
+ISO_TIME_RE = re.compile(r"^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}")
+
+CPU_FIELDS = ['%user', '%nice', '%system', '%iowait', '%steal', '%idle']
+MEMORY_FIELDS = ['kbmemfree', 'kbmemused', '%memused', 'kbbuffers', 'kbcached', 'kbcommit',
+                 '%commit', 'kbactive', 'kbinact', 'kbdirty']
+NETWORK_FIELDS = ['rxpck/s', 'txpck/s', 'rxkB/s', 'txkB/s', 'rxcmp/s', 'txcmp/s', 'rxmcst/s']
+DISK_FIELDS = ['tps', 'rd_sec/s', 'wr_sec/s', 'avgrq-sz', 'avgqu-sz', 'await', 'svctm', '%util']
+BLOCK_FIELDS = ['tps', 'rtps', 'wtps', 'bread/s', 'bwrtn/s']
+CGROUP_ROOT = "/sys/fs/cgroup"
+CONTAINER_FIELDS = ['cpu_pct', 'mem_pct', 'mem_bytes', 'blk_read_bytes', 'blk_write_bytes']
+SIZE_RE = re.compile(r"^([\d.]+)\s*([a-zA-Z]*)$")
+SIZE_UNITS = {'b': 1, 'kb': 1000, 'mb': 1000 ** 2, 'gb': 1000 ** 3, 'tb': 1000 ** 4,
+              'kib': 1024, 'mib': 1024 ** 2, 'gib': 1024 ** 3, 'tib': 1024 ** 4}
+IOSTAT_FIELDS = ['rrqm/s', 'wrqm/s', 'r/s', 'w/s', 'rMB/s', 'wMB/s', 'avgrq-sz', 'avgqu-sz',
+                 'await', 'r_await', 'w_await', 'svctm', '%util']
+# seconds between samples of each metric, overridden by INTERVALS of collect_config.yml
+DEFAULT_INTERVALS = {'cpu': 1, 'memory': 1, 'network': 1, 'disk_io_all_part': 1, 'diskIO_block': 1,
+                     'iostat': 1, 'kube_top': 15}
+PROC_METRICS = ['cpu', 'memory', 'network', 'disk_io_all_part', 'diskIO_block', 'iostat']
+STOP_GRACE_SEC = 60
+STOP_KILL_SEC = 5
+
 hostname = ""
 config = {}
 node_config = {}
+series = None
+stream_fd = None
+rings = {}
+stop_event = None
+run_origin = None
+run_deadline = None
 
 def cal_average(list):
     return (reduce(lambda x, y: x + y, list))/len(list)
@@ -51,174 +91,818 @@ def create_log_file(data, log_file):
         print(data)
 
 
-def monitor_cpu(interval_in_sec=1, timeout_in_sec=1, dict={}, lock=None, log=None):
-    cmd = "sar {} {}|grep Average".format(interval_in_sec, timeout_in_sec)
-    print('****before running cpu command')
-    out = run_command(cmd)
-    print('****after running cpu command')
-    filename = hostname + config["FILE_POST_CPU_INFO"]
+def interrupt_on_stop(proc):
+    """SIGINT proc when the run is stopped, sar then still prints its averages."""
+    while proc.poll() is None:
+        if stop_event.wait(1):
+            proc.send_signal(signal.SIGINT)
+            return
+
+
+def iter_command_lines(cmd, env=None):
+    """run cmd and yield its stdout lines as they are produced."""
+    print(f"running cmd : {cmd}")
+    proc = Popen("exec " + cmd, shell=True, stdout=PIPE, stderr=PIPE, universal_newlines=True,
+                 env=dict(os.environ, **env) if env else None)
+    if stop_event is not None:
+        threading.Thread(target=interrupt_on_stop, args=(proc,), daemon=True).start()
+    for line in proc.stdout:
+        yield line
+    stderr = proc.stderr.read()
+    proc.wait()
+    if stderr:
+        print(f"Stderr: {stderr.strip()}")
+
+
+class Ticker(object):
+    """wall clock ticks at whole multiples of interval from the run origin.
+
+    Monitors tick together whatever their interval, a late tick is skipped
+    rather than caught up, and wait() returns False once the run is over
+    or stopped.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.tick = 0
+        self.at = run_origin
+
+    def wait(self):
+        tick = max(self.tick + 1, int((time.time() - run_origin) / self.interval) + 1)
+        at = run_origin + tick * self.interval
+        if at > run_deadline + 1e-6 or stop_event.wait(max(0.0, at - time.time())):
+            return False
+        self.tick = tick
+        self.at = at
+        return True
+
+
+def sar_args(interval_in_sec, timeout_in_sec):
+    """interval and count of sar and iostat, which sample in whole seconds."""
+    interval = max(1, int(round(interval_in_sec)))
+    return "%d %d" % (interval, max(1, int(timeout_in_sec // interval)))
+
+
+def recording():
+    """whether interval samples are kept, as .ts files, streamed frames or a run summary."""
+    return config.get("TIME_SERIES", False) or config.get("NODE_SUMMARY", False) or stream_fd is not None
+
+
+def get_series():
+    """time-series writers of this monitor process.
+
+    A monitor with a sample ring only puts its samples there, the
+    collector drains them into the files and the stream.
+    """
+    global series
+    if series is None:
+        ring = rings.get(current_process().name)
+        if ring is not None:
+            series = timeseries.SeriesSet(hostname, files=False, stream=ring)
+        else:
+            series = timeseries.SeriesSet(hostname, files=config.get("TIME_SERIES", False),
+                                          stream=timeseries.FrameWriter(stream_fd) if stream_fd is not None else None)
+    return series
+
+
+class RingAggregator(object):
+    """drain the sample rings of all monitors into the series files and the stream.
+
+    Keeps the latest values of every series for a live summary printed
+    every summary_sec, 0 prints none. With NODE_SUMMARY every sample is
+    also folded into the run summary, rewritten every SUMMARY_FLUSH_SEC
+    so a killed collector leaves the summary of the run so far.
+    """
+
+    def __init__(self, rings, summary_sec=60):
+        self.rings = rings
+        self.readers = {name: timeseries.FrameReader() for name in rings}
+        self.series = timeseries.SeriesSet(hostname, files=config.get("TIME_SERIES", False),
+                                           stream=timeseries.FrameWriter(stream_fd) if stream_fd is not None else None)
+        self.summary = None
+        if config.get("NODE_SUMMARY", False):
+            self.summary = timeseries.RunSummary(config.get("SUMMARY_HISTOGRAMS", True))
+        self.latest = {}
+        self.samples = 0
+        self.lost = 0
+        self.summary_sec = summary_sec
+        self.next_summary = time.time() + summary_sec
+        self.flush_sec = config.get("SUMMARY_FLUSH_SEC", 30)
+        self.next_flush = time.time() + self.flush_sec
+
+    def drain(self):
+        for name, ring in self.rings.items():
+            frames, lost = ring.drain()
+            self.lost += lost
+            for metric, key, columns, ts, values in self.readers[name].feed(frames):
+                self.series.append(metric, key, columns, ts, values)
+                if self.summary is not None:
+                    self.summary.append(metric, key, columns, ts, values)
+                self.latest[(metric, key)] = dict(zip(columns, values))
+                self.samples += 1
+        if self.summary_sec and time.time() >= self.next_summary:
+            self.next_summary += self.summary_sec
+            self.report()
+        if self.summary is not None and self.flush_sec and time.time() >= self.next_flush:
+            self.next_flush += self.flush_sec
+            self.write_summary()
+
+    def write_summary(self):
+        filename = hostname + config.get("FILE_POST_SUMMARY", timeseries.SUMMARY_POST)
+        try:
+            # written aside and renamed over, a reader never sees half a summary
+            self.summary.write(filename)
+        except IOError as ex:
+            print("Write %s failed" % filename)
+            return False
+        return True
+
+    def report(self):
+        print("live: %d samples, %d lost, " % (self.samples, self.lost) +
+              " ".join("%s=%s" % (name, "-" if value is None else "%.1f" % value)
+                       for name, value in timeseries.fold_headlines(self.latest)))
+
+    def close(self):
+        self.drain()
+        self.report()
+        self.series.close()
+        if self.summary is not None and self.write_summary():
+            print("Run summary of %d columns saved to %s" % (
+                len(self.summary.columns), hostname + config.get("FILE_POST_SUMMARY", timeseries.SUMMARY_POST)))
+        for ring in self.rings.values():
+            ring.close()
+
+
+def clock_to_epoch(clock, state):
+    """epoch of a HH:MM:SS clock reading, following the run across midnight."""
+    h, m, s = [int(v) for v in clock.split(":")]
+    sec = h * 3600 + m * 60 + s
+    if "day" not in state:
+        today = datetime.datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        state["day"] = time.mktime(today.timetuple())
+        state["last"] = sec
+    if sec < state["last"]:
+        state["day"] += 86400
+    state["last"] = sec
+    return state["day"] + sec
+
+
+def collect_sar(cmd, filename, metric, keyed=False, log=None):
+    """run sar, keep its Average lines in filename.
+
+    In time-series mode every interval sample is also appended to the
+    series of metric, keyed by the first column (CPU, IFACE, DEV) if keyed.
+    """
+    ts_mode = recording()
+    header = None
+    state = {}
     try:
-        with open(filename, 'w') as f_handler:
-            for line in out:
-                f_handler.write(line)
-            f_handler.close()
+        stream = LogStream(filename, log)
     except IOError as ex:
+        return False
+    with stream:
+        for line in iter_command_lines(cmd, SAR_ENV):
+            if line.startswith("Average"):
+                stream.write(line)
+                continue
+            tokens = line.split()
+            if not ts_mode or len(tokens) < 2 or not CLOCK_RE.match(tokens[0]):
+                continue
+            clock = tokens.pop(0)
+            if tokens[0] in ("AM", "PM"):
+                h, rest = clock.split(":", 1)
+                clock = "%d:%s" % (int(h) % 12 + (12 if tokens.pop(0) == "PM" else 0), rest)
+            try:
+                values = [float(v) for v in (tokens[1:] if keyed else tokens)]
+            except ValueError:
+                header = tokens
+                continue
+            if header is not None:
+                get_series().append(metric, tokens[0] if keyed else "", header[1:] if keyed else header,
+                                    clock_to_epoch(clock, state), values)
+    return True
+
+
+class LogStream(object):
+    """line buffered writer of a monitor log, teed into the target_dir log.
+
+    Every line reaches both files as soon as it is written, so memory stays
+    flat over the run and a killed collector leaves its data behind.
+    """
+
+    def __init__(self, filename, log=None):
+        self.files = [open(filename, 'w', buffering=1)]
+        if log:
+            try:
+                self.files.append(open(log, 'w', buffering=1))
+            except (IOError, FileNotFoundError):
+                print(f"Failed to wrrite data file: {log}")
+
+    def write(self, line):
+        for fl in self.files:
+            fl.write(line)
+
+    def close(self):
+        for fl in self.files:
+            fl.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def monitor_cpu(interval_in_sec=1, timeout_in_sec=1, log=None):
+    cmd = "sar %s" % sar_args(interval_in_sec, timeout_in_sec)
+    print('****before running cpu command')
+    filename = hostname + config["FILE_POST_CPU_INFO"]
+    if not collect_sar(cmd, filename, "cpu", True, log):
         print("Collect CPU info failed")
         return
-    if log:
-        create_log_file(out, log)
+    print('****after running cpu command')
     print("CPU info collected, save to %s" % filename)
 
 
-def monitor_memory(interval_in_sec=1, timeout_in_sec=1, dict={}, lock=None, log=None):
-    cmd = "sar -r {} {}|grep Average".format(interval_in_sec, timeout_in_sec)
-    out = run_command(cmd)
+def monitor_memory(interval_in_sec=1, timeout_in_sec=1, log=None):
+    cmd = "sar -r %s" % sar_args(interval_in_sec, timeout_in_sec)
     filename = hostname + config["FILE_POST_MEMORY_INFO"]
-    try:
-        with open(filename, 'w') as f_handler:
-            for line in out:
-                f_handler.write(line)
-            f_handler.close()
-    except IOError as ex:
+    if not collect_sar(cmd, filename, "memory", False, log):
         print("Collect memory info failed")
         return
-    if log:
-        create_log_file(out, log)
     print("Memory info collected, save to %s" % filename)
 
 
-def monitor_network(interval_in_sec=1, timeout_in_sec=1, NIC=['ALL'], dict={}, lock=None, log=None):
-    cmd = "sar -n DEV {} {}|grep Average".format(interval_in_sec, timeout_in_sec)
-    out = run_command(cmd).splitlines()
+def monitor_network(interval_in_sec=1, timeout_in_sec=1, NIC=['ALL'], log=None):
+    cmd = "sar -n DEV %s" % sar_args(interval_in_sec, timeout_in_sec)
     filename = hostname + config["FILE_POST_NETWORK_INFO"]
-    try:
-         with open(filename, 'w') as f_handler:
-             for line in out:
-                f_handler.write(line + "\n")
-             f_handler.close()
-    except IOError as ex:
+    if not collect_sar(cmd, filename, "network", True, log):
         print("Collect network info failed")
         return
-    if log:
-        create_log_file(out, log)
     print("Network info collected, save to %s" % filename)
 
 
-def monitor_disk_io_all_part(interval_in_sec=1, timeout_in_sec=1, dict={}, lock=None, log=None):
-    cmd = "sar -dp {} {}|grep Average".format(interval_in_sec, timeout_in_sec)
-    out = run_command(cmd)
+def monitor_disk_io_all_part(interval_in_sec=1, timeout_in_sec=1, log=None):
+    cmd = "sar -dp %s" % sar_args(interval_in_sec, timeout_in_sec)
     filename = hostname + config["FILE_POST_DISK_IO_INFO"]
-    try:
-        with open(filename, 'w') as f_handler:
-            for line in out:
-                f_handler.write(line)
-            f_handler.close()
-    except IOError as ex:
+    if not collect_sar(cmd, filename, "disk_io_all_part", True, log):
         print("Collect disk io info failed")
         return
-    if log:
-        create_log_file(out, log)
     print("Disk io info collected, save to %s" % filename)
 
 
-def monitor_diskIO_block(interval_in_sec=1, timeout_in_sec=1, dict={}, lock=None, log=None):
-    cmd = "sar -b {} {}|grep Average".format(interval_in_sec, timeout_in_sec)
-    out = run_command(cmd)
+def monitor_diskIO_block(interval_in_sec=1, timeout_in_sec=1, log=None):
+    cmd = "sar -b %s" % sar_args(interval_in_sec, timeout_in_sec)
     filename = hostname + config["FILE_POST_DISK_BLOCK_INFO"]
-    try:
-        with open(filename, 'w') as f_handler:
-            for line in out:
-                f_handler.write(line)
-            f_handler.close()
-    except IOError as ex:
+    if not collect_sar(cmd, filename, "diskIO_block", False, log):
         print("Collect disk block info failed")
         return
-    if log:
-        create_log_file(out, log)
     print("Disk disk info collected, save to %s" % filename)
 
 
-def monitor_kube_top(interval_in_sec=1, timeout_in_sec=1, dict={}, lock=None, log=None):
+def sample_kube_metrics(client, namespace, stream, last):
+    """write one JSON record per container of the namespace, from the metrics API.
+
+    The API repeats a sample until metrics-server scrapes the pod again,
+    last holds the time of the latest one written of every container.
+    Returns False when the query failed.
+    """
+    try:
+        records = kube_metrics.container_records(client.pod_metrics(namespace))
+    except (IOError, OSError, ValueError) as ex:
+        print("Query pod metrics failed: %s" % ex)
+        return False
+    pods = {}
+    for record in records:
+        if last.get((record["pod"], record["container"])) == record["ts"]:
+            continue
+        last[(record["pod"], record["container"])] = record["ts"]
+        stream.write(json.dumps(record) + "\n")
+        total = pods.setdefault((record["pod"], record["ts"]), [0.0, 0.0])
+        total[0] += record["cpu_cores"] * 1000
+        total[1] += record["memory_bytes"] / 1048576.0
+    if recording():
+        for (pod, ts), values in pods.items():
+            get_series().append("kube_top", pod, ["Cpu(core)", "Memory(Mib)"], ts, values)
+    return True
+
+
+def monitor_kube_top(interval_in_sec=1, timeout_in_sec=1, log=None):
+    """sample the pods of KUBE_NAMESPACE every interval.
+
+    KUBE_METRICS "api" queries the metrics.k8s.io API on one kept open
+    connection, "kubectl" runs kubectl top pods. The API gives way to
+    kubectl after KUBE_API_MAX_FAILURES failed queries in a row, such as
+    when access is denied or no metrics-server is installed.
+    """
     print('#####in monitor kube top process')
-    sample_interval=15
-    cmd = "kubectl top pods -n hiota"
-    out = []
+    namespace = config.get("KUBE_NAMESPACE", kube_metrics.NAMESPACE)
+    cmd = "kubectl top pods -n %s" % namespace
     for _, (k, v) in enumerate(config.items()):
-        print(k + ": " + v)
+        print("%s: %s" % (k, v))
     filename = hostname + config["FILE_POST_KUBE_TOP_INFO"]
 
-    for i in range(int(timeout_in_sec/sample_interval)):
-        _out = run_command(cmd)
-        if not _out:
-            out.extend([0,0,0])
-        else:
-            out.extend(_out.splitlines())
-        time.sleep(sample_interval)
     try:
-        with open(filename, 'w') as f_handler:
-            for line in out:
-                f_handler.write(line + "\n")
-            f_handler.close()
+        stream = LogStream(filename, log)
     except IOError as ex:
-        print("Collect disk block info failed")
+        print("Collect kubectl top info failed")
         return
-    if log:
-        create_log_file(out, log)
+    client = None
+    if config.get("KUBE_METRICS", "api") == "api":
+        try:
+            client = kube_metrics.load_client(config.get("KUBECONFIG"), config.get("KUBE_API_SERVER"))
+        except (IOError, OSError, ValueError, ssl.SSLError) as ex:
+            print("Metrics API client failed, fall back to kubectl top: %s" % ex)
+    ticker = Ticker(interval_in_sec)
+    with stream:
+        if client is not None:
+            last = {}
+            failures = 0
+            max_failures = config.get("KUBE_API_MAX_FAILURES", 3)
+            while True:
+                if sample_kube_metrics(client, namespace, stream, last):
+                    failures = 0
+                else:
+                    failures += 1
+                    if failures >= max_failures:
+                        print("Metrics API failed %d times in a row, fall back to kubectl top" % failures)
+                        break
+                if not ticker.wait():
+                    client.close()
+                    print("Pod metrics collected, save to %s" % filename)
+                    return
+            client.close()
+        while True:
+            _out = run_command(cmd)
+            if _out:
+                stream.write(_out + "\n")
+                if recording():
+                    now = time.time()
+                    for line in _out.splitlines()[1:]:
+                        _line = line.split()
+                        get_series().append("kube_top", _line[0], ["Cpu(core)", "Memory(Mib)"], now,
+                                            [re.match(r"\d*", v).group() or 0 for v in _line[1:3]])
+            if not ticker.wait():
+                break
     print("Kubectl top info collected, save to %s" % filename)
 
 
-def monitor_iostat(interval_in_sec=1, timeout_in_sec=1, dict={}, lock=None, log=None):
-    cmd = f"iostat -dNmzx {interval_in_sec} {timeout_in_sec}"
-    out = run_command(cmd).splitlines()
+def monitor_iostat(interval_in_sec=1, timeout_in_sec=1, log=None):
+    ts_mode = recording()
+    cmd = f"iostat -dNmzx{'t' if ts_mode else ''} {sar_args(interval_in_sec, timeout_in_sec)}"
     filename = hostname + config["FILE_POST_IOSTAT_INFO"]
+    header = None
+    ts = None
     try:
-        with open(filename, 'w') as f_handler:
-            for line in out:
-                f_handler.write(line + "\n")
-            f_handler.close()
+        stream = LogStream(filename, log)
     except IOError as ex:
         print("Collect iostat info failed")
         return
-    if log:
-        create_log_file(out, log)
+    with stream:
+        for line in iter_command_lines(cmd, SAR_ENV):
+            tokens = line.split()
+            if ts_mode and ISO_TIME_RE.match(line):
+                ts = time.mktime(time.strptime(line[:19], "%Y-%m-%dT%H:%M:%S"))
+                continue
+            stream.write(line)
+            if not ts_mode or not tokens or line.startswith("Linux"):
+                continue
+            if tokens[0].startswith("Device"):
+                header = tokens[1:]
+            elif header is not None and ts is not None:
+                get_series().append("iostat", tokens[0], header, ts, tokens[1:])
     print("Disk iostat info collected, save to %s" % filename)
 
 
-def monitor_containers(containers_postfixs, log=None):
-    cmd = "docker ps"
-    out = run_command(cmd).splitlines()
+def size_to_bytes(value):
+    """bytes of a docker size string such as 1.5MiB, 12kB or 0B."""
+    match = SIZE_RE.match(value.strip())
+    if not match:
+        return 0
+    return int(float(match.group(1)) * SIZE_UNITS.get(match.group(2).lower(), 1))
+
+
+def docker_stats_record(stat, now):
+    mem_usage, _, mem_limit = stat["MemUsage"].partition("/")
+    blk_read, _, blk_write = stat["BlockIO"].partition("/")
+    return {"ts": now, "id": stat["ID"], "name": stat["Name"], "source": "docker",
+            "cpu_pct": float(stat["CPUPerc"].rstrip("%") or 0),
+            "mem_pct": float(stat["MemPerc"].rstrip("%") or 0),
+            "mem_bytes": size_to_bytes(mem_usage), "mem_limit_bytes": size_to_bytes(mem_limit),
+            "blk_read_bytes": size_to_bytes(blk_read), "blk_write_bytes": size_to_bytes(blk_write)}
+
+
+def find_containers(containers_postfixs):
+    """id -> name of the running containers matching the configured names."""
+    out = run_command("docker ps")
+    if not out:
+        return {}
     container_names = containers_postfixs.split(",")
-    container_ids = []
-    for line in out:
+    container_ids = {}
+    for line in out.splitlines():
         container_id = line.split()[0]
         for container_name in container_names:
             if ("k8s_" + container_name) in line:
                 if container_id not in container_ids:
-                    container_ids.append(container_id)
+                    container_ids[container_id] = line.split()[-1]
+    return container_ids
+
+
+def cgroup_version():
+    if os.path.exists(os.path.join(CGROUP_ROOT, "cgroup.controllers")):
+        return 2
+    if os.path.isdir(os.path.join(CGROUP_ROOT, "memory")):
+        return 1
+    return 0
+
+
+def find_cgroup_dirs(root, container_ids):
+    """container id -> cgroup directory under root, found in one walk."""
+    found = {}
+    for path, dirs, _ in os.walk(root):
+        for d in dirs:
+            for container_id in container_ids:
+                if container_id in d and container_id not in found:
+                    found[container_id] = os.path.join(path, d)
+        if len(found) == len(container_ids):
+            break
+    return found
+
+
+def resolve_container_cgroups(container_ids):
+    """return (cgroup version, {id: {controller: path}}) of the containers."""
+    version = cgroup_version()
+    if version == 2:
+        return version, {cid: {"cpu": p, "memory": p, "io": p}
+                         for cid, p in find_cgroup_dirs(CGROUP_ROOT, container_ids).items()}
+    if version == 1:
+        paths = {cid: {} for cid in container_ids}
+        for controller, sub in (("cpu", "cpuacct"), ("memory", "memory"), ("io", "blkio")):
+            for cid, p in find_cgroup_dirs(os.path.join(CGROUP_ROOT, sub), container_ids).items():
+                paths[cid][controller] = p
+        return version, {cid: p for cid, p in paths.items() if len(p) == 3}
+    return 0, {}
+
+
+def read_cgroup_value(path, name):
+    with open(os.path.join(path, name), 'r') as fl:
+        return fl.read().strip()
+
+
+def read_cgroup_counters(version, paths, mem_total):
+    """cpu seconds, memory bytes, memory limit and block read/write bytes."""
+    if version == 2:
+        cpu = read_cgroup_value(paths["cpu"], "cpu.stat").split("\n")[0].split()
+        cpu_sec = int(cpu[1]) / 1e6 if cpu[0] == "usage_usec" else 0.0
+        mem = int(read_cgroup_value(paths["memory"], "memory.current"))
+        limit = read_cgroup_value(paths["memory"], "memory.max")
+        limit = mem_total if limit == "max" else int(limit)
+        rd = wr = 0
+        for line in read_cgroup_value(paths["io"], "io.stat").splitlines():
+            for field in line.split()[1:]:
+                key, _, value = field.partition("=")
+                if key == "rbytes":
+                    rd += int(value)
+                elif key == "wbytes":
+                    wr += int(value)
+    else:
+        cpu_sec = int(read_cgroup_value(paths["cpu"], "cpuacct.usage")) / 1e9
+        mem = int(read_cgroup_value(paths["memory"], "memory.usage_in_bytes"))
+        limit = min(int(read_cgroup_value(paths["memory"], "memory.limit_in_bytes")), mem_total)
+        rd = wr = 0
+        for name in ("blkio.throttle.io_service_bytes", "blkio.io_service_bytes_recursive"):
+            try:
+                lines = read_cgroup_value(paths["io"], name).splitlines()
+            except IOError:
+                continue
+            for line in lines:
+                fields = line.split()
+                if len(fields) == 3 and fields[1] == "Read":
+                    rd += int(fields[2])
+                elif len(fields) == 3 and fields[1] == "Write":
+                    wr += int(fields[2])
+            break
+    return cpu_sec, mem, limit, rd, wr
+
+
+def sample_cgroups(stream, container_ids, version, cgroups, interval_in_sec, timeout_in_sec):
+    """write container records read straight from the cgroup files."""
+    mem_total = read_meminfo()['MemTotal'] * 1024
+    prev = {}
+    ticker = Ticker(interval_in_sec)
+    while True:
+        now = time.time()
+        mono = time.monotonic()
+        for cid, paths in cgroups.items():
+            try:
+                cpu_sec, mem, limit, rd, wr = read_cgroup_counters(version, paths, mem_total)
+            except (IOError, ValueError, IndexError):
+                continue
+            if cid in prev:
+                last_mono, last_cpu = prev[cid]
+                write_container_record(stream, {
+                    "ts": now, "id": cid, "name": container_ids[cid], "source": "cgroup",
+                    "cpu_pct": 100.0 * (cpu_sec - last_cpu) / (mono - last_mono),
+                    "mem_pct": 100.0 * mem / limit if limit else 0.0,
+                    "mem_bytes": mem, "mem_limit_bytes": limit,
+                    "blk_read_bytes": rd, "blk_write_bytes": wr})
+            prev[cid] = (mono, cpu_sec)
+        if not ticker.wait():
+            break
+
+
+def write_container_record(stream, record):
+    stream.write(json.dumps(record) + "\n")
+    if recording():
+        get_series().append("docker_stat", record["name"], CONTAINER_FIELDS, record["ts"],
+                            [record[f] for f in CONTAINER_FIELDS])
+
+
+def monitor_containers(containers_postfixs, log=None, interval_in_sec=10, timeout_in_sec=0):
+    """sample all matching containers with one docker stats call per interval.
+
+    Each sample is written as one JSON record per container, the whole
+    load window is covered instead of a single snapshot at start. When the
+    cgroup v1/v2 directories of all containers are found, the counters are
+    read from them directly every CGROUP_INTERVAL_SEC instead.
+    """
+    container_ids = find_containers(containers_postfixs)
     if len(container_ids) == 0:
         return
 
-    out = []
-    for container_id in container_ids:
-        cmd = "docker stats %s --no-stream" % container_id
-        _out = run_command(cmd)
-        if _out:
-            out.extend(_out.splitlines())
+    version, cgroups = 0, {}
+    if config.get("CONTAINER_BACKEND", "auto") != "docker":
+        version, cgroups = resolve_container_cgroups(list(container_ids))
+        print("cgroup v%d, %d of %d containers resolved" % (version, len(cgroups), len(container_ids)))
+
+    cmd = "docker stats --no-stream --format '{{json .}}' %s" % " ".join(container_ids)
     filename = hostname + config["FILE_POST_DOCKER_STATS_INFO"]
+    try:
+        stream = LogStream(filename, log)
+    except IOError as ex:
+        print("Collect docker stats info failed")
+        return
+    with stream:
+        if len(cgroups) == len(container_ids):
+            sample_cgroups(stream, container_ids, version, cgroups,
+                           config.get("CGROUP_INTERVAL_SEC", 0.5), timeout_in_sec)
+            print("Docker stats info collected from cgroup, save to %s" % filename)
+            return
+        ticker = Ticker(interval_in_sec)
+        while True:
+            now = time.time()
+            for line in iter_command_lines(cmd):
+                try:
+                    write_container_record(stream, docker_stats_record(json.loads(line), now))
+                except (ValueError, KeyError):
+                    continue
+            if not ticker.wait():
+                break
+    print("Docker stats info collected, save to %s" % filename)
+
+
+def read_proc_stat():
+    with open('/proc/stat', 'r') as fl:
+        return [int(v) for v in fl.readline().split()[1:]]
+
+
+def read_meminfo():
+    info = {}
+    with open('/proc/meminfo', 'r') as fl:
+        for line in fl:
+            name, value = line.split(':', 1)
+            info[name] = int(value.split()[0])
+    return info
+
+
+def read_net_dev():
+    stats = {}
+    with open('/proc/net/dev', 'r') as fl:
+        for line in fl.readlines()[2:]:
+            name, values = line.split(':', 1)
+            stats[name.strip()] = [int(v) for v in values.split()]
+    return stats
+
+
+def read_diskstats():
+    stats = {}
+    with open('/proc/diskstats', 'r') as fl:
+        for line in fl:
+            fields = line.split()
+            if fields[2].startswith(('loop', 'ram', 'zram')):
+                continue
+            stats[fields[2]] = [int(v) for v in fields[3:14]]
+    return stats
+
+
+def cpu_sample(prev, cur):
+    # %user %nice %system %iowait %steal %idle
+    d = [c - p for c, p in zip(cur, prev)]
+    total = sum(d[:8]) or 1
+    return [100.0 * d[0] / total, 100.0 * d[1] / total, 100.0 * (d[2] + d[5] + d[6]) / total,
+            100.0 * d[4] / total, 100.0 * d[7] / total, 100.0 * d[3] / total]
+
+
+def memory_sample(mem):
+    # kbmemfree kbmemused %memused kbbuffers kbcached kbcommit %commit kbactive kbinact kbdirty
+    used = mem['MemTotal'] - mem['MemFree']
+    return [mem['MemFree'], used, 100.0 * used / mem['MemTotal'], mem['Buffers'], mem['Cached'],
+            mem['Committed_AS'], 100.0 * mem['Committed_AS'] / (mem['MemTotal'] + mem.get('SwapTotal', 0)),
+            mem['Active'], mem['Inactive'], mem['Dirty']]
+
+
+def network_sample(prev, cur, dt):
+    # rxpck/s txpck/s rxkB/s txkB/s rxcmp/s txcmp/s rxmcst/s
+    sample = {}
+    for nic, c in cur.items():
+        p = prev.get(nic, c)
+        d = [(x - y) / dt for x, y in zip(c, p)]
+        sample[nic] = [d[1], d[9], d[0] / 1024, d[8] / 1024, d[6], d[15], d[7]]
+    return sample
+
+
+def disk_sample(prev, cur, dt):
+    # tps rd_sec/s wr_sec/s avgrq-sz avgqu-sz await svctm %util
+    sample = {}
+    for dev, c in cur.items():
+        d = [x - y for x, y in zip(c, prev.get(dev, c))]
+        ios = d[0] + d[4]
+        sample[dev] = [ios / dt, d[2] / dt, d[6] / dt,
+                       (d[2] + d[6]) / ios if ios else 0.0, d[10] / 1000.0 / dt,
+                       (d[3] + d[7]) / ios if ios else 0.0, d[9] / ios if ios else 0.0,
+                       min(100.0, d[9] / 10.0 / dt)]
+    return sample
+
+
+def block_sample(prev, cur, dt):
+    # tps rtps wtps bread/s bwrtn/s over whole disks
+    total = [0.0] * 5
+    for dev, c in cur.items():
+        if not os.path.exists('/sys/block/%s' % dev):
+            continue
+        d = [x - y for x, y in zip(c, prev.get(dev, c))]
+        total[0] += (d[0] + d[4]) / dt
+        total[1] += d[0] / dt
+        total[2] += d[4] / dt
+        total[3] += d[2] / dt
+        total[4] += d[6] / dt
+    return total
+
+
+def iostat_sample(prev, cur, dt):
+    # rrqm/s wrqm/s r/s w/s rMB/s wMB/s avgrq-sz avgqu-sz await r_await w_await svctm %util
+    sample = {}
+    for dev, c in cur.items():
+        d = [x - y for x, y in zip(c, prev.get(dev, c))]
+        ios = d[0] + d[4]
+        if ios == 0:
+            continue
+        sample[dev] = [d[1] / dt, d[5] / dt, d[0] / dt, d[4] / dt,
+                       d[2] / 2048.0 / dt, d[6] / 2048.0 / dt, (d[2] + d[6]) / ios,
+                       d[10] / 1000.0 / dt, (d[3] + d[7]) / ios,
+                       d[3] / d[0] if d[0] else 0.0, d[7] / d[4] if d[4] else 0.0,
+                       d[9] / ios, min(100.0, d[9] / 10.0 / dt)]
+    return sample
+
+
+def add_average(acc, key, values):
+    if key not in acc:
+        acc[key] = [0, [0.0] * len(values)]
+    acc[key][0] += 1
+    acc[key][1] = [s + v for s, v in zip(acc[key][1], values)]
+
+
+def average_line(name, acc):
+    count, sums = acc
+    return "Average: %12s " % name + " ".join("%9.2f" % (s / count) for s in sums)
+
+
+def write_average_file(filename, lines, log=None):
+    if not lines:
+        print("No native sampler info for %s" % filename)
+        return
     try:
         with open(filename, 'w') as f_handler:
-            for line in out:
+            for line in lines:
                 f_handler.write(line + "\n")
             f_handler.close()
     except IOError as ex:
-        print("Collect docker stats info failed")
+        print("Write %s failed" % filename)
         return
     if log:
-        create_log_file(out, log)
-    print("Docker stats info collected, save to %s" % filename)
+        create_log_file("\n".join(lines), log)
+    print("Native sampler info saved to %s" % filename)
+
+
+def monitor_proc(intervals=DEFAULT_INTERVALS, timeout_in_sec=1, NIC=['ALL'], log=None):
+    """sample cpu, memory, network and disks from /proc in one timer loop.
+
+    Produces the same Average lines as the sar monitors and the same
+    per-interval table as iostat -dNmzx, without forking any tool. The loop
+    ticks at the shortest of the intervals of those metrics, each metric is
+    sampled on the ticks its own interval rounds to.
+    """
+    acc = {metric: {} for metric in PROC_METRICS}
+    iostat_file = hostname + config["FILE_POST_IOSTAT_INFO"]
+    iostat_header = "%-12s " % "Device:" + " ".join("%8s" % f for f in IOSTAT_FIELDS)
+    ts_mode = recording()
+
+    def record(metric, key, columns, values):
+        add_average(acc[metric], key, values)
+        if ts_mode:
+            get_series().append(metric, key, columns, ts, values)
+
+    tick = min(intervals[metric] for metric in PROC_METRICS)
+    every = {metric: max(1, int(round(intervals[metric] / tick))) for metric in PROC_METRICS}
+    ticker = Ticker(tick)
+    sources = {'cpu': read_proc_stat, 'network': read_net_dev, 'disk_io_all_part': read_diskstats,
+               'diskIO_block': read_diskstats, 'iostat': read_diskstats}
+    prev = {metric: (read(), time.monotonic()) for metric, read in sources.items()}
+    with LogStream(iostat_file, log and log + 'iostat') as iostat_handler:
+        iostat_handler.write("Linux %s (%s)\n\n" % (os.uname()[2], hostname))
+        while ticker.wait():
+            due = [metric for metric in PROC_METRICS if ticker.tick % every[metric] == 0]
+            cur = {}
+            for metric in due:
+                if metric in sources:
+                    read = sources[metric]
+                    # the disk metrics due together share one read of diskstats
+                    same = [m for m in cur if sources[m] is read]
+                    cur[metric] = (cur[same[0]][0] if same else read(), time.monotonic())
+            ts = time.time()
+            for metric in due:
+                if metric == 'memory':
+                    record('memory', '', MEMORY_FIELDS, memory_sample(read_meminfo()))
+                    continue
+                (last, last_time), (now, now_time) = prev[metric], cur[metric]
+                dt = now_time - last_time
+                if metric == 'cpu':
+                    record('cpu', 'all', CPU_FIELDS, cpu_sample(last, now))
+                elif metric == 'network':
+                    for nic, values in network_sample(last, now, dt).items():
+                        record('network', nic, NETWORK_FIELDS, values)
+                elif metric == 'disk_io_all_part':
+                    for dev, values in disk_sample(last, now, dt).items():
+                        record('disk_io_all_part', dev, DISK_FIELDS, values)
+                elif metric == 'diskIO_block':
+                    record('diskIO_block', '', BLOCK_FIELDS, block_sample(last, now, dt))
+                elif metric == 'iostat':
+                    iostat_handler.write(iostat_header + "\n")
+                    for dev, values in iostat_sample(last, now, dt).items():
+                        iostat_handler.write("%-12s " % dev + " ".join("%8.2f" % v for v in values) + "\n")
+                        if ts_mode:
+                            get_series().append("iostat", dev, IOSTAT_FIELDS, ts, values)
+                    iostat_handler.write("\n")
+                prev[metric] = cur[metric]
+
+    cpu_acc, mem_acc, net_acc = acc['cpu'], acc['memory'], acc['network']
+    disk_acc, block_acc = acc['disk_io_all_part'], acc['diskIO_block']
+    write_average_file(hostname + config["FILE_POST_CPU_INFO"],
+                       [average_line('all', cpu_acc['all'])] if cpu_acc else [],
+                       log and log + 'cpu')
+    write_average_file(hostname + config["FILE_POST_MEMORY_INFO"],
+                       [average_line('', mem_acc[''])] if mem_acc else [],
+                       log and log + 'mem')
+    write_average_file(hostname + config["FILE_POST_NETWORK_INFO"],
+                       ["Average: %12s " % 'IFACE' + " ".join(NETWORK_FIELDS)] +
+                       [average_line(nic, acc) for nic, acc in net_acc.items()],
+                       log and log + 'network')
+    write_average_file(hostname + config["FILE_POST_DISK_IO_INFO"],
+                       ["Average: %12s " % 'DEV' + " ".join(DISK_FIELDS)] +
+                       [average_line(dev, acc) for dev, acc in disk_acc.items()],
+                       log and log + 'disk_io_all_part')
+    write_average_file(hostname + config["FILE_POST_DISK_BLOCK_INFO"],
+                       [average_line('', block_acc[''])] if block_acc else [],
+                       log and log + 'diskIO_block')
+    print("Native sampler info collected")
+
+
+def collect_dispatch_latency():
+    """fold the pre and post dispatch latencies of the CouchDB views into histograms."""
+    client = couch_latency.CouchClient(node_settings["IPS"].split(",")[0],
+                                       config.get("COUCH_PORT", couch_latency.COUCH_PORT),
+                                       config.get("COUCH_USER", couch_latency.COUCH_USER),
+                                       node_settings["COUCH_PW"])
+    for view_key, file_key in (("COUCH_PREDISPATCH_VIEW", "FILE_POST_PREDISPATCH_LATENCY"),
+                               ("COUCH_POSTDISPATCH_VIEW", "FILE_POST_POSTDISPATCH_LATENCY")):
+        filename = node_settings["HOSTS"].split(",")[0] + config[file_key]
+        try:
+            histogram = couch_latency.collect_latency(client, config.get("COUCH_DB", couch_latency.COUCH_DB),
+                                                      config[view_key],
+                                                      config.get("COUCH_PAGE_SIZE", couch_latency.PAGE_SIZE),
+                                                      config.get("COUCH_LATENCY_FIELD", couch_latency.LATENCY_FIELD))
+        except (IOError, OSError, ValueError) as ex:
+            print("Query %s failed: %s" % (config[view_key], ex))
+            continue
+        if couch_latency.write_latency(filename, config[view_key], histogram):
+            print("Dispatch latency of %d documents saved to %s" % (histogram.count, filename))
+    client.close()
 
 
 def collect_dispatch_data():
+    if config.get("DISPATCH_LATENCY", "script") == "native":
+        collect_dispatch_latency()
+        return
     # Just in case to create, may exist already, but no harm
     cmd_line = "./dispatch_latency/couch_query_postdispatch.sh %s %s" % (node_settings["IPS"].split(",")[0], node_settings["COUCH_PW"])
     cmd_line += " > %s%s" % (node_settings["HOSTS"].split(",")[0], config["FILE_POST_POSTDISPATCH_LATENCY"])
@@ -233,12 +917,154 @@ def collect_dispatch_data():
         time.sleep(0.1)
 
 
-def main():
-    global hostname, config, node_settings
+def wait_start(start_at):
+    """sleep until the start time shared by all nodes."""
+    delay = start_at - time.time()
+    if delay > 0:
+        print("waiting %.3f seconds for synchronized start" % delay)
+        time.sleep(delay)
+    print("start skew: %.3f seconds" % (time.time() - start_at))
+
+
+def start_stream():
+    """keep stdout for sample frames, send everything printed to stderr."""
+    global stream_fd
+    sys.stdout.flush()
+    stream_fd = os.dup(1)
+    os.dup2(2, 1)
+
+
+def read_proc_profile(pid="self"):
+    """cpu seconds, peak rss, context switches and io of a process from /proc."""
+    with open("/proc/%s/stat" % pid) as fl:
+        stat = fl.read().rsplit(")", 1)[1].split()
+    ticks = os.sysconf("SC_CLK_TCK")
+    profile = {"cpu_user_sec": int(stat[11]) / ticks, "cpu_sys_sec": int(stat[12]) / ticks}
+    with open("/proc/%s/status" % pid) as fl:
+        status = dict(line.split(":", 1) for line in fl if ":" in line)
+    profile["max_rss_kb"] = int(status.get("VmHWM", "0 kB").split()[0])
+    profile["vol_ctxt"] = int(status.get("voluntary_ctxt_switches", 0))
+    profile["invol_ctxt"] = int(status.get("nonvoluntary_ctxt_switches", 0))
+    try:
+        with open("/proc/%s/io" % pid) as fl:
+            io = dict(line.split(":", 1) for line in fl if ":" in line)
+        for name in ("rchar", "wchar", "read_bytes", "write_bytes"):
+            profile[name] = int(io[name])
+    except (IOError, KeyError):
+        # io accounting is not available in every kernel
+        pass
+    return profile
+
+
+def write_self_profile(name, started, pid="self", children=True):
+    """append what a collector process cost so far to the self profile log.
+
+    The io counters of a process include those of the processes it has
+    waited for. With children the cpu, peak rss and context switches of
+    the commands it ran, sar/iostat/docker/kubectl, are added from its
+    child rusage.
+    """
+    try:
+        record = dict(read_proc_profile(pid), ts=time.time(), monitor=name,
+                      pid=os.getpid() if pid == "self" else pid, wall_sec=time.time() - started)
+    except (IOError, ValueError, IndexError) as ex:
+        print("Profile of %s failed: %s" % (name, ex))
+        return
+    if children:
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        record.update(child_cpu_user_sec=usage.ru_utime, child_cpu_sys_sec=usage.ru_stime,
+                      child_max_rss_kb=usage.ru_maxrss, child_vol_ctxt=usage.ru_nvcsw,
+                      child_invol_ctxt=usage.ru_nivcsw)
+    fd = os.open(hostname + config.get("FILE_POST_SELF_PROFILE", "_self_profile.log"),
+                 os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, (json.dumps(record) + "\n").encode())
+    finally:
+        os.close(fd)
+
+
+def run_profiled(name, target, args):
+    """run a monitor, then record its own cost and that of its commands."""
+    # the handlers of the collector only set stop_event, which a monitor blocked
+    # in a command never looks at; terminate() has to end it. Ctrl-C reaches the
+    # whole process group, the monitors stop on the stop_event it sets instead.
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    started = time.time()
+    try:
+        target(*args)
+    finally:
+        write_self_profile(name, started)
+
+
+def monitor_process(name, target, args):
+    return Process(target=run_profiled, args=(name, target, args), name=name)
+
+
+def request_stop(signum, frame):
+    stop_event.set()
+
+
+def run_monitors(monitors, stop_file, aggregator=None):
+    """run monitors until they are done, stopping them all on a stop request.
+
+    The run stops on SIGTERM or SIGINT, or when stop_file shows up. A
+    monitor still alive STOP_GRACE_SEC after the stop, or after the end of
+    the load time, is terminated, and killed if it is still alive
+    STOP_KILL_SEC later. The sample rings are drained meanwhile.
+    """
+    for monitor in monitors:
+        monitor.start()
+    stopped_at = None
+    while any(monitor.is_alive() for monitor in monitors):
+        if not stop_event.is_set() and os.path.exists(stop_file):
+            print("%s found" % stop_file)
+            stop_event.set()
+        if stop_event.is_set() and stopped_at is None:
+            print("stopping all monitors")
+            stopped_at = time.time()
+        if time.time() > (stopped_at or run_deadline) + STOP_GRACE_SEC:
+            for monitor in monitors:
+                if monitor.is_alive():
+                    print("monitor %s did not stop, terminate it" % monitor.name)
+                    monitor.terminate()
+            break
+        if aggregator is not None:
+            aggregator.drain()
+        time.sleep(0.5)
+    for monitor in monitors:
+        monitor.join(STOP_KILL_SEC)
+        if monitor.is_alive():
+            print("monitor %s did not terminate, kill it" % monitor.name)
+            monitor.kill()
+            monitor.join(STOP_KILL_SEC)
+    if aggregator is not None:
+        aggregator.close()
+
+
+def main(argv):
+    global hostname, config, node_settings, stop_event, run_origin, run_deadline
+    try:
+        opts, args = getopt.getopt(argv, "s:", ["start-at=", "stream"])
+    except getopt.GetoptError:
+        print("collect_node.py [--start-at epoch_seconds] [--stream]")
+        sys.exit(2)
+    start_at = None
+    stream = False
+    for opt, arg in opts:
+        if opt in ("-s", "--start-at"):
+            start_at = float(arg)
+        elif opt == "--stream":
+            stream = True
+    if stream:
+        start_stream()
+
     path = NODE_RUN_PATH
     hostname = os.uname()[1]
     os.chdir(path)
     os.system('rm *.log')
+    # series files are appended to, so drop those of an earlier run
+    os.system('rm -f *%s' % timeseries.TS_POST)
 
     try:
         with open(COLLECT_CONFIG_YML_FILE, "r") as file:
@@ -262,8 +1088,15 @@ def main():
     datasize = "medium"
     target_dir = "/home/bench/performance/{0}/{1}/{2}/".format(date, data_type, datasize)
     # load time in seconds
-    load_time_in_sec = 3600
-    interval_in_sec = 1
+    load_time_in_sec = config.get("LOAD_TIME_IN_SEC", 3600)
+    intervals = dict(DEFAULT_INTERVALS, **(config.get("INTERVALS") or {}))
+    stop_file = config.get("STOP_FILE", "collect_node.stop")
+    if os.path.exists(stop_file):
+        os.remove(stop_file)
+    # a summary left by an earlier run would be parsed instead of the logs of this one
+    summary_file = hostname + config.get("FILE_POST_SUMMARY", timeseries.SUMMARY_POST)
+    if os.path.exists(summary_file):
+        os.remove(summary_file)
 
     hostnames = node_settings["HOSTS"].split(",")
     NIC = []
@@ -288,10 +1121,6 @@ def main():
         if match is True:
             break
 
-    max_thread_time = load_time_in_sec
-
-    lock = Lock()
-
     try:
         os.makedirs(target_dir, exist_ok=True)
     except:
@@ -299,44 +1128,47 @@ def main():
     csv_file = target_dir + 'Performace.csv'
     print(f"CVSFILE PATH : {csv_file}")
 
-    manager = Manager()
-    shared_dict = manager.dict()
+    containers = monitor_process("containers", monitor_containers, (node_settings["CONTAINERS"], target_dir + 'docker_stats',
+                                                                     config.get("CONTAINER_INTERVAL_SEC", 10), load_time_in_sec))
+    kube_top = monitor_process("kube_top", monitor_kube_top, (intervals['kube_top'], load_time_in_sec, target_dir +'kube_top'))
+    cpu = monitor_process("cpu", monitor_cpu, (intervals['cpu'], load_time_in_sec, target_dir +'cpu'))
+    mem = monitor_process("memory", monitor_memory, (intervals['memory'], load_time_in_sec, target_dir +'mem'))
+    network = monitor_process("network", monitor_network, (intervals['network'], load_time_in_sec, NIC, target_dir +'network'))
+    diskIO_block = monitor_process("diskIO_block", monitor_diskIO_block, (intervals['diskIO_block'], load_time_in_sec, target_dir +'diskIO_block'))
+    disk_io_all_part = monitor_process("disk_io_all_part", monitor_disk_io_all_part, (intervals['disk_io_all_part'], load_time_in_sec, target_dir +'disk_io_all_part'))
+    iostat = monitor_process("iostat", monitor_iostat, (intervals['iostat'], load_time_in_sec, target_dir +'iostat'))
 
-    containers = Process(target=monitor_containers, args=(node_settings["CONTAINERS"], target_dir + 'docker_stats'))
-    kube_top = Process(target=monitor_kube_top, args=(interval_in_sec, load_time_in_sec, shared_dict, lock, target_dir +'kube_top'))
-    cpu = Process(target=monitor_cpu, args=(interval_in_sec, load_time_in_sec, shared_dict, lock, target_dir +'cpu'))
-    mem = Process(target=monitor_memory, args=(interval_in_sec, load_time_in_sec, shared_dict, lock, target_dir +'mem'))
-    network = Process(target=monitor_network, args=(interval_in_sec, load_time_in_sec, NIC, shared_dict, lock, target_dir +'network'))
-    diskIO_block = Process(target=monitor_diskIO_block, args=(interval_in_sec, load_time_in_sec, shared_dict, lock, target_dir +'diskIO_block'))
-    disk_io_all_part = Process(target=monitor_disk_io_all_part, args=(interval_in_sec, load_time_in_sec, shared_dict, lock, target_dir +'disk_io_all_part'))
-    iostat = Process(target=monitor_iostat, args=(interval_in_sec, load_time_in_sec, shared_dict, lock, target_dir +'iostat'))
+    stop_event = Event()
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+    if start_at is not None:
+        wait_start(start_at)
+    # every monitor ticks from here, on all nodes when started together
+    run_origin = start_at if start_at is not None else time.time()
+    run_deadline = run_origin + load_time_in_sec
 
+    monitors = []
     if hostname == node_settings["HOSTS"].split(",")[0]:
         print('****starting kube top')
-        kube_top.start()
-    cpu.start()
-    mem.start()
-    network.start()
-    diskIO_block.start()
-    disk_io_all_part.start()
-    iostat.start()
-    containers.start()
+        monitors.append(kube_top)
+    if config.get("SAMPLER", "sar") == "proc":
+        monitors.append(monitor_process("proc", monitor_proc, (intervals, load_time_in_sec, NIC, target_dir)))
+    else:
+        monitors.extend([cpu, mem, network, diskIO_block, disk_io_all_part, iostat])
+    monitors.append(containers)
 
-    if hostname == node_settings["HOSTS"].split(",")[0]:
-        print('****joining kube top')
-        kube_top.join(timeout=max_thread_time)
-    cpu.join(timeout=max_thread_time)
-    mem.join(timeout=max_thread_time)
-    network.join(timeout=max_thread_time)
-    diskIO_block.join(timeout=max_thread_time)
-    disk_io_all_part.join(timeout=max_thread_time)
-    iostat.join(timeout=max_thread_time)
-    containers.join(timeout=max_thread_time)
+    aggregator = None
+    if recording():
+        for monitor in monitors:
+            rings[monitor.name] = timeseries.SampleRing(config.get("RING_SLOTS", timeseries.RING_SLOTS))
+        aggregator = RingAggregator(rings, config.get("LIVE_SUMMARY_SEC", 60))
+    run_monitors(monitors, stop_file, aggregator)
 
     if hostname == node_settings["HOSTS"].split(",")[0]:
         collect_dispatch_data()
 
+    write_self_profile("collector", start_time, children=False)
     print(f"Script took {time.time()-start_time} seconds to finish")
 
 if __name__ == "__main__":
-    main()
+    main(sys.argv[1:])
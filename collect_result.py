@@ -8,7 +8,9 @@
 # with the terms and conditions stipulated in the agreement/contract
 # under which the software has been supplied.
 
-from pexpect import pxssh
+import collections
+import fnmatch
+import datetime
 import getpass
 import ipaddress
 import os
@@ -22,14 +24,25 @@ import shutil
 import socket
 import subprocess
 from subprocess import *
+import stat
 import sys
+import tarfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import getopt
+import json
 import yaml
 import parse_output
+import run_history
+import timeseries
 
 SSH_KEY_PATH = '~/.ssh'
 SSH_KEY_FILE = 'id_rsa'
+SSH_USER = 'root'
+SSH_KEEPALIVE_SEC = 30
 node_proc = []
+ssh_pool = {}
+sftp_pool = {}
 
 NODE_RUN_PATH = "/var/tmp/node_stat"
 FILE_POST_CPU_INFO = "_cpu_info.log"
@@ -41,6 +54,11 @@ FILE_POST_NETWORK_INFO = "_network_info.log"
 FILE_POST_DOCKER_STATS_INFO = "_docker_stats.log"
 NODE_CONFIG_YML_FILE = "node_config.yml"
 COLLECT_CONFIG_YML_FILE = "collect_config.yml"
+RESULT_PATTERNS = "*log *.ts *_summary.bin"
+SUMMARY_RESULT_PATTERNS = "*_summary.bin *_latency.log *_self_profile.log"
+CLOCK_PROBES = 8
+NODE_CACHE_FILE = "node_cache.json"
+NODE_CACHE_TTL_SEC = 24 * 3600
 
 config = {}
 hostnames = []
@@ -49,40 +67,149 @@ hosts = {}
 node_settings = {}
 
 
-def check_ssh_conn(key, server, username):
-    """copy ssh key to remote host."""
+class PooledProc(object):
+    """Popen-like handle of a command running on a pooled ssh channel."""
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.stdin = channel.makefile_stdin('wb')
+        self.stdout = channel.makefile('rb')
+        self.stderr = channel.makefile_stderr('rb')
+        self.returncode = None
+        self.started = time.time()
+
+    def poll(self):
+        if self.returncode is None and self.channel.exit_status_ready():
+            self.returncode = self.channel.recv_exit_status()
+        return self.returncode
+
+    def wait(self):
+        if self.returncode is None:
+            self.returncode = self.channel.recv_exit_status()
+        return self.returncode
+
+
+def split_address(server, port=22):
+    """(host, port) of a node address, an ip or hostname optionally followed by :port."""
+    host, sep, tail = server.rpartition(":")
+    if sep and tail.isdigit() and (":" not in host or host.startswith("[")):
+        return host.strip("[]"), int(tail)
+    return server, port
+
+
+def node_address(host, port=22):
+    """ip[:port] of a node to ssh to, the port is left out when it is 22."""
+    port = int(port)
+    if port == 22:
+        return host
+    return ("[%s]:%d" if ":" in host else "%s:%d") % (host, port)
+
+
+def settings_addresses(settings):
+    """ip[:port] of the nodes of node_config, hosts in IPS and their ssh ports in SSH_PORTS."""
+    ports = [port for port in str(settings.get("SSH_PORTS") or "").split(",") if port.strip()]
+    addresses = []
+    for i, ip in enumerate(settings["IPS"].split(",")):
+        host, port = split_address(ip, int(ports[i]) if i < len(ports) else 22)
+        addresses.append(node_address(host, port))
+    return addresses
+
+
+def connect_ssh_client(server, username, key=None):
+    """open ssh client to remote host, server may be ip:port."""
+    host, port = split_address(server)
     # here is workaround to the known issue
     # https://github.com/paramiko/paramiko/issues/1369
     with warnings.catch_warnings():
         warnings.simplefilter("ignore")
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect(host, port=port, username=username, key_filename=key)
+    client.get_transport().set_keepalive(SSH_KEEPALIVE_SEC)
+    return client
+
+
+def check_ssh_conn(key, server, username):
+    """check ssh key login to remote host, keep the connection in the pool."""
+    try:
+        client = connect_ssh_client(server, username, key)
+    except Exception as e:
+        print('failed to connect server {} because of error: [{}].'.format(
+            server, str(e)))
+        return False
+    close_ssh_conn(server)
+    ssh_pool[server] = client
+    return True
+
+
+def get_ssh_client(ip, username=SSH_USER):
+    """get pooled ssh client of remote host. connect it if not exists."""
+    client = ssh_pool.get(ip)
+    if client is not None:
+        transport = client.get_transport()
+        if transport is not None and transport.is_active():
+            return client
+        close_ssh_conn(ip)
+    key = os.path.join(os.path.expanduser(SSH_KEY_PATH), SSH_KEY_FILE)
+    client = connect_ssh_client(ip, username, key if os.path.exists(key) else None)
+    ssh_pool[ip] = client
+    return client
+
+
+def get_sftp(ip):
+    """get pooled sftp session of remote host."""
+    sftp = sftp_pool.get(ip)
+    if sftp is None or sftp.get_channel().closed:
+        sftp = get_ssh_client(ip).open_sftp()
+        sftp_pool[ip] = sftp
+    return sftp
+
+
+def sftp_put(ip, local, remote):
+    """copy local file or directory to remote host, keep mode and times."""
+    sftp = get_sftp(ip)
+    st = os.stat(local)
+    if os.path.isdir(local):
         try:
-            client = paramiko.SSHClient()
-            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            client.connect(server, username=username, key_filename=key)
-            return True
-        except Exception as e:
-            print('failed to connect server {} because of error: [{}].'.format(
-                server, str(e)))
-            return False
+            sftp.mkdir(remote)
+        except IOError:
+            pass
+        for name in os.listdir(local):
+            sftp_put(ip, os.path.join(local, name), "%s/%s" % (remote, name))
+    else:
+        sftp.put(local, remote)
+    sftp.chmod(remote, stat.S_IMODE(st.st_mode))
+    sftp.utime(remote, (st.st_atime, st.st_mtime))
+
+
+def close_ssh_conn(ip):
+    sftp = sftp_pool.pop(ip, None)
+    if sftp is not None:
+        sftp.close()
+    client = ssh_pool.pop(ip, None)
+    if client is not None:
+        client.close()
+
+
+def close_ssh_pool():
+    for ip in list(ssh_pool.keys()):
+        close_ssh_conn(ip)
 
 
 def get_remote_hostname(ip, user):
-    """get hostname of remote server."""
-    cmd = 'hostname'
+    """get hostname of remote server over its pooled ssh connection."""
     try:
-        s = pxssh.pxssh(options={
-            "StrictHostKeyChecking": "no",
-            "UserKnownHostsFile": "/dev/null"})
-        s.login(ip, user)
-        s.sendline(cmd)
-        s.prompt()
-        res = s.before.decode("utf-8")
-        s.logout()
-        return res.splitlines()[1]
-    except pxssh.ExceptionPxssh as e:
+        channel = get_ssh_client(ip, user).get_transport().open_session()
+        channel.exec_command('hostname')
+        res = channel.makefile('rb').read().decode("utf-8").strip()
+        status = channel.recv_exit_status()
+    except (paramiko.SSHException, socket.error) as e:
         print("failed to ssh into {} with user: {}.".format(ip, user))
         print(e)
         return None
+    if status != 0 or not res:
+        return None
+    return res.splitlines()[0]
 
 
 def get_ssh_key():
@@ -97,7 +224,8 @@ def get_ssh_key():
 
 def push_ssh_key(key, host, username, password):
     """copy ssh key to remote host."""
-    cmd = '/usr/bin/ssh-copy-id -i %s %s@%s' % (key, username, host)
+    server, port = split_address(host)
+    cmd = '/usr/bin/ssh-copy-id -i %s -p %d %s@%s' % (key, port, username, server)
     child = pexpect.spawn(cmd)
     flag = False
     try:
@@ -134,15 +262,103 @@ def gen_ssh_key():
     subprocess.call(cmd, shell=True)
 
 
-def nodes_init(docker_stats_str=""):
-    """ set nodes number and get node IP / hostname """
+def load_node_cache(path, ttl):
+    """{ip: entry} of the cached nodes verified less than ttl seconds ago."""
+    try:
+        with open(path, "r") as fl:
+            cache = json.load(fl)
+    except (IOError, ValueError):
+        return {}
+    now = time.time()
+    return {ip: entry for ip, entry in cache.items()
+            if now - entry.get("verified", 0) < ttl and entry.get("key") and entry.get("hostname")}
+
+
+def save_node_cache(path, entries):
+    try:
+        with open(path, "r") as fl:
+            cache = json.load(fl)
+    except (IOError, ValueError):
+        cache = {}
+    cache.update(entries)
+    try:
+        with open(path, "w") as fl:
+            json.dump(cache, fl, indent=1)
+    except IOError as ex:
+        print("Write %s failed" % path)
+
+
+def probe_node(ip, key, password=None, user=SSH_USER):
+    """(hostname, key installed) of a node, its key is pushed with password if it is not yet."""
+    private_key = key[:-len(".pub")]
+    if not check_ssh_conn(private_key, ip, user):
+        if not password:
+            return None, False
+        if not push_ssh_key(key, ip, user, password) or not check_ssh_conn(private_key, ip, user):
+            return None, False
+    return get_remote_hostname(ip, user), True
+
+
+def discover_nodes(nodes, password=None):
+    """{ip: hostname} of nodes, probed all at once, None if any of them failed.
+
+    A node found in NODE_CACHE_FILE with its key installed and its hostname
+    verified less than NODE_CACHE_TTL_SEC ago is not connected to at all.
+    """
+    start = time.time()
+    cache_file = config.get("NODE_CACHE_FILE", NODE_CACHE_FILE)
+    cached = load_node_cache(cache_file, config.get("NODE_CACHE_TTL_SEC", NODE_CACHE_TTL_SEC))
+    found = {ip: cached[ip]["hostname"] for ip in nodes if ip in cached}
+    probe = [ip for ip in nodes if ip not in found]
+    failed = []
+    if probe:
+        key = get_ssh_key()
+        with ThreadPoolExecutor(max_workers=len(probe)) as executor:
+            results = dict(zip(probe, executor.map(lambda ip: probe_node(ip, key, password), probe)))
+        verified = time.time()
+        save_node_cache(cache_file, {ip: {"hostname": name, "key": installed, "verified": verified}
+                                     for ip, (name, installed) in results.items() if name})
+        for ip, (name, installed) in results.items():
+            if name:
+                found[ip] = name
+            else:
+                failed.append(ip)
+                print("node %s: %s" % (ip, "no hostname" if installed else "ssh key login failed"))
+    print("%d nodes discovered, %d from cache, in %.3f seconds" % (
+        len(found), len(nodes) - len(probe), time.time() - start))
+    if failed:
+        return None
+    return found
+
+
+def read_inventory(path):
+    """(nodes, couch password, ssh password) of an inventory file.
+
+    The file is yaml, either a list of ip[:port] or a mapping of NODES, a
+    list or a comma separated string, with optional COUCH_PW and
+    SSH_PASSWORD.
+    """
+    with open(path, "r") as fl:
+        inventory = yaml.safe_load(fl) or []
+    if isinstance(inventory, list):
+        return [str(node).strip() for node in inventory], None, None
+    nodes = inventory.get("NODES", [])
+    if isinstance(nodes, str):
+        nodes = nodes.split(",")
+    return ([str(node).strip() for node in nodes if str(node).strip()],
+            inventory.get("COUCH_PW"), inventory.get("SSH_PASSWORD"))
+
+
+def nodes_init(docker_stats_str="", nodes=None, couch_pw=None, ssh_password=None):
+    """ set nodes number and get node IP / hostname
+
+    Given nodes, a list of ip[:port], they are discovered in batch by
+    discover_nodes without any prompt.
+    """
     global hostnames, ips, node_settings
     global ips
     hosts_str = ""
-    ips_str = ""
     new_hosts_str = ""
-    new_ips_str = ""
-    couch_pw = ""
     need_update = True
 
     if os.path.exists(NODE_CONFIG_YML_FILE):
@@ -150,15 +366,26 @@ def nodes_init(docker_stats_str=""):
             node_settings = yaml.safe_load(file)
             file.close()
 
-    if len(node_settings) > 0:
+    if nodes:
+        found = discover_nodes(nodes, ssh_password)
+        if found is None:
+            return False
+        ips = list(nodes)
+        hostnames = [found[ip] for ip in ips]
+        new_hosts_str = ",".join(hostnames)
+        if couch_pw is not None:
+            node_settings["COUCH_PW"] = couch_pw
+        node_settings.setdefault("COUCH_PW", "")
+        for i in range(len(ips)):
+            print("node %d, host %s, ip %s" % (i + 1, hostnames[i], ips[i]))
+        need_update = False
+    elif len(node_settings) > 0:
         hosts_str = node_settings["HOSTS"]
-        ips_str = node_settings["IPS"]
         new_hosts_str = hosts_str
-        new_ips_str = ips_str
         docker_str = node_settings["CONTAINERS"]
         hostnames = hosts_str.split(",")
         couch_pw = node_settings["COUCH_PW"]
-        ips = ips_str.split(",")
+        ips = settings_addresses(node_settings)
         print("Couch PW: %s" % couch_pw)
         for i in range(len(ips)):
             print("node %d, host %s, ip %s" % (i + 1, hostnames[i], ips[i]))
@@ -173,7 +400,6 @@ def nodes_init(docker_stats_str=""):
 
     if need_update is True:
         new_hosts_str = ""
-        new_ips_str = ""
         hostnames = []
         ips = []
         os.system('clear')
@@ -188,7 +414,7 @@ def nodes_init(docker_stats_str=""):
                 os.system('clear')
                 ip = input("input ip address for node {}: ".format(node_num))
                 try:
-                    ipaddress.ip_address(ip)
+                    ipaddress.ip_address(split_address(ip)[0])
                 except Exception:
                     input("invalid ip address: %s. press any key to continue..." % ip)
                     continue
@@ -207,15 +433,16 @@ def nodes_init(docker_stats_str=""):
                 hostnames.append(hostname)
                 ips.append(ip)
                 new_hosts_str += hostname
-                new_ips_str += ip
                 if node_num != nodes_num:
                     new_hosts_str += ","
-                    new_ips_str += ","
                 break
             node_num = node_num + 1
         node_settings["COUCH_PW"] = input("input password for couchdb: ")
     node_settings["HOSTS"] = new_hosts_str
-    node_settings["IPS"] = new_ips_str
+    # the nodes match IPS against their own addresses and reach CouchDB at it,
+    # so it holds bare hosts and the ssh ports are kept apart
+    node_settings["IPS"] = ",".join(split_address(ip)[0] for ip in ips)
+    node_settings["SSH_PORTS"] = ",".join(str(split_address(ip)[1]) for ip in ips)
     node_settings["CONTAINERS"] = docker_stats_str
 
     for i in range(len(ips)):
@@ -238,22 +465,22 @@ def collect_docker_ps(container_name):
 
 
 def ssh_and_cmd(ip, cmd, block=True, stdout_collect=True, stderr_collect=True):
-    str_cmd = "ssh root@%s %s" % (ip, cmd)
+    str_cmd = "ssh %s@%s %s" % (SSH_USER, ip, cmd)
     print(str_cmd)
     print(block)
     try:
-        proc = Popen(str_cmd.split(), stdin=PIPE, stdout=PIPE, stderr=PIPE)
-        #print(proc.stderr.readlines())
+        channel = get_ssh_client(ip).get_transport().open_session()
+        channel.exec_command(cmd)
+        proc = PooledProc(channel)
         if (block == True):
-            while (proc.poll() == None):
-                time.sleep(0.1)
+            proc.wait()
         return True, proc
-    except subprocess.CalledProcessError as err:
-        print("ssh root@%s %s failed" % (ip, cmd))
-        return False, proc
+    except (paramiko.SSHException, socket.error) as err:
+        print("%s failed: %s" % (str_cmd, err))
+        return False, None
 
 
-def node_run(ip):
+def node_deploy(ip):
     global config
     path = config["NODE_RUN_PATH"]
     """
@@ -277,32 +504,35 @@ def node_run(ip):
         print("sync in %s failed" % ip)
         return False, proc
 
-    str_cmd = "scp collect_node.py node_config.yml collect_config.yml root@%s:%s/" % (ip, path)
-    print(str_cmd)
-    try:
-        proc = Popen(str_cmd.split(), stdin=PIPE, stdout=PIPE, stderr=PIPE)
-    except subprocess.CalledProcessError as err:
-        error = proc.stderr.readlines()
-        print(error)
-        return False, proc
-
-    str_cmd = "scp -pr dispatch_latency root@%s:%s/" % (ip, path)
-    print(str_cmd)
-    try:
-        proc = Popen(str_cmd.split(), stdin=PIPE, stdout=PIPE, stderr=PIPE)
-    except subprocess.CalledProcessError as err:
-        error = proc.stderr.readlines()
-        print(error)
-        return False, proc
+    for local in ["collect_node.py", "timeseries.py", "couch_latency.py", "kube_metrics.py", NODE_CONFIG_YML_FILE,
+                  COLLECT_CONFIG_YML_FILE, "dispatch_latency"]:
+        if not os.path.exists(local):
+            print("%s not found, skip copying it to %s" % (local, ip))
+            continue
+        print("sftp put %s %s:%s/" % (local, ip, path))
+        try:
+            sftp_put(ip, local, "%s/%s" % (path, local))
+        except (IOError, OSError, paramiko.SSHException) as err:
+            print("copy %s to %s failed: %s" % (local, ip, err))
+            return False, None
 
     str_cmd = "sync %s" % path
     print(str_cmd)
-    result, proc = ssh_and_cmd(ip, str_cmd, block=False)
+    result, proc = ssh_and_cmd(ip, str_cmd)
     if result is False:
         print("sync in %s failed" % ip)
         return False, proc
+    return True, proc
+
 
+def node_start(ip, start_at=None):
+    global config
+    path = config["NODE_RUN_PATH"]
     str_cmd = "python3 %s/collect_node.py" % path
+    if start_at is not None:
+        str_cmd += " --start-at %.3f" % start_at
+    if config.get("STREAM_TELEMETRY", False):
+        str_cmd += " --stream"
     print(str_cmd)
     result, proc = ssh_and_cmd(ip, str_cmd, block=False)
     if result is False:
@@ -311,6 +541,174 @@ def node_run(ip):
     return True, proc
 
 
+def node_run(ip):
+    result, proc = node_deploy(ip)
+    if result is False:
+        return False, proc
+    return node_start(ip)
+
+
+def nodes_launch(ips):
+    """deploy all nodes in parallel, then start the collectors together.
+
+    Every deploy thread waits on a barrier, the last one to arrive picks a
+    common start time START_DELAY_SEC ahead, and each collector sleeps until
+    that moment, so the sampling windows begin within the clock skew of the
+    nodes rather than the deploy time of the slowest one.
+    """
+    start = {}
+    if not ips:
+        return {}
+
+    def set_start_time():
+        start["at"] = time.time() + float(config.get("START_DELAY_SEC", 5))
+
+    barrier = threading.Barrier(len(ips), action=set_start_time)
+
+    def launch(ip):
+        try:
+            result, proc = node_deploy(ip)
+        except (IOError, OSError, EOFError, paramiko.SSHException) as err:
+            print("deploy to %s failed: %s" % (ip, err))
+            result, proc = False, None
+        except BaseException:
+            # never leave the other nodes waiting for this one
+            barrier.abort()
+            raise
+        try:
+            barrier.wait(config.get("DEPLOY_TIMEOUT_SEC", 600))
+        except threading.BrokenBarrierError:
+            print("not all nodes were deployed in time, %s is not started" % ip)
+            return False, proc
+        if result is False:
+            return False, proc
+        return node_start(ip, start["at"])
+
+    procs = {}
+    with ThreadPoolExecutor(max_workers=len(ips)) as executor:
+        futures = {ip: executor.submit(launch, ip) for ip in ips}
+        for ip, future in futures.items():
+            try:
+                result, proc = future.result()
+            except Exception as err:
+                print("deploy to %s failed: %s" % (ip, err))
+                result = False
+            if result is False:
+                print("node_run failed in %s" % ip)
+            else:
+                procs[ip] = proc
+    if "at" in start:
+        print("collectors start at %s" % time.ctime(start["at"]))
+    return procs
+
+
+def measure_clock_offset(ip, probes=CLOCK_PROBES):
+    """(offset, rtt) of the node clock against this one, offset = node - controller.
+
+    The node answers each probe with its time on one open channel, the
+    probe with the shortest round trip gives the offset, assuming its
+    reply was taken half way.
+    """
+    best = None
+    try:
+        channel = get_ssh_client(ip).get_transport().open_session()
+        channel.exec_command("while read line; do date +%s.%N; done")
+        stdin = channel.makefile_stdin('wb')
+        stdout = channel.makefile('rb')
+        for _ in range(probes):
+            sent = time.time()
+            stdin.write(b"\n")
+            stdin.flush()
+            remote = float(stdout.readline())
+            received = time.time()
+            if best is None or received - sent < best[1]:
+                best = (remote - (sent + received) / 2, received - sent)
+        channel.close()
+    except (paramiko.SSHException, socket.error, ValueError) as err:
+        print("measure clock of %s failed: %s" % (ip, err))
+    return best
+
+
+def measure_clock_offsets(ips):
+    """measure the clock offset of every node, saved for the time-series merge."""
+    offsets = {}
+    with ThreadPoolExecutor(max_workers=max(len(ips), 1)) as executor:
+        for ip, best in zip(ips, executor.map(measure_clock_offset, ips)):
+            if best is not None:
+                offsets[hosts[ip]] = {"ip": ip, "offset": best[0], "rtt": best[1]}
+                print("%s clock offset %+.3f ms, rtt %.3f ms" % (hosts[ip], best[0] * 1000, best[1] * 1000))
+    with open(parse_output.CLOCK_OFFSETS_FILE, "w") as fl:
+        json.dump(offsets, fl, indent=1)
+    return offsets
+
+
+class CountingReader(object):
+    """file wrapper counting the bytes read through it."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.count = 0
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.count += len(data)
+        return data
+
+
+def result_patterns():
+    """patterns of the result files fetched from a node.
+
+    With NODE_SUMMARY the metric logs are left on the node, the run summary
+    stands for them, and the .ts files are only wanted for the merged grid.
+    """
+    if not config.get("NODE_SUMMARY", False) or config.get("FETCH_RAW_LOGS", False):
+        return RESULT_PATTERNS
+    if config.get("MERGE_STEP_SEC"):
+        return SUMMARY_RESULT_PATTERNS + " *.ts"
+    return SUMMARY_RESULT_PATTERNS
+
+
+def fetch_tar_stream(ip, path, local_dir):
+    """stream the result logs of remote host as one compressed tar."""
+    str_cmd = "cd %s && tar czf - --ignore-failed-read %s" % (path, result_patterns())
+    print("ssh %s@%s %s" % (SSH_USER, ip, str_cmd))
+    channel = get_ssh_client(ip).get_transport().open_session()
+    channel.exec_command(str_cmd)
+    reader = CountingReader(channel.makefile('rb'))
+    files = 0
+    size = 0
+    with tarfile.open(fileobj=reader, mode='r|gz') as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            if hasattr(tarfile, 'data_filter'):
+                tar.extract(member, local_dir, filter='data')
+            else:
+                tar.extract(member, local_dir)
+            files += 1
+            size += member.size
+    status = channel.recv_exit_status()
+    if status != 0:
+        raise IOError("tar exited with %d: %s" % (
+            status, channel.makefile_stderr('rb').read().decode().strip()))
+    return files, size, reader.count
+
+
+def fetch_sftp(ip, path, local_dir):
+    """copy the result logs of remote host file by file over one sftp session."""
+    sftp = get_sftp(ip)
+    files = 0
+    size = 0
+    for f in sftp.listdir(path):
+        if not any(fnmatch.fnmatch(f, p) for p in result_patterns().split()):
+            continue
+        print("sftp get %s:%s/%s %s/" % (ip, path, f, local_dir))
+        sftp.get("%s/%s" % (path, f), "%s/%s" % (local_dir, f))
+        files += 1
+        size += os.path.getsize("%s/%s" % (local_dir, f))
+    return files, size, size
+
+
 def copy_result_to_local(ip, hostname):
     global config
     path = config["NODE_RUN_PATH"]
@@ -329,27 +727,161 @@ def copy_result_to_local(ip, hostname):
     print(cmd)
     os.mkdir("./%s" % hostname)
 
-    str_cmd = "ls %s/*log" % path
-    result, proc = ssh_and_cmd(ip, str_cmd)
+    start = time.time()
+    try:
+        files, size, transferred = fetch_tar_stream(ip, path, "./%s" % hostname)
+    except (IOError, EOFError, tarfile.TarError, paramiko.SSHException) as err:
+        print("tar stream from %s failed: %s, fall back to sftp" % (ip, err))
+        try:
+            files, size, transferred = fetch_sftp(ip, path, "./%s" % hostname)
+        except (IOError, paramiko.SSHException) as err:
+            print("copy result from %s failed: %s" % (ip, err))
+            return False, None
+    elapsed = time.time() - start
+    return True, {"host": hostname, "files": files, "size": size,
+                  "transferred": transferred, "seconds": elapsed}
+
+
+def print_transfer_summary(summaries):
+    print("%-20s %6s %12s %12s %9s %10s" % (
+        "HOST", "FILES", "SIZE(MB)", "WIRE(MB)", "TIME(s)", "MB/s"))
+    for s in summaries:
+        mb = s["transferred"] / (1024 * 1024)
+        print("%-20s %6d %12.3f %12.3f %9.3f %10.3f" % (
+            s["host"], s["files"], s["size"] / (1024 * 1024), mb, s["seconds"],
+            mb / s["seconds"] if s["seconds"] > 0 else 0))
+
+
+class TelemetryBoard(object):
+    """rolling per-node view of the samples streamed by the collectors."""
+
+    def __init__(self, window_sec=60):
+        self.window_sec = window_sec
+        self.lock = threading.Lock()
+        self.nodes = {}
+
+    def add(self, host, metric, key, columns, ts, values):
+        with self.lock:
+            node = self.nodes.setdefault(host, {"samples": 0, "received": 0.0, "series": {}})
+            node["samples"] += 1
+            node["received"] = time.time()
+            rows = node["series"].setdefault((metric, key), collections.deque())
+            rows.append((ts, dict(zip(columns, values))))
+            while rows[0][0] < ts - self.window_sec:
+                rows.popleft()
+
+    @staticmethod
+    def rolling_means(node):
+        means = {}
+        for series, rows in node["series"].items():
+            fields = rows[-1][1].keys()
+            means[series] = {f: sum(row[f] for _, row in rows) / len(rows) for f in fields}
+        return means
+
+    def report(self):
+        now = time.time()
+        with self.lock:
+            print("%-20s %8s %6s " % ("HOST", "SAMPLES", "AGE(s)") +
+                  " ".join("%10s" % name for name, _, _, _ in timeseries.HEADLINES))
+            for host in sorted(self.nodes):
+                node = self.nodes[host]
+                print("%-20s %8d %6.1f " % (host, node["samples"], now - node["received"]) +
+                      " ".join("%10s" % ("-" if value is None else "%.1f" % value)
+                               for _, value in timeseries.fold_headlines(self.rolling_means(node))))
+
+
+def watch_node(ip, proc, board=None):
+    """wait for the collector of node to exit, then copy its results right away.
+
+    With a board the collector streams sample frames on stdout, which are
+    decoded into the board as they arrive, and prints on stderr.
+    """
+    tail = collections.deque(maxlen=20)
+    if board is None:
+        proc.channel.set_combine_stderr(True)
+        for line in proc.stdout:
+            tail.append(line)
+    else:
+        drain = threading.Thread(target=tail.extend, args=(proc.stderr,), daemon=True)
+        drain.start()
+        reader = timeseries.FrameReader()
+        while True:
+            data = proc.channel.recv(65536)
+            if not data:
+                break
+            for sample in reader.feed(data):
+                board.add(hosts[ip], *sample)
+        drain.join()
+    status = proc.wait()
+    elapsed = time.time() - proc.started
+    print("%s collector exited with %d after %.1f seconds" % (hosts[ip], status, elapsed))
+    if status != 0:
+        for line in tail:
+            print("  %s: %s" % (hosts[ip], line.decode(errors="replace").rstrip()))
+    result, summary = copy_result_to_local(ip, hosts[ip])
     if result is False:
-        return
-    files = []
-    while (1):
-        line = proc.stdout.readline()
-        print(line)
-        if (not line):
-            break;
-        line = line.decode().rstrip('\n')
-        if path in line:
-            files.append(line)
-    for line in files:
-        str_cmd = "scp root@%s:%s ./%s/" % (ip, line, hostname)
-        print(str_cmd)
-        time.sleep(0.1)
-        proc = Popen(str_cmd.split(), stdin=PIPE, stdout=PIPE, stderr=PIPE)
-        print(proc.stderr.readlines())
-        while proc.poll() is None:
-            time.sleep(0.1)
+        print("copy result from %s failed" % ip)
+        summary = None
+    return status, elapsed, summary
+
+
+def abort_nodes(ips):
+    """ask the collector of every node to stop, it keeps what it sampled so far."""
+    path = config["NODE_RUN_PATH"]
+    for ip in ips:
+        str_cmd = "touch %s/%s" % (path, config.get("STOP_FILE", "collect_node.stop"))
+        result, proc = ssh_and_cmd(ip, str_cmd)
+        if result is False or proc.returncode != 0:
+            print("stop collector in %s failed" % ip)
+
+
+def watch_nodes(procs):
+    """fetch results of every node as soon as its collector exits.
+
+    In streaming mode a rolling summary of every node is printed each
+    STREAM_REPORT_SEC. Ctrl-C stops all collectors still running and goes
+    on with the results they have so far.
+    """
+    status = {}
+    summaries = []
+    board = None
+    stop = threading.Event()
+
+    def report():
+        while not stop.wait(config.get("STREAM_REPORT_SEC", 10)):
+            board.report()
+
+    if config.get("STREAM_TELEMETRY", False):
+        board = TelemetryBoard(config.get("STREAM_WINDOW_SEC", 60))
+        threading.Thread(target=report, daemon=True).start()
+
+    def done(future):
+        ip = futures[future]
+        code, elapsed, summary = future.result()
+        status[ip] = (code, elapsed)
+        if summary is not None:
+            summaries.append(summary)
+        print("%d/%d nodes done" % (len(status), len(procs)))
+
+    with ThreadPoolExecutor(max_workers=max(len(procs), 1)) as executor:
+        futures = {executor.submit(watch_node, ip, proc, board): ip for ip, proc in procs.items()}
+        try:
+            for future in as_completed(futures):
+                done(future)
+        except KeyboardInterrupt:
+            running = [ip for ip in procs if ip not in status]
+            print("interrupted, stopping the collectors of %d nodes" % len(running))
+            abort_nodes(running)
+            for future in as_completed([f for f, ip in futures.items() if ip in running]):
+                done(future)
+    stop.set()
+    if board is not None:
+        board.report()
+    print("%-20s %-16s %5s %10s" % ("HOST", "IP", "EXIT", "ELAPSED(s)"))
+    for ip, (code, elapsed) in status.items():
+        print("%-20s %-16s %5d %10.1f" % (hosts[ip], ip, code, elapsed))
+    print_transfer_summary(summaries)
+    return status
 
 
 def main(argv):
@@ -359,65 +891,84 @@ def main(argv):
         config = yaml.safe_load(file)
 
     try:
-        opts, args = getopt.getopt(argv, "hd:", ["containers="])
+        opts, args = getopt.getopt(argv, "hd:pn:i:", ["containers=", "parallel", "nodes=", "inventory="])
     except getopt.GetoptError:
-        print("collect_result.py -d container_names(separated by comma)")
+        print("collect_result.py -d container_names(separated by comma) [-p] [-n ip[:port],... | -i inventory.yml]")
         sys.exit(2)
     containers = ''
+    parallel = False
+    nodes = None
+    couch_pw = os.environ.get("COUCH_PW")
+    ssh_password = os.environ.get("SSH_PASSWORD")
     for opt, arg in opts:
         if opt == '-h':
-            print("collect_result.py -d container_names(separated by comma)")
+            print("collect_result.py -d container_names(separated by comma) [-p] [-n ip[:port],... | -i inventory.yml]")
+            print("  -p, --parallel   deploy and start all nodes concurrently")
+            print("  -n, --nodes      discover these nodes without prompting, COUCH_PW and SSH_PASSWORD")
+            print("                   are taken from the environment")
+            print("  -i, --inventory  same with the nodes and passwords of an inventory file")
         elif opt in ("-d", "--containers"):
             containers = arg
+        elif opt in ("-p", "--parallel"):
+            parallel = True
+        elif opt in ("-n", "--nodes"):
+            nodes = [node.strip() for node in arg.split(",") if node.strip()]
+        elif opt in ("-i", "--inventory"):
+            try:
+                nodes, inventory_couch_pw, inventory_ssh_password = read_inventory(arg)
+            except (IOError, AttributeError, yaml.YAMLError) as ex:
+                print("Read inventory %s failed: %s" % (arg, ex))
+                sys.exit(2)
+            couch_pw = inventory_couch_pw if inventory_couch_pw is not None else couch_pw
+            ssh_password = inventory_ssh_password if inventory_ssh_password is not None else ssh_password
     if len(containers) == 0:
         print("Err: Container name is expected")
         sys.exit(2)
 
-    if nodes_init(containers) is False:
+    if nodes_init(containers, nodes, couch_pw, ssh_password) is False:
         print("nodes init failed\n")
         return
     container_names = containers.split(",")
     print(container_names)
     print("Clear stale couchDB dispatch data, may take some time depends on data volume")
+    couch_host = split_address(ips[0])[0]
     str_cmd = "%s/dispatch_latency/couch_create_view.sh %s %s" % (
-        config["NODE_RUN_PATH"], ips[0], node_settings["COUCH_PW"])
+        config["NODE_RUN_PATH"], couch_host, node_settings["COUCH_PW"])
     print(str_cmd)
     ssh_and_cmd(ips[0], str_cmd)
-    str_cmd = "%s/dispatch_latency/couch_delete.sh %s %s" % (config["NODE_RUN_PATH"], ips[0], node_settings["COUCH_PW"])
+    str_cmd = "%s/dispatch_latency/couch_delete.sh %s %s" % (config["NODE_RUN_PATH"], couch_host, node_settings["COUCH_PW"])
     ssh_and_cmd(ips[0], str_cmd)
     print(str_cmd)
 
     procs = {}
     results = []
-    for ip in ips:
-        result, proc = node_run(ip)
-        #print(result)
-        if result is False:
-            print("node_run failed in %s" % ip)
-        else:
-            results.append(result)
-            procs[ip] = proc
+    if parallel is True:
+        procs = nodes_launch(ips)
+    else:
+        for ip in ips:
+            result, proc = node_run(ip)
+            #print(result)
+            if result is False:
+                print("node_run failed in %s" % ip)
+            else:
+                results.append(result)
+                procs[ip] = proc
     print("****************")
     print(procs)
-    while 1:
-        all_done = True
-        for _, (ip, proc) in enumerate(procs.items()):
-            if proc.poll() is None:
-                all_done = False
-                print("%s is running" % ip)
-                break
-        if all_done is False:
-            time.sleep(5)
-        else:
-            break
-
-    for _, (ip, proc) in enumerate(procs.items()):
-        copy_result_to_local(ip, hosts[ip])
-    
+    measure_clock_offsets(list(procs))
+    watch_nodes(procs)
+    close_ssh_pool()
+
     cmd = "rm -rf performance_report.csv final_performance_report.csv"
     print(cmd)
     os.system(cmd)
-    parse_output.parsing_result(hostnames)
+    run_id = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    out_dict = parse_output.parsing_result(hostnames, config.get("PARSE_ENGINE", "python"),
+                                           config.get("PARSE_WORKERS", 0), run_id=run_id,
+                                           columnar_dir=config.get("COLUMNAR_DIR"),
+                                           cache_dir=config.get("PARSE_CACHE_DIR"),
+                                           merge_step=config.get("MERGE_STEP_SEC"))
+    run_history.ingest_run(config.get("RUN_HISTORY_DB", run_history.RUN_HISTORY_DB), run_id, out_dict)
     #python3 parse_output1.py 
     #execfile('parse_output1.py')
     #os.system('parse_output1.py')
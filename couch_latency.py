@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020. Hitachi Vantara Corporation. All rights reserved.
+#
+# The copyright to the computer software herein is the property of
+# Hitachi Vantara Corporation. The software may be used and/or copied only
+# with the written permission of Hitachi Vantara Corporation or in accordance
+# with the terms and conditions stipulated in the agreement/contract
+# under which the software has been supplied.
+
+# Dispatch latency straight from the CouchDB views.
+#
+#   python3 couch_latency.py -H 10.0.0.1 -w password -v _design/latency/_view/postdispatch -o post.json
+#
+# Rows of a view are fetched page by page over one keep-alive connection
+# and every latency is folded into a log-linear histogram as it arrives,
+# so memory does not grow with the number of dispatched documents. The
+# value of a row is its latency in milliseconds, or an object holding it
+# under the latency field.
+
+import base64
+import getopt
+import http.client
+import json
+import math
+import sys
+import urllib.parse
+
+COUCH_PORT = 5984
+COUCH_USER = "admin"
+COUCH_DB = "dispatch"
+PAGE_SIZE = 5000
+LATENCY_FIELD = "latency"
+PERCENTILES = [50, 90, 99, 99.9]
+
+
+class CouchClient(object):
+    """GET json from CouchDB over one pooled HTTP connection."""
+
+    def __init__(self, host, port=COUCH_PORT, user=COUCH_USER, password="", timeout=60):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.headers = {"Accept": "application/json", "Connection": "keep-alive"}
+        if password:
+            token = base64.b64encode(("%s:%s" % (user, password)).encode()).decode()
+            self.headers["Authorization"] = "Basic " + token
+        self.conn = None
+
+    def get(self, path, params=None):
+        url = path
+        if params:
+            url += "?" + urllib.parse.urlencode(params)
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.conn.request("GET", url, headers=self.headers)
+                resp = self.conn.getresponse()
+                body = resp.read()
+            except (http.client.HTTPException, OSError) as ex:
+                # the server closed the idle connection, retry once on a new one
+                self.close()
+                if attempt:
+                    # callers handle IOError, a malformed response is one too
+                    raise IOError("GET %s: %s" % (url, str(ex) or type(ex).__name__)) from ex
+                continue
+            if resp.status != 200:
+                raise IOError("GET %s: %d %s" % (url, resp.status, body[:200].decode(errors="replace")))
+            return json.loads(body)
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def iter_view_rows(client, db, view, page_size=PAGE_SIZE):
+    """rows of a view, paged by start key and doc id rather than skip."""
+    path = "/%s/%s" % (urllib.parse.quote(db, safe=""), view.lstrip("/"))
+    params = {"limit": page_size + 1, "reduce": "false"}
+    while True:
+        rows = client.get(path, params).get("rows", [])
+        for row in rows[:page_size]:
+            yield row
+        if len(rows) <= page_size:
+            return
+        last = rows[page_size]
+        params = {"limit": page_size + 1, "reduce": "false",
+                  "startkey": json.dumps(last["key"]), "startkey_docid": last["id"]}
+
+
+class LatencyHistogram(object):
+    """log-linear histogram of latencies, HDR style.
+
+    Values are kept in microseconds in buckets of 2**SUB_BITS steps per
+    power of two, so any recorded value is known within 1/2**SUB_BITS of
+    itself whatever its magnitude.
+    """
+
+    SUB_BITS = 7
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def bucket(self, value):
+        shift = max(0, value.bit_length() - self.SUB_BITS)
+        return shift << self.SUB_BITS | value >> shift
+
+    def bucket_value(self, index):
+        shift = index >> self.SUB_BITS
+        low = (index & ((1 << self.SUB_BITS) - 1)) << shift
+        return low + ((1 << shift) - 1) / 2.0
+
+    def record(self, value_ms):
+        if value_ms is None or value_ms < 0 or math.isnan(value_ms):
+            return
+        index = self.bucket(int(round(value_ms * 1000)))
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value_ms
+        self.min = value_ms if self.min is None else min(self.min, value_ms)
+        self.max = value_ms if self.max is None else max(self.max, value_ms)
+
+    def percentile(self, q):
+        """latency in milliseconds below which q percent of the values are."""
+        if not self.count:
+            return 0.0
+        rank = max(1, int(math.ceil(self.count * q / 100.0)))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(max(self.bucket_value(index) / 1000.0, self.min), self.max)
+        return self.max
+
+    def summary(self):
+        result = {"count": self.count, "unit": "ms",
+                  "mean": self.total / self.count if self.count else 0.0,
+                  "min": self.min or 0.0, "max": self.max or 0.0}
+        for q in PERCENTILES:
+            result["p%g" % q] = self.percentile(q)
+        return result
+
+
+def row_latency(row, field=LATENCY_FIELD):
+    value = row.get("value")
+    if isinstance(value, dict):
+        value = value.get(field)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def collect_latency(client, db, view, page_size=PAGE_SIZE, field=LATENCY_FIELD):
+    histogram = LatencyHistogram()
+    for row in iter_view_rows(client, db, view, page_size):
+        histogram.record(row_latency(row, field))
+    return histogram
+
+
+def write_latency(filename, view, histogram):
+    """write the summary of histogram as json, return False on failure."""
+    try:
+        with open(filename, "w") as fl:
+            json.dump(dict(histogram.summary(), view=view), fl, indent=1)
+    except IOError as ex:
+        print("Write %s failed" % filename)
+        return False
+    return True
+
+
+def usage():
+    print("couch_latency.py -H host [-P port] [-u user] [-w password] [-d db] -v view "
+          "[-s page_size] [-f latency_field] [-o out.json]")
+
+
+def main(argv):
+    try:
+        opts, args = getopt.getopt(argv, "hH:P:u:w:d:v:s:f:o:")
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+    host = None
+    port = COUCH_PORT
+    user = COUCH_USER
+    password = ""
+    db = COUCH_DB
+    view = None
+    page_size = PAGE_SIZE
+    field = LATENCY_FIELD
+    out = None
+    for opt, arg in opts:
+        if opt == '-h':
+            usage()
+            return
+        elif opt == "-H":
+            host = arg
+        elif opt == "-P":
+            port = int(arg)
+        elif opt == "-u":
+            user = arg
+        elif opt == "-w":
+            password = arg
+        elif opt == "-d":
+            db = arg
+        elif opt == "-v":
+            view = arg
+        elif opt == "-s":
+            page_size = int(arg)
+        elif opt == "-f":
+            field = arg
+        elif opt == "-o":
+            out = arg
+    if host is None or view is None:
+        usage()
+        sys.exit(2)
+
+    client = CouchClient(host, port, user, password)
+    try:
+        histogram = collect_latency(client, db, view, page_size, field)
+    finally:
+        client.close()
+    if out:
+        write_latency(out, view, histogram)
+    else:
+        print(json.dumps(histogram.summary(), indent=1))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
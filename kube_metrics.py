@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020. Hitachi Vantara Corporation. All rights reserved.
+#
+# The copyright to the computer software herein is the property of
+# Hitachi Vantara Corporation. The software may be used and/or copied only
+# with the written permission of Hitachi Vantara Corporation or in accordance
+# with the terms and conditions stipulated in the agreement/contract
+# under which the software has been supplied.
+
+# Pod metrics straight from the metrics.k8s.io API.
+#
+#   python3 kube_metrics.py -n hiota [-s https://10.0.0.1:6443] [-k ~/.kube/config]
+#
+# One keep-alive connection to the API server serves every tick. Credentials
+# come from the service account when running in a pod, else from the
+# current context of kubeconfig. Usage quantities such as 1234567n or
+# 2048Ki are turned into exact cores and bytes.
+
+import base64
+import datetime
+import getopt
+import http.client
+import json
+import os
+import re
+import ssl
+import sys
+import tempfile
+import time
+import urllib.parse
+from decimal import Decimal
+import yaml
+
+KUBECONFIG = "~/.kube/config"
+SERVICE_ACCOUNT_DIR = "/var/run/secrets/kubernetes.io/serviceaccount"
+NAMESPACE = "hiota"
+QUANTITY_RE = re.compile(r"^([+-]?(?:\d+\.?\d*|\.\d+))(?:[eE]([+-]?\d+))?([a-zA-Z]*)$")
+QUANTITY_SUFFIXES = {"n": Decimal("1e-9"), "u": Decimal("1e-6"), "m": Decimal("1e-3"), "": Decimal(1),
+                     "k": Decimal("1e3"), "M": Decimal("1e6"), "G": Decimal("1e9"), "T": Decimal("1e12"),
+                     "P": Decimal("1e15"), "E": Decimal("1e18"),
+                     "Ki": Decimal(2 ** 10), "Mi": Decimal(2 ** 20), "Gi": Decimal(2 ** 30),
+                     "Ti": Decimal(2 ** 40), "Pi": Decimal(2 ** 50), "Ei": Decimal(2 ** 60)}
+
+
+def parse_quantity(value):
+    """exact Decimal of a kubernetes quantity, 250m is 0.25 and 1Ki is 1024."""
+    match = QUANTITY_RE.match(str(value).strip())
+    if match is None or match.group(3) not in QUANTITY_SUFFIXES:
+        raise ValueError("bad quantity %r" % value)
+    number = Decimal(match.group(1))
+    if match.group(2):
+        number = number.scaleb(int(match.group(2)))
+    return number * QUANTITY_SUFFIXES[match.group(3)]
+
+
+def parse_timestamp(value):
+    """epoch of an RFC 3339 timestamp of the API, None if there is none."""
+    try:
+        return datetime.datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except (AttributeError, ValueError):
+        return None
+
+
+class KubeMetricsClient(object):
+    """GET json from the API server over one persistent connection."""
+
+    def __init__(self, server, context=None, token=None, timeout=30):
+        url = urllib.parse.urlsplit(server)
+        self.https = url.scheme == "https"
+        self.host = url.hostname
+        self.port = url.port or (443 if self.https else 80)
+        self.context = context
+        self.timeout = timeout
+        self.headers = {"Accept": "application/json", "Connection": "keep-alive"}
+        if token:
+            self.headers["Authorization"] = "Bearer " + token
+        self.conn = None
+
+    def connect(self):
+        if self.https:
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout, context=self.context)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def get(self, path):
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = self.connect()
+            try:
+                self.conn.request("GET", path, headers=self.headers)
+                resp = self.conn.getresponse()
+                body = resp.read()
+            except (http.client.HTTPException, OSError) as ex:
+                # the server closed the idle connection, retry once on a new one
+                self.close()
+                if attempt:
+                    # callers handle IOError, a malformed response is one too
+                    raise IOError("GET %s: %s" % (path, str(ex) or type(ex).__name__)) from ex
+                continue
+            if resp.status != 200:
+                raise IOError("GET %s: %d %s" % (path, resp.status, body[:200].decode(errors="replace")))
+            return json.loads(body)
+
+    def pod_metrics(self, namespace=NAMESPACE):
+        return self.get("/apis/metrics.k8s.io/v1beta1/namespaces/%s/pods" %
+                        urllib.parse.quote(namespace, safe="")).get("items", [])
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def kubeconfig_credentials(path=None):
+    """(server, ssl context, token) of the current context of a kubeconfig."""
+    path = os.path.expanduser(path or os.environ.get("KUBECONFIG", KUBECONFIG).split(os.pathsep)[0])
+    with open(path, "r") as fl:
+        kubeconfig = yaml.safe_load(fl)
+    base = os.path.dirname(path)
+
+    def named(section, name):
+        for entry in kubeconfig.get(section) or []:
+            if entry.get("name") == name:
+                return entry.get(section[:-1]) or {}
+        return {}
+
+    context = named("contexts", kubeconfig.get("current-context"))
+    cluster = named("clusters", context.get("cluster"))
+    user = named("users", context.get("user"))
+    if not cluster.get("server"):
+        raise ValueError("no server for the current context in %s" % path)
+
+    ssl_context = ssl.create_default_context()
+    if cluster.get("insecure-skip-tls-verify"):
+        ssl_context.check_hostname = False
+        ssl_context.verify_mode = ssl.CERT_NONE
+    elif cluster.get("certificate-authority-data"):
+        ssl_context.load_verify_locations(cadata=base64.b64decode(cluster["certificate-authority-data"]).decode())
+    elif cluster.get("certificate-authority"):
+        ssl_context.load_verify_locations(cafile=os.path.join(base, cluster["certificate-authority"]))
+
+    if user.get("client-certificate-data") and user.get("client-key-data"):
+        # ssl only loads a client certificate from files
+        with tempfile.TemporaryDirectory() as tmp:
+            cert = os.path.join(tmp, "cert.pem")
+            key = os.path.join(tmp, "key.pem")
+            for name, field in ((cert, "client-certificate-data"), (key, "client-key-data")):
+                with open(os.open(name, os.O_WRONLY | os.O_CREAT, 0o600), "wb") as out:
+                    out.write(base64.b64decode(user[field]))
+            ssl_context.load_cert_chain(cert, key)
+    elif user.get("client-certificate") and user.get("client-key"):
+        ssl_context.load_cert_chain(os.path.join(base, user["client-certificate"]),
+                                    os.path.join(base, user["client-key"]))
+    token = user.get("token")
+    if not token and user.get("tokenFile"):
+        with open(os.path.join(base, user["tokenFile"]), "r") as fl:
+            token = fl.read().strip()
+    return cluster["server"], ssl_context, token
+
+
+def load_client(kubeconfig=None, server=None, timeout=30):
+    """client of the service account when running in a pod, else of kubeconfig."""
+    token_file = os.path.join(SERVICE_ACCOUNT_DIR, "token")
+    if kubeconfig is None and os.path.exists(token_file) and os.environ.get("KUBERNETES_SERVICE_HOST"):
+        with open(token_file, "r") as fl:
+            token = fl.read().strip()
+        context = ssl.create_default_context(cafile=os.path.join(SERVICE_ACCOUNT_DIR, "ca.crt"))
+        default = "https://%s:%s" % (os.environ["KUBERNETES_SERVICE_HOST"],
+                                     os.environ.get("KUBERNETES_SERVICE_PORT", "443"))
+        return KubeMetricsClient(server or default, context, token, timeout)
+    default, context, token = kubeconfig_credentials(kubeconfig)
+    return KubeMetricsClient(server or default, context, token, timeout)
+
+
+def container_records(items, now=None):
+    """one record per container of the pod metrics items, cpu in cores, memory in bytes."""
+    now = now or time.time()
+    records = []
+    for item in items:
+        ts = parse_timestamp(item.get("timestamp")) or now
+        window = item.get("window", "")
+        for container in item.get("containers", []):
+            usage = container.get("usage", {})
+            try:
+                cpu = parse_quantity(usage.get("cpu", "0"))
+                memory = parse_quantity(usage.get("memory", "0"))
+            except ValueError:
+                continue
+            records.append({"ts": ts, "pod": item.get("metadata", {}).get("name", ""),
+                            "container": container.get("name", ""), "window": window,
+                            "cpu_cores": float(cpu), "memory_bytes": int(memory)})
+    return records
+
+
+def usage():
+    print("kube_metrics.py [-n namespace] [-s server] [-k kubeconfig]")
+
+
+def main(argv):
+    try:
+        opts, args = getopt.getopt(argv, "hn:s:k:")
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+    namespace = NAMESPACE
+    server = None
+    kubeconfig = None
+    for opt, arg in opts:
+        if opt == '-h':
+            usage()
+            return
+        elif opt == "-n":
+            namespace = arg
+        elif opt == "-s":
+            server = arg
+        elif opt == "-k":
+            kubeconfig = arg
+    client = load_client(kubeconfig, server)
+    try:
+        for record in container_records(client.pod_metrics(namespace)):
+            print(json.dumps(record))
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
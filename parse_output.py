@@ -9,8 +9,45 @@
 # under which the software has been supplied.
 
 import os
+import glob
+import datetime
+import gzip
+import hashlib
+import inspect
+import math
+import pickle
+import struct
+import time
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+import json
 from functools import reduce
 import re, csv
+import timeseries
+import couch_latency
+try:
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+CLOCK_OFFSETS_FILE = "clock_offsets.json"
+MERGED_TIMESERIES_CSV = "timeseries_merged.csv"
+# bump when a parser returns other records for the same log, helpers included;
+# a change in the source of a parser itself makes its own keys anew
+PARSE_CACHE_VERSION = 2
+PARSE_CACHE_MAX_AGE_SEC = 7 * 24 * 3600
+PARSE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+KUBE_TOP_RE = re.compile(r'^(?!NAME)(\S+)\s+(\d+)\S*\s+(\d+)', re.M)
+# report columns of the old sysstat headers, by the header of sysstat 11+ that
+# replaced them and the factor to the old unit: sectors are half a kB
+SYSSTAT_ALIASES = {'rd_sec/s': ('rkB/s', 2.0), 'wr_sec/s': ('wkB/s', 2.0), 'avgrq-sz': ('areq-sz', 2.0),
+                   'avgqu-sz': ('aqu-sz', 1.0)}
+STATS_FEILD = ["HOST", 'KEY', 'FIELD', 'count', 'mean', 'min', 'max', 'p50', 'p95', 'p99']
 
 def cal_average(list):
     return (reduce(lambda x, y: x + y, list))/len(list)
@@ -18,6 +55,9 @@ def cal_average(list):
 def convert_to_gb(_list):
     temp_list = []
     for value in _list:
+        if not isinstance(value, str):
+            temp_list.append(value / (1024 * 1024 * 1024))
+            continue
         MB_KB = list(filter(lambda x: x.isdigit() == True or x.isalpha(), re.split(r'(\d+)', value.strip())))
         _value = int(MB_KB[0]) if len(MB_KB) == 2 else float(".".join(MB_KB[:-1]))
         _size = MB_KB[-1]
@@ -36,7 +76,8 @@ def process_cpu(out=None, host=None, dict={}, lock=None):
     if not 'cpu' in dict.keys():
         dict['cpu'] = {}
     
-    if os.path.isfile(out):
+    # a run stopped before its first sample leaves an empty Average file
+    if os.path.isfile(out) and os.path.getsize(out) > 0:
         with open(out, 'r') as fl:
             _out = (fl.readlines()[0]).split()[1:]
         
@@ -60,7 +101,8 @@ def process_memory(out=None, host=None, dict={}):
              '%commit', 'kbactive', 'kbinact', 'kbdirty']
     if not 'memory' in dict.keys():
         dict['memory'] = {}
-    if os.path.isfile(out):
+    # a run stopped before its first sample leaves an empty Average file
+    if os.path.isfile(out) and os.path.getsize(out) > 0:
         with open(out, 'r') as fl:
             _out = (fl.readlines()[0]).split()[1:]
 
@@ -137,7 +179,8 @@ def process_diskIO_block(out=None, host=None, dict={}):
     if not 'diskIO_block' in dict.keys():
         dict['diskIO_block'] = {}
 
-    if os.path.isfile(out):
+    # a run stopped before its first sample leaves an empty Average file
+    if os.path.isfile(out) and os.path.getsize(out) > 0:
         with open(out, 'r') as fl:
             _out = (fl.readlines()[0]).split()[1:]
             dict['diskIO_block'][host] = {'Feild': Feild, 'data': [{
@@ -152,6 +195,20 @@ def process_diskIO_block(out=None, host=None, dict={}):
     else:
         print("Nothing to do for diskIO_block info")
 
+def kube_metrics_rows(lines):
+    """(pod, cpu millicores, memory Mib) per pod and sample of kube_metrics.py records."""
+    samples = {}
+    for line in lines:
+        record = json.loads(line)
+        samples[(record['pod'], record['container'], record['ts'])] = record
+    pods = {}
+    for record in samples.values():
+        total = pods.setdefault((record['pod'], record['ts']), [0.0, 0.0])
+        total[0] += record['cpu_cores'] * 1000
+        total[1] += record['memory_bytes'] / 1048576.0
+    return [(pod, cpu, mem) for (pod, _), (cpu, mem) in pods.items()]
+
+
 def process_kube_top(out=None, host=None, dict={}):
     data = {}
     if not 'kube_top' in dict.keys():
@@ -161,8 +218,15 @@ def process_kube_top(out=None, host=None, dict={}):
     if os.path.isfile(out):
         print("Processing data for kubectl top")
         with open(out, 'r') as fl:
-            for line in fl.readlines():
-                if line.startswith('NAME'):
+            lines = fl.readlines()
+            # containers of the metrics API records are summed per pod like kubectl top does
+            for pod, cpu, mem in kube_metrics_rows([line for line in lines if line.startswith('{')]):
+                if not data.get(pod):
+                    data[pod] = {'cpu' : [], 'memory' : [], "HOST": "" }
+                data[pod]['cpu'].append(cpu)
+                data[pod]['memory'].append(mem)
+            for line in lines:
+                if line.startswith('NAME') or line.startswith('{'):
                     continue
                 _line = line.strip().split()
                 if not data.get(_line[0]):
@@ -237,6 +301,16 @@ def process_docker_stat(out=None, host=None, dict={}):
         docker_info = {}
         with open(out, 'r') as fl:
             for i in set(fl.readlines()):
+                if i.startswith('{'):
+                    # structured record of the periodic sampler, sizes in bytes
+                    record = json.loads(i)
+                    if not docker_info.get(record['name']):
+                        docker_info[record['name']] = {'cpu': [], 'mem': [], 'storage_r': [], 'storage_w': [], "HOST": ""}
+                    docker_info[record['name']]['cpu'].append(float(record['cpu_pct']))
+                    docker_info[record['name']]['mem'].append(float(record['mem_pct']))
+                    docker_info[record['name']]['storage_r'].append(record['blk_read_bytes'])
+                    docker_info[record['name']]['storage_w'].append(record['blk_write_bytes'])
+                    continue
                 l = i.split()
                 if "NAME" in l:
                     continue
@@ -267,32 +341,564 @@ def process_docker_stat(out=None, host=None, dict={}):
         print("Nothing to do for kube top info")
 
 
-def parsing_result(hostsStr):
-    out_dict = {}
-    log_dir = os.getcwd()
-    hosts = hostsStr
-    cvs_name = f"{log_dir}/performance_report.csv"
-    final_csv = f"{log_dir}/final_performance_report.csv"
-    #hosts = ["vmdk"]
-
-    for host in hosts:
-        os.chdir(log_dir)
-        if os.path.isdir(host):
-            os.chdir(f"{log_dir}/{host}")
-
-            process_cpu(f"{host}_cpu_info.log", host, out_dict)
-            process_memory(f"{host}_memory_info.log", host, out_dict)
-            process_network(f"{host}_network_info.log", host, out_dict)
-            process_disk_io_all_part(f"{host}_disk_io_info.log", host, out_dict)
-            process_diskIO_block(f"{host}_disk_block_info.log", host, out_dict)
-            process_kube_top(f"{host}_kube_top_info.log", host, out_dict)
-            process_iostat(f"{host}_iostat_info.log", host, out_dict)
-            process_docker_stat(f"{host}_docker_stats.log", host, out_dict)
+def process_self_profile(out=None, host=None, dict={}):
+    # cost of the collector processes on the node, json lines of write_self_profile
+    feild = ["HOST", 'MONITOR', 'wall_sec', 'cpu_sec', 'child_cpu_sec', '%cpu', 'max_rss_mb', 'child_max_rss_mb',
+             'ctxt_switches', 'read_mb', 'write_mb']
+    if not os.path.isfile(out):
+        print("Nothing to do for self profile info")
+        return
+    data = []
+    total = {k: 0 for k in feild[2:]}
+    with open(out, 'r') as fl:
+        for line in fl:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            cpu_sec = record['cpu_user_sec'] + record['cpu_sys_sec']
+            child_cpu_sec = record.get('child_cpu_user_sec', 0) + record.get('child_cpu_sys_sec', 0)
+            row = {'HOST': host, 'MONITOR': record['monitor'], 'wall_sec': record['wall_sec'],
+                   'cpu_sec': cpu_sec, 'child_cpu_sec': child_cpu_sec,
+                   '%cpu': 100.0 * (cpu_sec + child_cpu_sec) / record['wall_sec'] if record['wall_sec'] else 0.0,
+                   'max_rss_mb': record['max_rss_kb'] / 1024.0,
+                   'child_max_rss_mb': record.get('child_max_rss_kb', 0) / 1024.0,
+                   'ctxt_switches': record['vol_ctxt'] + record['invol_ctxt'] +
+                                    record.get('child_vol_ctxt', 0) + record.get('child_invol_ctxt', 0),
+                   'read_mb': record.get('rchar', 0) / (1024.0 * 1024),
+                   'write_mb': record.get('wchar', 0) / (1024.0 * 1024)}
+            for k in feild[2:]:
+                # processes run side by side, their peaks and walls do not add up
+                total[k] = max(total[k], row[k]) if k in ('wall_sec', 'child_max_rss_mb') else total[k] + row[k]
+            data.append({k: round(v, 3) if isinstance(v, float) else v for k, v in row.items()})
+    if not data:
+        return
+    # the collector io already holds that of the monitors it waited for
+    io_rows = [row for row in data if row['MONITOR'] == 'collector'] or data
+    for k in ('read_mb', 'write_mb'):
+        total[k] = sum(row[k] for row in io_rows)
+    total['%cpu'] = 100.0 * (total['cpu_sec'] + total['child_cpu_sec']) / total['wall_sec'] if total['wall_sec'] else 0.0
+    row = {'HOST': host, 'MONITOR': 'TOTAL'}
+    row.update({k: round(v, 3) for k, v in total.items()})
+    data.append(row)
+    dict.setdefault('self_profile', {})[host] = {'Feild': feild, 'data': data}
+    print("Processing DONE for self profile")
+
+
+def latency_summary(doc):
+    """histogram summary of a latency log, native summary or raw view output of the scripts."""
+    if isinstance(doc, dict) and 'count' in doc and 'unit' in doc:
+        return doc
+    if isinstance(doc, dict):
+        doc = doc.get('rows', [])
+    if not isinstance(doc, list):
+        return None
+    histogram = couch_latency.LatencyHistogram()
+    for row in doc:
+        if isinstance(row, dict):
+            histogram.record(couch_latency.row_latency(row))
         else:
-            print(f"Directory {host} doesnot exists")
+            histogram.record(couch_latency.row_latency({'value': row}))
+    return histogram.summary()
+
+
+def process_dispatch_latency(out=None, host=None, dict={}):
+    # histogram summary of couch_latency.py, or the view rows the couch_query scripts
+    # write, json in <host>_<phase>_latency.log
+    feild = ["HOST", 'PHASE', 'count', 'mean', 'min', 'max', 'p50', 'p90', 'p99', 'p99.9']
+    phase = os.path.basename(out)[len(host) + 1:].split("_")[0]
+    if not os.path.isfile(out):
+        print("Nothing to do for %s latency info" % phase)
+        return
+    try:
+        with open(out, 'r') as fl:
+            summary = json.load(fl)
+        summary = latency_summary(summary)
+    except ValueError:
+        summary = None
+    if summary is None:
+        print("%s is not a latency histogram summary nor view rows, skip it" % out)
+        return
+    row = {'HOST': host, 'PHASE': phase}
+    row.update({k: round(summary.get(k, 0), 3) for k in feild[2:]})
+    dict.setdefault(phase + '_latency', {})[host] = {'Feild': feild, 'data': [row]}
+    print("Processing DONE for %s latency" % phase)
+
+
+def process_timeseries(out=None, host=None, dict={}):
+    # per interval samples kept in <host>_<metric>[@<key>].ts files
+    Feild = ["HOST", 'METRIC', 'KEY', 'FIELD', 'count', 'mean', 'min', 'max', 'p50', 'p95', 'p99']
+    files = sorted(glob.glob(os.path.join(out, f"{host}_*{timeseries.TS_POST}")))
+    if not files:
+        print("Nothing to do for time-series info")
+        return
+    if not 'timeseries' in dict.keys():
+        dict['timeseries'] = {}
+
+    data = []
+    for path in files:
+        metric, key = timeseries.split_series_file(path, host)
+        columns, values = timeseries.read_series(path)
+        for column in columns[1:]:
+            row = {'HOST': host, 'METRIC': metric, 'KEY': key, 'FIELD': column}
+            summary = summarize_np(values[column]) if np is not None else timeseries.summarize(values[column])
+            row.update({k: round(v, 3) for k, v in summary.items()})
+            data.append(row)
+    dict['timeseries'][host] = {'Feild': Feild, 'data': data}
+    print("Processing DONE for time-series")
+
+
+def process_summary(out=None, host=None, dict={}):
+    # run summary folded on the node, stands for the metric logs and the .ts files
+    if not os.path.isfile(out):
+        print("Nothing to do for run summary info")
+        return
+    try:
+        created, columns = timeseries.read_summary(out)
+    except (IOError, ValueError, struct.error) as ex:
+        print("Read run summary %s failed: %s" % (out, ex))
+        return
+    metrics = {}
+    for (metric, key, column), summary in columns.items():
+        metrics.setdefault(metric, {}).setdefault(key, {})[column] = summary
+
+    def mean(values, column, scale=1.0):
+        if column not in values and column in SYSSTAT_ALIASES:
+            column, factor = SYSSTAT_ALIASES[column]
+            scale *= factor
+        return round(values[column].mean() * scale, 3) if column in values else ''
+
+    def iostat_await(values):
+        # sysstat 11+ reports r_await and w_await only, weigh them by r/s and w/s
+        if 'await' in values or not all(c in values for c in ('r_await', 'w_await', 'r/s', 'w/s')):
+            return mean(values, 'await')
+        reads, writes = values['r/s'].mean(), values['w/s'].mean()
+        if reads + writes <= 0:
+            return 0.0
+        return round((values['r_await'].mean() * reads + values['w_await'].mean() * writes) / (reads + writes), 3)
+
+    def spread(values, column, scale=1.0):
+        if column not in values:
+            return ''
+        return f"{values[column].min * scale}|{values[column].max * scale}"
+
+    sections = {
+        'cpu': (["HOST", 'CPU', '%user', '%nice', '%system', '%iowait', '%steal', '%idle'], 'cpu'),
+        'memory': (['HOST', 'kbmemfree', 'kbmemused', '%memused', 'kbbuffers', 'kbcached', 'kbcommit',
+                    '%commit', 'kbactive', 'kbinact', 'kbdirty'], None),
+        'network': (["HOST", 'IFACE', 'rxpck/s', 'txpck/s', 'rxkB/s', 'txkB/s', 'rxcmp/s', 'txcmp/s',
+                     'rxmcst/s'], 'network'),
+        'disk_io_all_part': (["HOST", 'DEV', 'tps', 'rd_sec/s', 'wr_sec/s', 'avgrq-sz', 'avgqu-sz', 'await',
+                              'svctm', '%util'], 'disk_io_all_part'),
+        'diskIO_block': (["HOST", 'tps', 'rtps', 'wtps', 'bread/s', 'bwrtn/s'], None),
+        'kube_top': (["HOST", 'Pod Name', 'Cpu(core)', 'Memory(Mib)'], 'kube_top')}
+    for metric, (Feild, keyed) in sections.items():
+        if metric not in metrics:
+            continue
+        data = []
+        for key, values in sorted(metrics[metric].items()):
+            if metric == 'network' and key.startswith('cali'):
+                continue
+            row = {'HOST': host}
+            if keyed:
+                row[Feild[1]] = key
+            for column in Feild[2 if keyed else 1:]:
+                row[column] = mean(values, column)
+            data.append(row)
+        dict.setdefault(metric, {})[host] = {'Feild': Feild, 'data': data}
+
+    if 'iostat' in metrics:
+        Feild = ["HOST", 'Device', 'tps', 'MB_read/s', 'MB_wrtn/s', 'await', 'r_await', 'w_await', '%util']
+        data = []
+        for key, values in sorted(metrics['iostat'].items()):
+            tps = ''
+            if 'r/s' in values and 'w/s' in values:
+                tps = round(values['r/s'].mean() + values['w/s'].mean(), 3)
+            data.append({'HOST': host, 'Device': key, 'tps': tps, 'MB_read/s': mean(values, 'rMB/s'),
+                         'MB_wrtn/s': mean(values, 'wMB/s'), 'await': iostat_await(values),
+                         'r_await': mean(values, 'r_await'), 'w_await': mean(values, 'w_await'),
+                         '%util': mean(values, '%util')})
+        dict.setdefault('iostat', {})[host] = {'Feild': Feild, 'data': data}
+
+    if 'docker_stat' in metrics:
+        Feild = ["HOST", 'DockerName', '%Average_CPU', '%CPU_usage(min|Max)', '%Average_Memory',
+                 '%MemoryUsage(min|Max)', 'gb_block_read', 'gb_block_read(min|Max)', 'gb_block_wrt',
+                 'gb_block_wrt(min|Max)']
+        gb = 1.0 / (1024 * 1024 * 1024)
+        data = []
+        for key, values in sorted(metrics['docker_stat'].items()):
+            data.append({'HOST': host, 'DockerName': key,
+                         '%Average_CPU': mean(values, 'cpu_pct'), '%CPU_usage(min|Max)': spread(values, 'cpu_pct'),
+                         '%Average_Memory': mean(values, 'mem_pct'),
+                         '%MemoryUsage(min|Max)': spread(values, 'mem_pct'),
+                         'gb_block_read': mean(values, 'blk_read_bytes', gb),
+                         'gb_block_read(min|Max)': spread(values, 'blk_read_bytes', gb),
+                         'gb_block_wrt': mean(values, 'blk_write_bytes', gb),
+                         'gb_block_wrt(min|Max)': spread(values, 'blk_write_bytes', gb)})
+        dict.setdefault('docker_stat', {})[host] = {'Feild': Feild, 'data': data}
+
+    Feild = ["HOST", 'METRIC', 'KEY', 'FIELD', 'count', 'mean', 'min', 'max', 'p50', 'p95', 'p99']
+    data = [{'HOST': host, 'METRIC': metric, 'KEY': key, 'FIELD': column, 'count': summary.count,
+             'mean': round(summary.mean(), 3), 'min': round(summary.min, 3), 'max': round(summary.max, 3),
+             'p50': round(summary.percentile(50), 3), 'p95': round(summary.percentile(95), 3),
+             'p99': round(summary.percentile(99), 3)}
+            for (metric, key, column), summary in sorted(columns.items())]
+    dict.setdefault('timeseries', {})[host] = {'Feild': Feild, 'data': data}
+    print("Processing DONE for run summary")
+
+
+def factorize(keys):
+    """keys in order of first appearance and the index of each key in it."""
+    codes = {}
+    inverse = np.fromiter((codes.setdefault(k, len(codes)) for k in keys), dtype=np.intp, count=len(keys))
+    return list(codes), inverse
+
+
+def group_aggregate(keys, values):
+    """per key count, mean, min, max, p50, p95 and p99 of each value column."""
+    uniq, inverse = factorize(keys)
+    order = np.argsort(inverse, kind='stable')
+    grouped = values[order]
+    counts = np.bincount(inverse, minlength=len(uniq))
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    stats = {'count': counts,
+             'mean': np.add.reduceat(grouped, starts, axis=0) / counts[:, None],
+             'min': np.minimum.reduceat(grouped, starts, axis=0),
+             'max': np.maximum.reduceat(grouped, starts, axis=0)}
+    pct = np.array([np.percentile(grouped[s:s + c], (50, 95, 99), axis=0) for s, c in zip(starts, counts)])
+    stats['p50'], stats['p95'], stats['p99'] = pct[:, 0], pct[:, 1], pct[:, 2]
+    return uniq, stats
+
+
+def stats_rows(host, uniq, stats, fields):
+    return [{'HOST': host, 'KEY': key, 'FIELD': field, 'count': int(stats['count'][i]),
+             'mean': round(float(stats['mean'][i][j]), 3), 'min': round(float(stats['min'][i][j]), 3),
+             'max': round(float(stats['max'][i][j]), 3), 'p50': round(float(stats['p50'][i][j]), 3),
+             'p95': round(float(stats['p95'][i][j]), 3), 'p99': round(float(stats['p99'][i][j]), 3)}
+            for i, key in enumerate(uniq) for j, field in enumerate(fields)]
+
+
+def summarize_np(values):
+    values = np.asarray(values)
+    if not len(values):
+        return timeseries.summarize([])
+    p50, p95, p99 = np.percentile(values, (50, 95, 99))
+    return {"count": len(values), "mean": float(values.mean()), "min": float(values.min()),
+            "max": float(values.max()), "p50": float(p50), "p95": float(p95), "p99": float(p99)}
+
+
+def process_iostat_np(out=None, host=None, dict={}):
+    Feild = ["HOST", 'Device', 'tps', 'MB_read/s', 'MB_wrtn/s', 'await', 'r_await', 'w_await', '%util']
+    if not 'iostat' in dict.keys():
+        dict['iostat'] = {}
 
-            # Parsing data to cvs
-            #print(out_dict, type(out_dict), out_dict.keys(), out_dict['cpu']['data'])
+    print("Processing Data for iostat")
+    if not os.path.isfile(out):
+        print("Nothing to do for iostat info")
+        return
+    with open(out, 'r') as fl:
+        lines = [line for line in fl.read().splitlines() if line and not line.startswith(('Linux', 'Device'))]
+    if not lines:
+        dict['iostat'][host] = {'Feild': Feild, 'data': []}
+        return
+    # r/s w/s rMB/s wMB/s await r_await w_await %util
+    columns = np.loadtxt(lines, usecols=(3, 4, 5, 6, 9, 10, 11, 13), ndmin=2)
+    values = np.column_stack([columns[:, 0] + columns[:, 1], columns[:, 2:]])
+    uniq, stats = group_aggregate([line.split(None, 1)[0] for line in lines], values)
+    dict['iostat'][host] = {'Feild': Feild, 'data': [
+        {'HOST': host, 'Device': str(key), **{f: round(float(v), 3) for f, v in zip(Feild[2:], stats['mean'][i])}}
+        for i, key in enumerate(uniq)]}
+    dict.setdefault('iostat_stats', {})[host] = {
+        'Feild': STATS_FEILD, 'data': stats_rows(host, uniq, stats, Feild[2:])}
+    print("Processing DONE for iostat")
+
+
+def process_kube_top_np(out=None, host=None, dict={}):
+    Feild = ["HOST", 'Pod Name', 'Cpu(core)', 'Memory(Mib)']
+    if not 'kube_top' in dict.keys():
+        dict['kube_top'] = {}
+    if not os.path.isfile(out):
+        print("Nothing to do for kube top info")
+        return
+    print("Processing data for kubectl top")
+    with open(out, 'r') as fl:
+        text = fl.read()
+    # keep the leading digits of 250m / 1024Mi like the text parser does
+    rows = KUBE_TOP_RE.findall(text)
+    records = [line for line in text.splitlines() if line.startswith('{')]
+    if records:
+        rows = [row for row in rows if not row[0].startswith('{')] + kube_metrics_rows(records)
+    if not rows:
+        dict['kube_top'][host] = {'Feild': Feild, 'data': []}
+        return
+    values = np.array([(cpu, mem) for _, cpu, mem in rows], dtype=float)
+    uniq, stats = group_aggregate([pod for pod, _, _ in rows], values)
+    dict['kube_top'][host] = {'Feild': Feild, 'data': [
+        {'HOST': host, 'Pod Name': str(key), 'Cpu(core)': round(float(stats['mean'][i][0]), 3),
+         'Memory(Mib)': round(float(stats['mean'][i][1]), 3)} for i, key in enumerate(uniq)]}
+    dict.setdefault('kube_top_stats', {})[host] = {
+        'Feild': STATS_FEILD, 'data': stats_rows(host, uniq, stats, Feild[2:])}
+    print("Processing DONE for kubectl top")
+
+
+def process_docker_stat_np(out=None, host=None, dict={}):
+    feild = ["HOST", 'DockerName', '%Average_CPU', '%CPU_usage(min|Max)', '%Average_Memory', '%MemoryUsage(min|Max)',
+             'gb_block_read', 'gb_block_read(min|Max)', 'gb_block_wrt', 'gb_block_wrt(min|Max)']
+    if not 'docker_stat' in dict.keys():
+        dict['docker_stat'] = {}
+    if not os.path.isfile(out):
+        print("Nothing to do for docker stat info")
+        return
+    names = []
+    rows = []
+    with open(out, 'r') as fl:
+        for i in set(fl.readlines()):
+            if i.startswith('{'):
+                record = json.loads(i)
+                names.append(record['name'])
+                rows.append((record['cpu_pct'], record['mem_pct'], record['blk_read_bytes'] / (1024 * 1024 * 1024),
+                             record['blk_write_bytes'] / (1024 * 1024 * 1024)))
+                continue
+            l = i.split()
+            if "NAME" in l or len(l) < 13:
+                continue
+            names.append(l[1])
+            rows.append((float(l[2].split("%")[0]), float(l[6].split("%")[0]),
+                         convert_to_gb([l[10]])[0], convert_to_gb([l[12]])[0]))
+    if not rows:
+        dict['docker_stat'][host] = {'Feild': feild, 'data': []}
+        return
+    uniq, stats = group_aggregate(names, np.array(rows, dtype=float))
+    data = []
+    for i, key in enumerate(uniq):
+        mean, lo, hi = stats['mean'][i], stats['min'][i], stats['max'][i]
+        data.append({'HOST': host, 'DockerName': str(key), '%Average_CPU': mean[0],
+                     '%CPU_usage(min|Max)': f'{lo[0]}|{hi[0]}', '%Average_Memory': mean[1],
+                     '%MemoryUsage(min|Max)': f"{lo[1]}|{hi[1]}", 'gb_block_read': mean[2],
+                     'gb_block_read(min|Max)': f"{lo[2]}|{hi[2]}", 'gb_block_wrt': mean[3],
+                     'gb_block_wrt(min|Max)': f"{lo[3]}|{hi[3]}"})
+    dict['docker_stat'][host] = {'Feild': feild, 'data': data}
+    dict.setdefault('docker_stat_stats', {})[host] = {
+        'Feild': STATS_FEILD, 'data': stats_rows(host, uniq, stats, ['cpu_pct', 'mem_pct', 'gb_block_read', 'gb_block_wrt'])}
+
+
+def column_array(values):
+    """typed arrow array, float64 when every value is numeric else string."""
+    try:
+        return pa.array([None if v is None or v == "" else float(v) for v in values], type=pa.float64())
+    except (TypeError, ValueError):
+        return pa.array([None if v is None else str(v) for v in values], type=pa.string())
+
+
+def write_columnar(out_dict, out_dir, run_id, timestamp):
+    """write one parquet table per metric family as <out_dir>/<family>/<run_id>.parquet."""
+    if pa is None:
+        print("pyarrow is not installed, skip columnar output")
+        return []
+    written = []
+    for family, hosts in out_dict.items():
+        rows = [row for host in hosts for row in hosts[host]['data']]
+        if not rows:
+            continue
+        fields = hosts[next(iter(hosts))]['Feild']
+        columns = {'run_id': pa.array([run_id] * len(rows), type=pa.string()),
+                   'timestamp': pa.array([timestamp] * len(rows), type=pa.timestamp('s', tz='UTC'))}
+        for field in fields:
+            columns[field] = column_array([row.get(field) for row in rows])
+        path = os.path.join(out_dir, family, f"{run_id}.parquet")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        pq.write_table(pa.table(columns), path)
+        written.append(path)
+    print(f"Columnar report written to {out_dir}")
+    return written
+
+
+def host_parse_jobs(log_dir, host, engine="python"):
+    """(parser, absolute log path, host) of every metric log of host."""
+    numpy_engine = engine == "numpy"
+    host_dir = os.path.join(log_dir, host)
+    summary = os.path.join(host_dir, host + timeseries.SUMMARY_POST)
+    if os.path.isfile(summary):
+        # the node already folded the metrics, only its json logs are left to parse
+        parsers = [(process_dispatch_latency, "_predispatch_latency.log"),
+                   (process_dispatch_latency, "_postdispatch_latency.log"),
+                   (process_self_profile, "_self_profile.log")]
+        jobs = [(parser, os.path.join(host_dir, host + post), host) for parser, post in parsers]
+        jobs.append((process_summary, summary, host))
+        return jobs
+    parsers = [(process_cpu, "_cpu_info.log"),
+               (process_memory, "_memory_info.log"),
+               (process_network, "_network_info.log"),
+               (process_disk_io_all_part, "_disk_io_info.log"),
+               (process_diskIO_block, "_disk_block_info.log"),
+               (process_kube_top_np if numpy_engine else process_kube_top, "_kube_top_info.log"),
+               (process_iostat_np if numpy_engine else process_iostat, "_iostat_info.log"),
+               (process_docker_stat_np if numpy_engine else process_docker_stat, "_docker_stats.log"),
+               (process_dispatch_latency, "_predispatch_latency.log"),
+               (process_dispatch_latency, "_postdispatch_latency.log"),
+               (process_self_profile, "_self_profile.log")]
+    jobs = [(parser, os.path.join(host_dir, host + post), host) for parser, post in parsers]
+    jobs.append((process_timeseries, host_dir, host))
+    return jobs
+
+
+def parse_log(job):
+    """run one parser on its own and return its plain {metric: {host: ...}} records."""
+    parser, path, host = job
+    records = {}
+    parser(path, host, records)
+    return records
+
+
+def source_files(path, host):
+    """log files a parser job reads, the .ts files of host for a directory."""
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, f"{host}_*{timeseries.TS_POST}")))
+    return [path] if os.path.isfile(path) else []
+
+
+def content_digest(files):
+    digest = hashlib.blake2b(digest_size=16)
+    for path in files:
+        digest.update(os.path.basename(path).encode())
+        with open(path, 'rb') as fl:
+            for chunk in iter(lambda: fl.read(1024 * 1024), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_cache_entry(entry_path):
+    try:
+        with gzip.open(entry_path, 'rb') as fl:
+            return pickle.load(fl)
+    except (IOError, EOFError, pickle.UnpicklingError):
+        return None
+
+
+def save_cache_entry(entry_path, entry):
+    tmp_path = f"{entry_path}.{os.getpid()}"
+    with gzip.open(tmp_path, 'wb', compresslevel=1) as fl:
+        pickle.dump(entry, fl, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, entry_path)
+
+
+def parser_fingerprint(parser):
+    """digest of the source of parser, so an edited parser does not reuse old records."""
+    try:
+        source = inspect.getsource(parser).encode()
+    except (OSError, TypeError):
+        source = parser.__code__.co_code
+    return hashlib.sha1(source).hexdigest()[:16]
+
+
+def cached_parse_log(job, cache_dir):
+    """parse_log, reusing the records of a log whose content did not change.
+
+    A log with the same size and mtime is a hit without reading it, a log
+    re-fetched with the same content is a hit after hashing it.
+    """
+    parser, path, host = job
+    files = source_files(path, host)
+    signature = [(os.path.basename(f), st.st_size, st.st_mtime_ns) for f, st in ((f, os.stat(f)) for f in files)]
+    key = hashlib.sha1(f"{PARSE_CACHE_VERSION}:{parser.__name__}:{parser_fingerprint(parser)}:"
+                       f"{os.path.abspath(path)}".encode()).hexdigest()
+    entry_path = os.path.join(cache_dir, f"{key}.pkl.gz")
+    entry = load_cache_entry(entry_path)
+    if entry is not None and entry['signature'] == signature:
+        os.utime(entry_path)
+        return entry['records']
+    digest = content_digest(files)
+    if entry is not None and entry['digest'] == digest:
+        entry['signature'] = signature
+    else:
+        entry = {'signature': signature, 'digest': digest, 'records': parse_log(job)}
+    save_cache_entry(entry_path, entry)
+    return entry['records']
+
+
+def evict_parse_cache(cache_dir, max_age=PARSE_CACHE_MAX_AGE_SEC, max_bytes=PARSE_CACHE_MAX_BYTES):
+    """drop entries unused for max_age seconds, then the oldest over max_bytes."""
+    entries = []
+    now = time.time()
+    for path in glob.glob(os.path.join(cache_dir, "*.pkl.gz")):
+        st = os.stat(path)
+        if now - st.st_mtime > max_age:
+            os.remove(path)
+        else:
+            entries.append((st.st_mtime, st.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        os.remove(path)
+        total -= size
+
+
+def merge_records(out_dict, records):
+    for key, hosts in records.items():
+        out_dict.setdefault(key, {}).update(hosts)
+
+
+def load_clock_offsets(log_dir):
+    """{host: {"offset": node clock - controller clock, "rtt": seconds}} measured at launch."""
+    try:
+        with open(os.path.join(log_dir, CLOCK_OFFSETS_FILE), 'r') as fl:
+            return json.load(fl)
+    except (IOError, ValueError):
+        return {}
+
+
+def merge_timeseries(log_dir, hosts, step=1.0, offsets=None, out=None):
+    """resample the series of all hosts onto one grid of step seconds.
+
+    Sample times are moved onto the controller clock by the offset of
+    their node, every column is the mean of its samples in each step and
+    left empty for steps without any. Written as a wide csv, one row per
+    step and one column per host:metric[@key]:field.
+    """
+    offsets = offsets or {}
+    labels = []
+    bins = []
+    first = last = None
+    for host in hosts:
+        shift = offsets.get(host, {}).get("offset", 0.0)
+        for path in sorted(glob.glob(os.path.join(log_dir, host, f"{host}_*{timeseries.TS_POST}"))):
+            metric, key = timeseries.split_series_file(path, host)
+            columns, values = timeseries.read_series(path)
+            if not len(values["ts"]):
+                continue
+            steps = [int(math.floor((ts - shift) / step)) for ts in values["ts"]]
+            first = min(steps[0], first if first is not None else steps[0])
+            last = max(steps[-1], last if last is not None else steps[-1])
+            for column in columns[1:]:
+                acc = {}
+                for s, v in zip(steps, values[column]):
+                    total = acc.setdefault(s, [0.0, 0])
+                    total[0] += v
+                    total[1] += 1
+                labels.append("%s:%s%s:%s" % (host, metric, "@" + key if key else "", column))
+                bins.append(acc)
+    if not labels:
+        print("Nothing to do for time-series merge")
+        return 0
+    out = out or os.path.join(log_dir, MERGED_TIMESERIES_CSV)
+    with open(out, 'w', newline="") as fl:
+        writer = csv.writer(fl)
+        writer.writerow(["ts"] + labels)
+        for s in range(first, last + 1):
+            row = [round(s * step, 3)]
+            for acc in bins:
+                total = acc.get(s)
+                row.append(round(total[0] / total[1], 3) if total else "")
+            writer.writerow(row)
+    print("Merged %d series of %d hosts onto %d steps of %gs in %s" % (
+        len(labels), len(hosts), last - first + 1, step, out))
+    return last - first + 1
+
+
+def write_report_csv(out_dict, hosts, cvs_name, final_csv):
+    """append the report rows of out_dict to cvs_name, and each section to final_csv."""
+    #print(out_dict, type(out_dict), out_dict.keys(), out_dict['cpu']['data'])
     print(out_dict)
     print("Creating the CSV file")
     with open(cvs_name, 'a+', newline="") as fl:
@@ -330,3 +936,48 @@ def parsing_result(hostsStr):
                     spamwriter.writerow(','.join(row))
         except Exception as e:
             pass
+
+
+def parsing_result(hostsStr, engine="python", workers=0, run_id=None, columnar_dir=None, cache_dir=None,
+                   merge_step=None):
+    out_dict = {}
+    timestamp = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+    if run_id is None:
+        run_id = timestamp.strftime("%Y-%m-%d_%H-%M-%S")
+    if engine == "numpy" and np is None:
+        print("numpy is not installed, fall back to the python parsers")
+        engine = "python"
+    log_dir = os.getcwd()
+    hosts = hostsStr
+    cvs_name = f"{log_dir}/performance_report.csv"
+    final_csv = f"{log_dir}/final_performance_report.csv"
+    #hosts = ["vmdk"]
+
+    jobs = []
+    for host in hosts:
+        if os.path.isdir(os.path.join(log_dir, host)):
+            jobs.extend(host_parse_jobs(log_dir, host, engine))
+        else:
+            print(f"Directory {host} doesnot exists")
+    parse = parse_log
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        parse = partial(cached_parse_log, cache_dir=cache_dir)
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for records in executor.map(parse, jobs, chunksize=max(1, len(jobs) // (workers * 4))):
+                merge_records(out_dict, records)
+    else:
+        for job in jobs:
+            merge_records(out_dict, parse(job))
+    if cache_dir:
+        evict_parse_cache(cache_dir)
+
+    write_report_csv(out_dict, hosts, cvs_name, final_csv)
+
+    if columnar_dir:
+        write_columnar(out_dict, columnar_dir, run_id, timestamp)
+    if merge_step:
+        merge_timeseries(log_dir, [host for host in hosts if os.path.isdir(os.path.join(log_dir, host))],
+                         float(merge_step), load_clock_offsets(log_dir))
+    return out_dict
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020. Hitachi Vantara Corporation. All rights reserved.
+#
+# The copyright to the computer software herein is the property of
+# Hitachi Vantara Corporation. The software may be used and/or copied only
+# with the written permission of Hitachi Vantara Corporation or in accordance
+# with the terms and conditions stipulated in the agreement/contract
+# under which the software has been supplied.
+
+# Local store of parsed runs and cross-run comparison.
+#
+#   python3 run_history.py list
+#   python3 run_history.py compare <base_run_id> <run_id> [-t percent] [-a]
+#
+# Every report row of parsing_result is kept as (run, host, metric, item,
+# field, value), item being the device, interface, pod or container the
+# row is about.
+
+import datetime
+import getopt
+import sqlite3
+import sys
+
+RUN_HISTORY_DB = "run_history.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    ingested TEXT NOT NULL,
+    hosts TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS samples (
+    run_id TEXT NOT NULL,
+    host TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    item TEXT NOT NULL,
+    field TEXT NOT NULL,
+    value REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS samples_run ON samples (run_id, metric, field);
+CREATE INDEX IF NOT EXISTS samples_host ON samples (host, metric);
+CREATE INDEX IF NOT EXISTS samples_item ON samples (metric, item);
+"""
+
+# a rise of these is a regression
+LOWER_IS_BETTER = {'await', 'r_await', 'w_await', 'svctm', 'avgqu-sz', '%util', '%user', '%nice', '%system',
+                   '%iowait', '%steal', 'kbmemused', '%memused', 'kbcommit', '%commit', 'Cpu(core)',
+                   'Memory(Mib)', '%Average_CPU', '%Average_Memory', 'cpu_pct', 'mem_pct',
+                   'predispatch', 'postdispatch'}
+# a drop of these is a regression
+HIGHER_IS_BETTER = {'tps', 'rtps', 'wtps', 'bread/s', 'bwrtn/s', 'rd_sec/s', 'wr_sec/s', 'rxpck/s', 'txpck/s',
+                    'rxkB/s', 'txkB/s', 'MB_read/s', 'MB_wrtn/s', 'r/s', 'w/s', 'rMB/s', 'wMB/s', '%idle',
+                    'kbmemfree'}
+# columns naming what a row is about: cpu, interface, device, pod, container, ...
+ITEM_FIELDS = ('CPU', 'IFACE', 'DEV', 'Device', 'Pod Name', 'DockerName', 'MONITOR', 'PHASE',
+               'METRIC', 'KEY', 'FIELD')
+STAT_FIELDS = {'count', 'mean', 'min', 'max', 'p50', 'p90', 'p95', 'p99', 'p99.9'}
+
+
+def connect(db_path=RUN_HISTORY_DB):
+    conn = sqlite3.connect(db_path)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def as_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def row_samples(row):
+    """(item, field, value) of a report row, item made of its identifier columns."""
+    numbers = []
+    keys = []
+    for field, value in row.items():
+        if field == 'HOST':
+            continue
+        if field in ITEM_FIELDS:
+            if value != "" and value is not None:
+                keys.append(str(value))
+            continue
+        # text columns such as min|max spreads are not compared
+        number = as_number(value)
+        if number is not None:
+            numbers.append((field, number))
+    item = "/".join(keys)
+    return [(item, field, number) for field, number in numbers]
+
+
+def ingest_run(db_path, run_id, out_dict):
+    """store every report row of out_dict of parsing_result under run_id."""
+    conn = connect(db_path)
+    hosts = sorted({host for metric in out_dict.values() for host in metric})
+    with conn:
+        conn.execute("DELETE FROM samples WHERE run_id = ?", (run_id,))
+        conn.execute("INSERT OR REPLACE INTO runs VALUES (?, ?, ?)",
+                     (run_id, datetime.datetime.now().isoformat(timespec="seconds"), ",".join(hosts)))
+        conn.executemany("INSERT INTO samples VALUES (?, ?, ?, ?, ?, ?)", (
+            (run_id, host, metric, item, field, value)
+            for metric, per_host in out_dict.items()
+            for host, table in per_host.items()
+            for row in table['data']
+            for item, field, value in row_samples(row)))
+    conn.close()
+    print("run %s stored in %s" % (run_id, db_path))
+
+
+def direction(item, field):
+    """+1 if a rise of the value is a regression, -1 if a drop is, else 0."""
+    name = item.rsplit("/", 1)[-1] if field in STAT_FIELDS else field
+    if field == 'count':
+        return 0
+    if name in LOWER_IS_BETTER:
+        return 1
+    if name in HIGHER_IS_BETTER:
+        return -1
+    return 0
+
+
+def compare_runs(db_path, base, run, threshold=5.0):
+    """rows of (host, metric, item, field, base, run, change %, regression)."""
+    conn = connect(db_path)
+    rows = conn.execute("""
+        SELECT a.host, a.metric, a.item, a.field, a.value, b.value
+        FROM samples a JOIN samples b
+          ON a.host = b.host AND a.metric = b.metric AND a.item = b.item AND a.field = b.field
+        WHERE a.run_id = ? AND b.run_id = ?
+        ORDER BY a.metric, a.host, a.item, a.field""", (base, run)).fetchall()
+    conn.close()
+    result = []
+    for host, metric, item, field, old, new in rows:
+        if old == new:
+            change = 0.0
+        elif old == 0:
+            change = float("inf")
+        else:
+            change = 100.0 * (new - old) / abs(old)
+        regression = direction(item, field) * change > threshold
+        result.append((host, metric, item, field, old, new, change, regression))
+    return result
+
+
+def list_runs(db_path):
+    conn = connect(db_path)
+    rows = conn.execute("""
+        SELECT r.run_id, r.ingested, r.hosts, COUNT(s.run_id)
+        FROM runs r LEFT JOIN samples s ON r.run_id = s.run_id
+        GROUP BY r.run_id ORDER BY r.run_id""").fetchall()
+    conn.close()
+    return rows
+
+
+def usage():
+    print("run_history.py [-d db] list")
+    print("run_history.py [-d db] compare base_run_id run_id [-t threshold_percent] [-a]")
+
+
+def main(argv):
+    try:
+        opts, args = getopt.gnu_getopt(argv, "hd:t:a", ["db=", "threshold=", "all"])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+    db_path = RUN_HISTORY_DB
+    threshold = 5.0
+    show_all = False
+    for opt, arg in opts:
+        if opt == '-h':
+            usage()
+            return
+        elif opt in ("-d", "--db"):
+            db_path = arg
+        elif opt in ("-t", "--threshold"):
+            threshold = float(arg)
+        elif opt in ("-a", "--all"):
+            show_all = True
+
+    if args[:1] == ["list"]:
+        print("%-22s %-20s %8s  %s" % ("RUN", "INGESTED", "SAMPLES", "HOSTS"))
+        for run_id, ingested, hosts, count in list_runs(db_path):
+            print("%-22s %-20s %8d  %s" % (run_id, ingested, count, hosts))
+    elif args[:1] == ["compare"] and len(args) == 3:
+        rows = compare_runs(db_path, args[1], args[2], threshold)
+        print("%-18s %-16s %-30s %-16s %14s %14s %9s" % (
+            "METRIC", "HOST", "ITEM", "FIELD", args[1][:14], args[2][:14], "CHANGE%"))
+        regressions = 0
+        for host, metric, item, field, old, new, change, regression in rows:
+            regressions += regression
+            if show_all or regression:
+                print("%-18s %-16s %-30s %-16s %14.3f %14.3f %9.1f %s" % (
+                    metric, host, item[:30], field, old, new, change, "REGRESSION" if regression else ""))
+        print("%d regressions over %.1f%% in %d compared values" % (regressions, threshold, len(rows)))
+    else:
+        usage()
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,135 @@
+#
+# Copyright (c) 2020. Hitachi Vantara Corporation. All rights reserved.
+#
+# The copyright to the computer software herein is the property of
+# Hitachi Vantara Corporation. The software may be used and/or copied only
+# with the written permission of Hitachi Vantara Corporation or in accordance
+# with the terms and conditions stipulated in the agreement/contract
+# under which the software has been supplied.
+
+# couch_latency.py against a stand-in CouchDB serving one view over http.server.
+
+import base64
+import http.server
+import json
+import threading
+import urllib.parse
+
+import pytest
+
+import couch_latency
+import parse_output
+
+VIEW = "_design/latency/_view/postdispatch"
+# several documents share a key, so paging has to go on by doc id
+ROWS = sorted(({"id": "doc%04d" % i, "key": i // 3, "value": {"latency": 0.5 + i % 97}} for i in range(1000)),
+              key=lambda row: (row["key"], row["id"]))
+
+
+class CouchHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        self.server.requests.append(params)
+        if self.headers.get("Authorization") != self.server.auth:
+            return self.reply(401, {"error": "unauthorized"})
+        if url.path != "/dispatch/" + VIEW:
+            return self.reply(404, {"error": "not_found"})
+        rows = ROWS
+        if "startkey" in params:
+            start = (json.loads(params["startkey"]), params.get("startkey_docid", ""))
+            rows = [row for row in rows if (row["key"], row["id"]) >= start]
+        self.reply(200, {"total_rows": len(ROWS), "offset": len(ROWS) - len(rows),
+                         "rows": rows[:int(params.get("limit", len(rows)))]})
+
+    def reply(self, status, doc):
+        body = json.dumps(doc).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def couch():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), CouchHandler)
+    server.requests = []
+    server.auth = "Basic " + base64.b64encode(b"admin:secret").decode()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def client_of(server, password="secret"):
+    return couch_latency.CouchClient("127.0.0.1", server.server_address[1], password=password, timeout=5)
+
+
+def test_view_rows_are_paged_by_key_and_doc_id(couch):
+    client = client_of(couch)
+    try:
+        rows = list(couch_latency.iter_view_rows(client, "dispatch", VIEW, page_size=64))
+    finally:
+        client.close()
+    assert [row["id"] for row in rows] == [row["id"] for row in ROWS]
+    # 1000 rows in pages of 64 take 16 requests, none of them skips
+    assert len(couch.requests) == 16
+    assert all("skip" not in params and params["reduce"] == "false" for params in couch.requests)
+    assert all(params["limit"] == "65" for params in couch.requests)
+
+
+def test_histogram_summary_of_view(couch, tmp_path):
+    client = client_of(couch)
+    try:
+        histogram = couch_latency.collect_latency(client, "dispatch", VIEW, page_size=300)
+    finally:
+        client.close()
+    latencies = sorted(row["value"]["latency"] for row in ROWS)
+    summary = histogram.summary()
+    assert summary["count"] == len(ROWS)
+    assert summary["min"] == latencies[0]
+    assert summary["max"] == latencies[-1]
+    assert summary["mean"] == pytest.approx(sum(latencies) / len(latencies))
+    for q in couch_latency.PERCENTILES:
+        exact = latencies[int(len(latencies) * q / 100.0 + 0.999999) - 1]
+        assert summary["p%g" % q] == pytest.approx(exact, rel=2.0 ** -couch_latency.LatencyHistogram.SUB_BITS)
+
+    out = tmp_path / "node1_postdispatch_latency.log"
+    assert couch_latency.write_latency(str(out), VIEW, histogram)
+    report = {}
+    parse_output.process_dispatch_latency(str(out), "node1", report)
+    row = report["postdispatch_latency"]["node1"]["data"][0]
+    assert row["count"] == len(ROWS) and row["max"] == latencies[-1]
+
+
+def test_raw_view_output_of_scripts_is_folded(couch, tmp_path):
+    client = client_of(couch)
+    try:
+        doc = client.get("/dispatch/" + VIEW)
+    finally:
+        client.close()
+    report = {}
+    for name, content in (("node1_postdispatch_latency.log", doc), ("node2_postdispatch_latency.log", doc["rows"])):
+        out = tmp_path / name
+        out.write_text(json.dumps(content))
+        parse_output.process_dispatch_latency(str(out), name.split("_")[0], report)
+    for host in ("node1", "node2"):
+        row = report["postdispatch_latency"][host]["data"][0]
+        assert row["count"] == len(ROWS)
+        assert row["min"] == 0.5 and row["max"] == 96.5
+
+
+def test_unauthorized_query_raises(couch):
+    client = client_of(couch, password="wrong")
+    try:
+        with pytest.raises(IOError):
+            list(couch_latency.iter_view_rows(client, "dispatch", VIEW))
+    finally:
+        client.close()
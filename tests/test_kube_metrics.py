@@ -0,0 +1,168 @@
+#
+# Copyright (c) 2020. Hitachi Vantara Corporation. All rights reserved.
+#
+# The copyright to the computer software herein is the property of
+# Hitachi Vantara Corporation. The software may be used and/or copied only
+# with the written permission of Hitachi Vantara Corporation or in accordance
+# with the terms and conditions stipulated in the agreement/contract
+# under which the software has been supplied.
+
+# kube_metrics.py and the kube_top monitor against a stub metrics API over http.server.
+
+import http.server
+import json
+import socket
+import threading
+import time
+from decimal import Decimal
+
+import pytest
+import yaml
+
+import collect_node
+import kube_metrics
+
+TOKEN = "stub-token"
+POD_METRICS = {"kind": "PodMetricsList", "items": [
+    {"metadata": {"name": "web-1", "namespace": "hiota"}, "timestamp": "2026-01-02T03:04:05Z", "window": "15s",
+     "containers": [{"name": "web", "usage": {"cpu": "250m", "memory": "2048Ki"}},
+                    {"name": "proxy", "usage": {"cpu": "1234567n", "memory": "1Mi"}}]},
+    {"metadata": {"name": "db-0", "namespace": "hiota"}, "timestamp": "2026-01-02T03:04:05Z", "window": "15s",
+     "containers": [{"name": "db", "usage": {"cpu": "1", "memory": "1Gi"}}]}]}
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        if self.headers.get("Authorization") != "Bearer " + TOKEN:
+            return self.reply(401, {"kind": "Status", "code": 401})
+        if self.server.status != 200 or self.path != "/apis/metrics.k8s.io/v1beta1/namespaces/hiota/pods":
+            return self.reply(self.server.status if self.server.status != 200 else 404,
+                              {"kind": "Status", "reason": "NotFound"})
+        self.reply(200, POD_METRICS)
+
+    def reply(self, status, doc):
+        body = json.dumps(doc).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def api():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), MetricsHandler)
+    server.paths = []
+    server.status = 200
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def write_kubeconfig(path, server):
+    cluster = {"insecure-skip-tls-verify": True}
+    if server:
+        cluster["server"] = server
+    path.write_text(yaml.safe_dump({
+        "apiVersion": "v1", "kind": "Config", "current-context": "stub",
+        "contexts": [{"name": "stub", "context": {"cluster": "stub", "user": "stub"}}],
+        "clusters": [{"name": "stub", "cluster": cluster}],
+        "users": [{"name": "stub", "user": {"token": TOKEN}}]}))
+    return str(path)
+
+
+def test_parse_quantity():
+    assert kube_metrics.parse_quantity("250m") == Decimal("0.25")
+    assert kube_metrics.parse_quantity("1234567n") == Decimal("0.001234567")
+    assert kube_metrics.parse_quantity("2048Ki") == 2 * 1024 * 1024
+    assert kube_metrics.parse_quantity("1e3") == 1000
+    with pytest.raises(ValueError):
+        kube_metrics.parse_quantity("12Q")
+
+
+def test_pod_metrics_of_kubeconfig_client(api, tmp_path):
+    kubeconfig = write_kubeconfig(tmp_path / "config", "http://127.0.0.1:%d" % api.server_address[1])
+    client = kube_metrics.load_client(kubeconfig)
+    try:
+        records = kube_metrics.container_records(client.pod_metrics("hiota"))
+        client.pod_metrics("hiota")
+    finally:
+        client.close()
+    assert len(api.paths) == 2
+    by_name = {record["container"]: record for record in records}
+    assert by_name["web"]["cpu_cores"] == 0.25 and by_name["web"]["memory_bytes"] == 2097152
+    assert by_name["proxy"]["cpu_cores"] == pytest.approx(0.001234567)
+    assert by_name["db"]["pod"] == "db-0" and by_name["db"]["memory_bytes"] == 2 ** 30
+    assert by_name["db"]["ts"] == kube_metrics.parse_timestamp("2026-01-02T03:04:05Z")
+
+
+def test_denied_query_raises(api):
+    client = kube_metrics.KubeMetricsClient("http://127.0.0.1:%d" % api.server_address[1], token="wrong")
+    try:
+        with pytest.raises(IOError):
+            client.pod_metrics("hiota")
+    finally:
+        client.close()
+
+
+def test_kubeconfig_without_server(tmp_path):
+    with pytest.raises(ValueError):
+        kube_metrics.load_client(write_kubeconfig(tmp_path / "config", None))
+
+
+def test_kube_top_falls_back_to_kubectl(api, tmp_path, monkeypatch):
+    api.status = 404
+    kubectl = []
+
+    def run_command(cmd):
+        kubectl.append(cmd)
+        return "NAME CPU(cores) MEMORY(bytes)\nweb-1 250m 2Mi"
+
+    interval = 0.05
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(collect_node, "run_command", run_command)
+    monkeypatch.setattr(collect_node, "hostname", "node1")
+    monkeypatch.setattr(collect_node, "config", {
+        "FILE_POST_KUBE_TOP_INFO": "_kube_top_info.log", "KUBE_METRICS": "api", "KUBE_NAMESPACE": "hiota",
+        "KUBECONFIG": write_kubeconfig(tmp_path / "config", "http://127.0.0.1:%d" % api.server_address[1]),
+        "KUBE_API_MAX_FAILURES": 3})
+    monkeypatch.setattr(collect_node, "stop_event", threading.Event())
+    monkeypatch.setattr(collect_node, "run_origin", time.time())
+    monkeypatch.setattr(collect_node, "run_deadline", collect_node.run_origin + 8 * interval)
+    collect_node.monitor_kube_top(interval)
+
+    assert len(api.paths) == 3
+    assert kubectl and all(cmd == "kubectl top pods -n hiota" for cmd in kubectl)
+    with open("node1_kube_top_info.log") as fl:
+        assert "web-1 250m 2Mi" in fl.read()
+
+
+def test_malformed_response_raises_ioerror():
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(4)
+
+    def garbage():
+        for _ in range(2):
+            conn, _ = server.accept()
+            conn.recv(4096)
+            conn.sendall(b"garbage\r\n\r\n")
+            conn.close()
+
+    thread = threading.Thread(target=garbage, daemon=True)
+    thread.start()
+    client = kube_metrics.KubeMetricsClient("http://127.0.0.1:%d" % server.getsockname()[1], token=TOKEN)
+    try:
+        with pytest.raises(IOError):
+            client.pod_metrics("hiota")
+    finally:
+        client.close()
+        server.close()
@@ -0,0 +1,51 @@
+#
+# Copyright (c) 2020. Hitachi Vantara Corporation. All rights reserved.
+#
+# The copyright to the computer software herein is the property of
+# Hitachi Vantara Corporation. The software may be used and/or copied only
+# with the written permission of Hitachi Vantara Corporation or in accordance
+# with the terms and conditions stipulated in the agreement/contract
+# under which the software has been supplied.
+
+# report sections parse_output.py makes of a run summary.
+
+import pytest
+
+import parse_output
+import timeseries
+
+SAR_D_OLD = ["tps", "rd_sec/s", "wr_sec/s", "avgrq-sz", "avgqu-sz", "await", "svctm", "%util"]
+SAR_D_NEW = ["tps", "rkB/s", "wkB/s", "dkB/s", "areq-sz", "aqu-sz", "await", "%util"]
+IOSTAT_NEW = ["r/s", "rMB/s", "rrqm/s", "%rrqm", "r_await", "rareq-sz", "w/s", "wMB/s", "wrqm/s", "%wrqm",
+              "w_await", "wareq-sz", "aqu-sz", "%util"]
+
+
+def summary_report(tmp_path, samples):
+    summary = timeseries.RunSummary()
+    for metric, key, columns, values in samples:
+        for ts in range(3):
+            summary.append(metric, key, columns, float(ts), values)
+    path = str(tmp_path / "node1_summary.bin")
+    summary.write(path)
+    report = {}
+    parse_output.process_summary(path, "node1", report)
+    return report
+
+
+def test_sar_disk_columns_of_either_sysstat(tmp_path):
+    old = summary_report(tmp_path, [("disk_io_all_part", "sda", SAR_D_OLD, [10, 8, 4, 16, 1.5, 2, 0.5, 30])])
+    new = summary_report(tmp_path, [("disk_io_all_part", "sda", SAR_D_NEW, [10, 4, 2, 0, 8, 1.5, 2, 30])])
+    old_row = old['disk_io_all_part']['node1']['data'][0]
+    new_row = new['disk_io_all_part']['node1']['data'][0]
+    for column in ('tps', 'rd_sec/s', 'wr_sec/s', 'avgrq-sz', 'avgqu-sz', 'await', '%util'):
+        assert new_row[column] == pytest.approx(old_row[column])
+    assert new_row['svctm'] == ''
+
+
+def test_iostat_await_of_read_and_write_awaits(tmp_path):
+    values = [30, 1.5, 0, 0, 2.0, 51, 10, 0.5, 0, 0, 6.0, 51, 0.3, 40]
+    row = summary_report(tmp_path, [("iostat", "sda", IOSTAT_NEW, values)])['iostat']['node1']['data'][0]
+    assert row['tps'] == 40
+    assert row['MB_read/s'] == 1.5 and row['MB_wrtn/s'] == 0.5
+    assert row['await'] == pytest.approx((2.0 * 30 + 6.0 * 10) / 40)
+    assert row['%util'] == 40
@@ -0,0 +1,57 @@
+#
+# Copyright (c) 2020. Hitachi Vantara Corporation. All rights reserved.
+#
+# The copyright to the computer software herein is the property of
+# Hitachi Vantara Corporation. The software may be used and/or copied only
+# with the written permission of Hitachi Vantara Corporation or in accordance
+# with the terms and conditions stipulated in the agreement/contract
+# under which the software has been supplied.
+
+# sample rings and frames of timeseries.py.
+
+import pytest
+
+import timeseries
+
+
+def drain(ring):
+    frames, lost = ring.drain()
+    return timeseries.FrameReader().feed(frames), lost
+
+
+def test_ring_keeps_series_apart_past_256_keys():
+    ring = timeseries.SampleRing(1024)
+    try:
+        for i in range(300):
+            ring.append("network", "cali%03d" % i, ["rxkB/s"], 1.0, [i])
+        ring.append("network", "cali000", ["rxkB/s"], 2.0, [1000])
+        samples, lost = drain(ring)
+    finally:
+        ring.close()
+    assert lost == 0
+    assert [(key, ts, values) for _, key, _, ts, values in samples[-1:]] == [("cali000", 2.0, (1000.0,))]
+    assert all(key == "cali%03d" % values[0] for _, key, _, ts, values in samples[:300])
+
+
+def test_pipe_stream_ids_do_not_wrap():
+    writer = timeseries.FrameWriter(None)
+    writer.pid = 4321
+    ids = [writer.stream_id(i) for i in range(1000)]
+    assert len(set(ids)) == 1000
+    with pytest.raises(ValueError):
+        writer.stream_id(1 << writer.STREAM_BITS)
+
+
+def test_oversized_frames_are_counted_lost():
+    ring = timeseries.SampleRing(16)
+    try:
+        ring.append("docker_stat", "c" * 600, ["cpu_pct"], 1.0, [1])
+        ring.append("docker_stat", "c" * 600, ["cpu_pct"], 2.0, [2])
+        ring.append("iostat", "sda", ["c%d" % i for i in range(70)], 1.0, list(range(70)))
+        ring.append("cpu", "", ["%idle"], 1.0, [50])
+        samples, lost = drain(ring)
+    finally:
+        ring.close()
+    # the long schema and both samples of its series, and the wide sample
+    assert lost == 4
+    assert [(metric, values) for metric, _, _, _, values in samples] == [("cpu", (50.0,))]
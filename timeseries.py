@@ -0,0 +1,493 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2020. Hitachi Vantara Corporation. All rights reserved.
+#
+# The copyright to the computer software herein is the property of
+# Hitachi Vantara Corporation. The software may be used and/or copied only
+# with the written permission of Hitachi Vantara Corporation or in accordance
+# with the terms and conditions stipulated in the agreement/contract
+# under which the software has been supplied.
+
+# Append-only columnar time-series files.
+#
+# A series file starts with one text line "TS1 <column>,<column>,...\n"
+# followed by rows of little-endian float64 values, one per column. The
+# first column is always the epoch time of the sample. Files are named
+# <host>_<metric>.ts, or <host>_<metric>@<key>.ts for per device/interface
+# series.
+#
+# The same samples can be streamed live as frames of a 8 byte header
+# "TF" <kind:u8> <stream:u32> <length:u16> and a payload. A schema frame
+# names a stream "<metric>\t<key>\t<column>,<column>,..." once, every
+# sample frame of it then carries little-endian float64 ts and values.
+#
+# A run summary <host>_summary.bin folds every sample of a run into one
+# fixed-width row per (metric, key, column): a header "TSUM" <version:u16>
+# <flags:u16> <created:f64> <strings:u32> <rows:u32>, a table of u16
+# length prefixed utf-8 strings, then the rows, each followed by the
+# (bucket:u32, count:u32) pairs of its histogram.
+
+import array
+import mmap
+import os
+import struct
+import sys
+import time
+
+TS_MAGIC = "TS1"
+TS_POST = ".ts"
+FRAME = struct.Struct("<2sBIH")
+FRAME_MAGIC = b"TF"
+FRAME_SCHEMA = 0
+FRAME_SAMPLE = 1
+RING_SLOTS = 4096
+SUMMARY_POST = "_summary.bin"
+SUMMARY_MAGIC = b"TSUM"
+SUMMARY_VERSION = 1
+SUMMARY_HISTOGRAMS = 1
+SUMMARY_HEADER = struct.Struct("<4sHHdII")
+SUMMARY_ROW = struct.Struct("<HHHQdddddI")
+SUMMARY_BIN = struct.Struct("<II")
+# column, metric, field, how the values of the keys of the metric are folded
+HEADLINES = [("CPU_IDLE%", "cpu", "%idle", "mean"),
+             ("MEM_USED%", "memory", "%memused", "mean"),
+             ("UTIL%_MAX", "iostat", "%util", "max"),
+             ("RX_kB/s", "network", "rxkB/s", "sum"),
+             ("TX_kB/s", "network", "txkB/s", "sum"),
+             ("CTR_CPU%", "docker_stat", "cpu_pct", "sum")]
+
+
+def series_file(host, metric, key=""):
+    if key:
+        return "%s_%s@%s%s" % (host, metric, key, TS_POST)
+    return "%s_%s%s" % (host, metric, TS_POST)
+
+
+def split_series_file(filename, host):
+    """return (metric, key) of series file name of host."""
+    name = os.path.basename(filename)[len(host) + 1:-len(TS_POST)]
+    metric, _, key = name.partition("@")
+    return metric, key
+
+
+class TimeSeriesWriter(object):
+    """append float64 sample rows to a series file as they are sampled."""
+
+    def __init__(self, path, columns):
+        self.columns = ["ts"] + list(columns)
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.fl = open(path, "ab")
+        if new:
+            self.fl.write(("%s %s\n" % (TS_MAGIC, ",".join(self.columns))).encode())
+            self.fl.flush()
+
+    def append(self, ts, values):
+        row = array.array("d", [ts])
+        row.extend(float(v) for v in values)
+        if sys.byteorder != "little":
+            row.byteswap()
+        row.tofile(self.fl)
+        self.fl.flush()
+
+    def close(self):
+        self.fl.close()
+
+
+class FrameWriter(object):
+    """stream samples as frames to a pipe, such as the stdout of an ssh channel.
+
+    Every frame goes out in one write well below PIPE_BUF, so the monitor
+    processes of a collector can share the pipe without interleaving. The
+    stream ids of a process carry its pid in their top bits.
+    """
+
+    STREAM_BITS = 20
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.pid = None
+        self.streams = {}
+
+    def write(self, kind, stream, payload):
+        if self.fd is None:
+            return False
+        try:
+            os.write(self.fd, FRAME.pack(FRAME_MAGIC, kind, stream, len(payload)) + payload)
+        except OSError:
+            # nobody is reading any more, keep sampling to the files
+            self.fd = None
+            return False
+        return True
+
+    def write_schema(self, stream, metric, key, columns):
+        return self.write(FRAME_SCHEMA, stream, ("%s\t%s\t%s" % (metric, key, ",".join(columns))).encode())
+
+    def stale_schema(self, stream):
+        """whether the reader may have missed the schema of stream."""
+        return False
+
+    def stream_id(self, index):
+        """id of the index-th stream of this writer, never reused."""
+        if index >> self.STREAM_BITS:
+            raise ValueError("more than %d series in one frame writer" % (1 << self.STREAM_BITS))
+        return (self.pid << self.STREAM_BITS | index) & 0xffffffff
+
+    def append(self, metric, key, columns, ts, values):
+        if self.pid != os.getpid():
+            # stream ids are unique per process, a forked monitor starts afresh
+            self.pid = os.getpid()
+            self.streams = {}
+        stream = self.streams.get((metric, key))
+        if stream is None:
+            stream = self.stream_id(len(self.streams))
+            self.streams[(metric, key)] = stream
+            self.write_schema(stream, metric, key, columns)
+        elif self.stale_schema(stream):
+            self.write_schema(stream, metric, key, columns)
+        values = [float(v) for v in values]
+        self.write(FRAME_SAMPLE, stream, struct.pack("<%dd" % (len(values) + 1), ts, *values))
+
+
+class SampleRing(FrameWriter):
+    """frames of one monitor in a ring of fixed size slots, drained by one reader.
+
+    The ring is an anonymous shared mapping created before the monitor is
+    forked. The monitor is its only writer and never waits: it clears the
+    sequence of a slot, fills it, then publishes the new sequence and the
+    write count. The reader copies a slot and keeps it only if its sequence
+    is the expected one before and after the copy, so slots overwritten by
+    a writer that lapped it are counted as lost instead of read torn.
+
+    A frame too large for a slot is dropped and counted in the header, the
+    reader adds it to the lost ones. A series whose schema does not fit is
+    dropped as a whole, its samples counted likewise.
+    """
+
+    HEADER = struct.Struct("<QQ")
+    SLOT = struct.Struct("<QH")
+    SLOT_SIZE = 512
+    # the ring has one writer, every id of the frame field is its own
+    STREAM_BITS = 32
+
+    def __init__(self, slots=RING_SLOTS):
+        FrameWriter.__init__(self, None)
+        self.slots = slots
+        self.buf = mmap.mmap(-1, self.HEADER.size + slots * self.SLOT_SIZE)
+        self.written = 0
+        self.dropped = 0
+        self.read = 0
+        self.dropped_read = 0
+        self.schema_at = {}
+        self.rejected = set()
+
+    def stream_id(self, index):
+        if index >> self.STREAM_BITS:
+            raise ValueError("more than %d series in one sample ring" % (1 << self.STREAM_BITS))
+        return index
+
+    def write_schema(self, stream, metric, key, columns):
+        if not FrameWriter.write_schema(self, stream, metric, key, columns):
+            if stream not in self.rejected:
+                self.rejected.add(stream)
+                print("schema of %s %s is too long for a ring slot, the series is dropped" % (metric, key))
+        self.schema_at[stream] = self.written
+
+    def stale_schema(self, stream):
+        # a schema one lap old may be overwritten before it is read, repeat it
+        return self.written - self.schema_at[stream] >= self.slots
+
+    def offset(self, seq):
+        return self.HEADER.size + (seq % self.slots) * self.SLOT_SIZE
+
+    def write(self, kind, stream, payload):
+        """put one frame in the next slot, False if it is dropped."""
+        frame = FRAME.pack(FRAME_MAGIC, kind, stream, len(payload)) + payload
+        if stream in self.rejected or len(frame) > self.SLOT_SIZE - self.SLOT.size:
+            if kind == FRAME_SAMPLE and stream not in self.rejected:
+                print("sample frame of %d bytes is too long for a ring slot, dropped" % len(frame))
+            self.dropped += 1
+            self.HEADER.pack_into(self.buf, 0, self.written, self.dropped)
+            return False
+        offset = self.offset(self.written)
+        self.SLOT.pack_into(self.buf, offset, 0, 0)
+        self.buf[offset + self.SLOT.size:offset + self.SLOT.size + len(frame)] = frame
+        self.written += 1
+        self.SLOT.pack_into(self.buf, offset, self.written, len(frame))
+        self.HEADER.pack_into(self.buf, 0, self.written, self.dropped)
+        return True
+
+    def drain(self):
+        """(frames written since the last drain, number of them lost to overrun or dropped)."""
+        written, dropped = self.HEADER.unpack_from(self.buf, 0)
+        lost = dropped - self.dropped_read
+        self.dropped_read = dropped
+        if written - self.read > self.slots:
+            lost = written - self.slots - self.read
+            self.read = written - self.slots
+        frames = []
+        while self.read < written:
+            offset = self.offset(self.read)
+            seq, length = self.SLOT.unpack_from(self.buf, offset)
+            frame = self.buf[offset + self.SLOT.size:offset + self.SLOT.size + length]
+            self.read += 1
+            if seq == self.read and self.SLOT.unpack_from(self.buf, offset)[0] == seq:
+                frames.append(frame)
+            else:
+                lost += 1
+        return b"".join(frames), lost
+
+    def close(self):
+        self.buf.close()
+
+
+def fold_headlines(values):
+    """[(column, value or None)] of HEADLINES from {(metric, key): {field: value}}."""
+    result = []
+    for name, metric, field, how in HEADLINES:
+        found = [row[field] for (m, key), row in values.items() if m == metric and field in row]
+        if not found:
+            result.append((name, None))
+        elif how == "max":
+            result.append((name, max(found)))
+        elif how == "sum":
+            result.append((name, sum(found)))
+        else:
+            result.append((name, sum(found) / len(found)))
+    return result
+
+
+class ColumnSummary(object):
+    """count, sum, min, max, time span and histogram of the values of one column.
+
+    The histogram is log-linear over thousandths of the value with
+    2**SUB_BITS buckets per power of two, so percentiles are known within
+    1/2**SUB_BITS of themselves whatever the unit of the column.
+    """
+
+    SUB_BITS = 7
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = 0.0
+        self.max = 0.0
+        self.first = 0.0
+        self.last = 0.0
+        self.bins = {}
+
+    def bucket(self, value):
+        value = int(round(max(0.0, value) * 1000))
+        shift = max(0, value.bit_length() - self.SUB_BITS)
+        return shift << self.SUB_BITS | value >> shift
+
+    def bucket_value(self, index):
+        shift = index >> self.SUB_BITS
+        low = (index & ((1 << self.SUB_BITS) - 1)) << shift
+        return (low + ((1 << shift) - 1) / 2.0) / 1000.0
+
+    def add(self, ts, value, histogram=True):
+        if value != value:
+            return
+        if self.count:
+            self.min = min(self.min, value)
+            self.max = max(self.max, value)
+            self.last = max(self.last, ts)
+        else:
+            self.min = self.max = value
+            self.first = self.last = ts
+        self.count += 1
+        self.total += value
+        if histogram:
+            index = self.bucket(value)
+            self.bins[index] = self.bins.get(index, 0) + 1
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, q):
+        """value below which q percent of the values are, the mean without histogram."""
+        if not self.bins:
+            return self.mean()
+        rank = max(1, -(-sum(self.bins.values()) * q // 100))
+        seen = 0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen >= rank:
+                return min(max(self.bucket_value(index), self.min), self.max)
+        return self.max
+
+
+class RunSummary(object):
+    """fold the samples of a host into ColumnSummary rows and write them as one file."""
+
+    def __init__(self, histograms=True):
+        self.histograms = histograms
+        self.columns = {}
+
+    def append(self, metric, key, columns, ts, values):
+        for column, value in zip(columns, values):
+            summary = self.columns.get((metric, key, column))
+            if summary is None:
+                summary = self.columns[(metric, key, column)] = ColumnSummary()
+            try:
+                summary.add(ts, float(value), self.histograms)
+            except ValueError:
+                continue
+
+    def write(self, path, created=None):
+        strings = {}
+
+        def index(text):
+            return strings.setdefault(text, len(strings))
+
+        rows = []
+        for (metric, key, column), s in sorted(self.columns.items()):
+            if not s.count:
+                continue
+            bins = sorted(s.bins.items())
+            rows.append(SUMMARY_ROW.pack(index(metric), index(key), index(column), s.count, s.total,
+                                         s.min, s.max, s.first, s.last, len(bins)) +
+                        b"".join(SUMMARY_BIN.pack(b, c) for b, c in bins))
+        table = b"".join(struct.pack("<H", len(text)) + text
+                         for text in (name.encode() for name in strings))
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as fl:
+            fl.write(SUMMARY_HEADER.pack(SUMMARY_MAGIC, SUMMARY_VERSION,
+                                         SUMMARY_HISTOGRAMS if self.histograms else 0,
+                                         created or time.time(), len(strings), len(rows)))
+            fl.write(table)
+            fl.write(b"".join(rows))
+        os.rename(tmp, path)
+
+
+def read_summary(path):
+    """return (created, {(metric, key, column): ColumnSummary}) of a run summary file."""
+    with open(path, "rb") as fl:
+        data = fl.read()
+    if len(data) < SUMMARY_HEADER.size:
+        raise ValueError("%s is not a run summary file" % path)
+    magic, version, flags, created, n_strings, n_rows = SUMMARY_HEADER.unpack_from(data, 0)
+    if magic != SUMMARY_MAGIC:
+        raise ValueError("%s is not a run summary file" % path)
+    if version > SUMMARY_VERSION:
+        raise ValueError("%s is a version %d run summary, %d is supported" % (path, version, SUMMARY_VERSION))
+    pos = SUMMARY_HEADER.size
+    strings = []
+    for _ in range(n_strings):
+        length = struct.unpack_from("<H", data, pos)[0]
+        strings.append(data[pos + 2:pos + 2 + length].decode())
+        pos += 2 + length
+    columns = {}
+    for _ in range(n_rows):
+        metric, key, column, count, total, lo, hi, first, last, n_bins = SUMMARY_ROW.unpack_from(data, pos)
+        pos += SUMMARY_ROW.size
+        s = ColumnSummary()
+        s.count, s.total, s.min, s.max, s.first, s.last = count, total, lo, hi, first, last
+        s.bins = dict(SUMMARY_BIN.iter_unpack(data[pos:pos + n_bins * SUMMARY_BIN.size]))
+        pos += n_bins * SUMMARY_BIN.size
+        columns[(strings[metric], strings[key], strings[column])] = s
+    return created, columns
+
+
+class FrameReader(object):
+    """decode frames of a byte stream fed in chunks of any size."""
+
+    def __init__(self):
+        self.buf = b""
+        self.streams = {}
+
+    def feed(self, data):
+        """return the (metric, key, columns, ts, values) samples completed by data."""
+        buf = self.buf + data
+        pos = 0
+        samples = []
+        while len(buf) - pos >= FRAME.size:
+            magic, kind, stream, length = FRAME.unpack_from(buf, pos)
+            if magic != FRAME_MAGIC or kind not in (FRAME_SCHEMA, FRAME_SAMPLE):
+                # skip stray output up to the next frame
+                found = buf.find(FRAME_MAGIC, pos + 1)
+                pos = found if found >= 0 else len(buf) - 1
+                continue
+            end = pos + FRAME.size + length
+            if end > len(buf):
+                break
+            payload = buf[pos + FRAME.size:end]
+            pos = end
+            if kind == FRAME_SCHEMA:
+                metric, key, columns = payload.decode().split("\t")
+                self.streams[stream] = (metric, key, columns.split(","))
+            elif stream in self.streams and length % 8 == 0:
+                metric, key, columns = self.streams[stream]
+                row = struct.unpack("<%dd" % (length // 8), payload)
+                samples.append((metric, key, columns, row[0], row[1:]))
+        self.buf = buf[pos:]
+        return samples
+
+
+class SeriesSet(object):
+    """writers of one host, opened on first sample of each (metric, key).
+
+    Samples are also streamed to stream, a FrameWriter, when given; files
+    False streams them only.
+    """
+
+    def __init__(self, host, directory=".", files=True, stream=None):
+        self.host = host
+        self.directory = directory
+        self.files = files
+        self.stream = stream
+        self.writers = {}
+
+    def append(self, metric, key, columns, ts, values):
+        if self.stream is not None:
+            self.stream.append(metric, key, columns, ts, values)
+        if not self.files:
+            return
+        writer = self.writers.get((metric, key))
+        if writer is None:
+            path = os.path.join(self.directory, series_file(self.host, metric, key))
+            writer = TimeSeriesWriter(path, columns)
+            self.writers[(metric, key)] = writer
+        writer.append(ts, values)
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+        self.writers = {}
+
+
+def read_series(path):
+    """return (columns, {column: array('d')}) of a series file."""
+    with open(path, "rb") as fl:
+        header = fl.readline().decode().split()
+        if len(header) != 2 or header[0] != TS_MAGIC:
+            raise ValueError("%s is not a time-series file" % path)
+        columns = header[1].split(",")
+        data = array.array("d")
+        raw = fl.read()
+    # a collector killed mid-write may leave a partial row behind
+    row_size = data.itemsize * len(columns)
+    data.frombytes(raw[:len(raw) - len(raw) % row_size])
+    if sys.byteorder != "little":
+        data.byteswap()
+    return columns, {c: data[i::len(columns)] for i, c in enumerate(columns)}
+
+
+def percentile(sorted_values, q):
+    """linear interpolated percentile of sorted values, q in [0, 100]."""
+    if not sorted_values:
+        return 0.0
+    pos = (len(sorted_values) - 1) * q / 100.0
+    lo = int(pos)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (pos - lo)
+
+
+def summarize(values):
+    """count, mean, min, max, p50, p95 and p99 of sample values."""
+    values = sorted(values)
+    if not values:
+        return {"count": 0, "mean": 0.0, "min": 0.0, "max": 0.0, "p50": 0.0, "p95": 0.0, "p99": 0.0}
+    return {"count": len(values), "mean": sum(values) / len(values),
+            "min": values[0], "max": values[-1],
+            "p50": percentile(values, 50), "p95": percentile(values, 95), "p99": percentile(values, 99)}